@@ -0,0 +1,218 @@
+import os
+import heapq
+from collections import Counter, OrderedDict
+from metrics import register_collector
+
+# Analytics settings
+ANALYTICS_TOP_LIMIT = 50  # artists per time range (the most Spotify returns in one call)
+ANALYTICS_CACHE_USERS = int(os.environ.get("ANALYTICS_CACHE_USERS", "10000"))
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+
+stats = {"updates": 0, "recomputes": 0, "cache_hits": 0, "evictions": 0}
+
+def top_counts(counts, n):
+    """The n largest entries of a Counter, ties broken by key so results are stable"""
+    return heapq.nsmallest(n, counts.items(), key=lambda item: (-item[1], item[0]))
+
+class ArtistAggregate:
+    """
+    Genre counts for one ranked artist list (a user's top artists for a time range).
+    update() only touches the artists that entered or left the list.
+    """
+
+    def __init__(self):
+        self.artists = {}  # id -> {'name', 'genres', 'rank'}
+        self.genres = Counter()
+        self.version = 0
+        self._source = None
+        self._derived = {}
+
+    def update(self, artists):
+        """Apply a new ranked list of artists; returns True if anything changed"""
+        # The response cache hands back the same list until it refreshes
+        if artists is self._source:
+            return False
+        self._source = artists
+
+        incoming = {artist['id']: (rank, artist) for rank, artist in enumerate(artists)}
+        removed = self.artists.keys() - incoming.keys()
+        changed = bool(removed)
+
+        for artist_id in removed:
+            genres = self.artists.pop(artist_id)['genres']
+            self.genres.subtract(genres)
+            for genre in genres:
+                if self.genres[genre] <= 0:
+                    del self.genres[genre]
+
+        for artist_id, (rank, artist) in incoming.items():
+            current = self.artists.get(artist_id)
+            if current is None:
+                self.artists[artist_id] = {'name': artist['name'], 'genres': artist['genres'], 'rank': rank}
+                self.genres.update(artist['genres'])
+                changed = True
+            elif current['rank'] != rank:
+                current['rank'] = rank
+                changed = True
+
+        if changed:
+            self.version += 1
+        return changed
+
+    def derived(self, name, compute):
+        """Value of compute(self), cached until the artist list changes"""
+        cached = self._derived.get(name)
+        if cached is None or cached[0] != self.version:
+            cached = self._derived[name] = (self.version, compute(self))
+        return cached[1]
+
+    def ranked(self):
+        """Artist ids in rank order"""
+        return sorted(self.artists, key=lambda artist_id: self.artists[artist_id]['rank'])
+
+    def weight(self, artist_id):
+        """Rank weight in (0, 1]: 1 for the top artist, falling linearly down the list"""
+        artist = self.artists.get(artist_id)
+        if artist is None:
+            return 0.0
+        return 1 - artist['rank'] / len(self.artists)
+
+    def top_genres(self, n=5):
+        return [genre for genre, _ in top_counts(self.genres, n)]
+
+    def genre_distribution(self, n=10):
+        """Most common genres with the share of artists tagged with each"""
+        total = len(self.artists) or 1
+        return [
+            {'genre': genre, 'count': count, 'share': round(count / total, 4)}
+            for genre, count in top_counts(self.genres, n)
+        ]
+
+def compare_artist_trends(short, medium, long):
+    """New discoveries (only in the short-term list) and favorites present in all three lists"""
+    new_artists = []
+    consistent = []
+    for artist_id in short.ranked():
+        entry = {'id': artist_id, 'name': short.artists[artist_id]['name']}
+        in_medium = artist_id in medium.artists
+        in_long = artist_id in long.artists
+        if not in_medium and not in_long:
+            new_artists.append(entry)
+        elif in_medium and in_long:
+            consistent.append(entry)
+    return {
+        'new_discoveries': new_artists,
+        'consistent_favorites': consistent
+    }
+
+def artist_churn(newer, older):
+    """How much a newer top list differs from an older one"""
+    newer_ids = newer.artists.keys()
+    older_ids = older.artists.keys()
+    entered = newer_ids - older_ids
+    left = older_ids - newer_ids
+    total = len(newer_ids) + len(older_ids)
+    return {
+        'entered': len(entered),
+        'left': len(left),
+        'retained': len(newer_ids & older_ids),
+        'rate': round((len(entered) + len(left)) / total, 4) if total else 0.0
+    }
+
+def trend_scores(short, long, n=5):
+    """
+    Rising and falling artists: score = short-term rank weight - long-term rank weight,
+    so an artist new to the top of the short-term list scores close to 1
+    """
+    scores = Counter()
+    for artist_id in short.artists.keys() | long.artists.keys():
+        scores[artist_id] = round(short.weight(artist_id) - long.weight(artist_id), 4)
+
+    def describe(artist_id, score):
+        artist = short.artists.get(artist_id) or long.artists[artist_id]
+        return {'id': artist_id, 'name': artist['name'], 'score': score}
+
+    rising = [describe(artist_id, score) for artist_id, score in top_counts(scores, n) if score > 0]
+    falling = [
+        describe(artist_id, score)
+        for artist_id, score in heapq.nsmallest(n, scores.items(), key=lambda item: (item[1], item[0]))
+        if score < 0
+    ]
+    return {'rising': rising, 'falling': falling}
+
+def listening_genres(history_artists, aggregates, n=10):
+    """Genre play counts from ingested history, using genres known from the top artist lists"""
+    artist_genres = {}
+    for aggregate in aggregates:
+        for artist_id, artist in aggregate.artists.items():
+            artist_genres.setdefault(artist_id, artist['genres'])
+
+    counts = Counter()
+    for artist in history_artists:
+        for genre in artist_genres.get(artist['id'], ()):
+            counts[genre] += artist['plays']
+    total = sum(artist['plays'] for artist in history_artists) or 1
+    return [
+        {'genre': genre, 'plays': plays, 'share': round(plays / total, 4)}
+        for genre, plays in top_counts(counts, n)
+    ]
+
+class UserAnalytics:
+    """Per-user aggregates and the statistics derived from them, recomputed only when inputs change"""
+
+    def __init__(self):
+        self.ranges = {time_range: ArtistAggregate() for time_range in TIME_RANGES}
+        self.history = []
+        self._summary = None
+        self._summary_key = None
+
+    def update_range(self, time_range, artists):
+        stats["updates"] += 1
+        self.ranges[time_range].update(artists)
+
+    def update_history(self, history_artists):
+        self.history = history_artists
+
+    def summary(self):
+        short, medium, long = (self.ranges[time_range] for time_range in TIME_RANGES)
+        key = (short.version, medium.version, long.version, tuple((a['id'], a['plays']) for a in self.history))
+        if key == self._summary_key:
+            stats["cache_hits"] += 1
+            return self._summary
+
+        stats["recomputes"] += 1
+        self._summary = {
+            'short_term_genres': short.top_genres(),
+            'medium_term_genres': medium.top_genres(),
+            'long_term_genres': long.top_genres(),
+            'trend': compare_artist_trends(short, medium, long),
+            'analytics': {
+                'genre_distribution': {
+                    time_range: self.ranges[time_range].genre_distribution() for time_range in TIME_RANGES
+                },
+                'churn': {
+                    'short_vs_medium': artist_churn(short, medium),
+                    'medium_vs_long': artist_churn(medium, long)
+                },
+                'trend_scores': trend_scores(short, long),
+                'listening_genres': listening_genres(self.history, (short, medium, long))
+            }
+        }
+        self._summary_key = key
+        return self._summary
+
+_users = OrderedDict()
+
+def get_user_analytics(user_id):
+    """Return the user's analytics state, keeping the most recently used ANALYTICS_CACHE_USERS users"""
+    analytics = _users.get(user_id)
+    if analytics is None:
+        analytics = _users[user_id] = UserAnalytics()
+        if len(_users) > ANALYTICS_CACHE_USERS:
+            _users.popitem(last=False)
+            stats["evictions"] += 1
+    else:
+        _users.move_to_end(user_id)
+    return analytics
+
+register_collector(lambda: dict({f"analytics_{name}": value for name, value in stats.items()}, analytics_users=len(_users)))
@@ -1,129 +1,443 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
 import os
 import time
-import random
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from db import store_token, get_token, add_used_code, is_code_used, cleanup_old_codes, init_db
+import asyncio
+import logging
+import threading
+from typing import Optional
+from collections import OrderedDict
+from spotify_api import AsyncSpotify
+from metrics import counter, register_collector
+from db import (
+    store_token, get_token, claim_code, expire_used_codes, claim_expiring_tokens, disable_token_refresh,
+    create_session, get_session, delete_session, enroll_history_user
+)
+
+logger = logging.getLogger(__name__)
 
 # Create the router object
 router = APIRouter(
     tags=["authentication"]
 )
 
-# Initialize the database when the app starts
-init_db()
-
-# Set up Spotify OAuth
+# Set up Spotify OAuth (the schema is created by migrate.py or the startup hook, not on import)
 SPOTIFY_CLIENT_ID = os.environ.get("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIFY_CLIENT_SECRET")
 REDIRECT_URI = os.environ.get("REDIRECT_URI", "http://localhost:8000/callback")
+SPOTIFY_SCOPE = "user-top-read user-read-currently-playing playlist-modify-private playlist-read-private user-read-recently-played user-read-playback-state"
 
-sp_oauth = SpotifyOAuth(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET,
-    redirect_uri=REDIRECT_URI,
-    scope="user-top-read user-read-currently-playing playlist-modify-private playlist-read-private user-read-recently-played user-read-playback-state"
-)
+_sp_oauth = None
+
+def get_sp_oauth():
+    """Create the SpotifyOAuth helper on first use; spotipy is only imported when login or refresh needs it"""
+    global _sp_oauth
+    if _sp_oauth is None:
+        from spotipy.oauth2 import SpotifyOAuth
+        _sp_oauth = SpotifyOAuth(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            redirect_uri=REDIRECT_URI,
+            scope=SPOTIFY_SCOPE
+        )
+    return _sp_oauth
+
+# Session id -> (Spotify user id, valid until), so the hot path skips the sessions table.
+# Entries are re-checked against the database after SESSION_CACHE_TTL (so a logout on
+# another worker takes effect within that time) and never outlive the session itself.
+SESSION_CACHE_TTL = int(os.environ.get("SESSION_CACHE_TTL", "60"))  # seconds
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+_session_cache = OrderedDict()
+_session_cache_lock = threading.Lock()
+
+def _cache_session(session_id, user_id, expires_in):
+    with _session_cache_lock:
+        _session_cache[session_id] = (user_id, time.monotonic() + min(SESSION_CACHE_TTL, expires_in))
+        _session_cache.move_to_end(session_id)
+        while len(_session_cache) > SESSION_CACHE_SIZE:
+            _session_cache.popitem(last=False)
+
+def _cached_session_user(session_id):
+    with _session_cache_lock:
+        entry = _session_cache.get(session_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del _session_cache[session_id]
+            return None
+        _session_cache.move_to_end(session_id)
+        return entry[0]
+
+def _forget_session(session_id):
+    with _session_cache_lock:
+        _session_cache.pop(session_id, None)
+
+def get_session_id(request: Request) -> Optional[str]:
+    """Read the session id from the X-Session-Id header"""
+    return request.headers.get("X-Session-Id")
+
+def get_stream_session_id(request: Request) -> Optional[str]:
+    """
+    Session id for server-sent event routes: EventSource can't send headers, so ?session=
+    is accepted here (and only here, to keep session ids out of other URLs and access logs)
+    """
+    return request.headers.get("X-Session-Id") or request.query_params.get("session")
+
+async def _resolve_session(session_id):
+    if not session_id:
+        raise HTTPException(status_code=401, detail="No session. Please authenticate.")
+
+    user_id = _cached_session_user(session_id)
+    if user_id is None:
+        session = await run_in_threadpool(get_session, session_id)
+        if session is None:
+            raise HTTPException(status_code=401, detail="Session expired. Please log in again.")
+        user_id, expires_in = session
+        _cache_session(session_id, user_id, expires_in)
+    return user_id
+
+async def get_current_user(session_id: Optional[str] = Depends(get_session_id)) -> str:
+    """Resolve the Spotify user id for the caller's session"""
+    return await _resolve_session(session_id)
+
+async def get_stream_user(session_id: Optional[str] = Depends(get_stream_session_id)) -> str:
+    """Resolve the Spotify user id for a server-sent event stream"""
+    return await _resolve_session(session_id)
+
+# Used authorization codes. Spotify codes expire after 10 minutes, so a code
+# seen within USED_CODE_MEMORY_TTL is answered from memory; the used_codes
+# table catches replays across workers and keeps codes for USED_CODE_RETENTION.
+USED_CODE_MEMORY_TTL = int(os.environ.get("USED_CODE_MEMORY_TTL", "900"))  # seconds
+USED_CODE_RETENTION = int(os.environ.get("USED_CODE_RETENTION", "86400"))  # seconds
+USED_CODE_EXPIRY_INTERVAL = int(os.environ.get("USED_CODE_EXPIRY_INTERVAL", "600"))  # seconds between expiry runs
+USED_CODE_EXPIRY_BATCH = int(os.environ.get("USED_CODE_EXPIRY_BATCH", "1000"))  # rows deleted per statement
+
+_recent_codes = {}  # code -> expiry (monotonic); insertion order is expiry order
+_recent_codes_lock = threading.Lock()
+used_code_checks = counter("used_code_checks_total", "Authorization code checks by result")
+
+def _claim_code(code):
+    """True the first time an authorization code is seen by any worker"""
+    now = time.monotonic()
+    with _recent_codes_lock:
+        while _recent_codes:
+            oldest = next(iter(_recent_codes))
+            if _recent_codes[oldest] > now:
+                break
+            del _recent_codes[oldest]
+        if code in _recent_codes:
+            used_code_checks.inc(result="memory")
+            return False
+        # Claim in memory first so a concurrent callback in this process is rejected without the database
+        _recent_codes[code] = now + USED_CODE_MEMORY_TTL
+
+    try:
+        claimed = claim_code(code)
+    except Exception:
+        # Nothing was recorded, so let a retry of this callback claim the code again
+        with _recent_codes_lock:
+            _recent_codes.pop(code, None)
+        raise
+    used_code_checks.inc(result="claimed" if claimed else "database")
+    return claimed
+
+async def _expire_codes_loop():
+    """Delete expired used codes in batches every USED_CODE_EXPIRY_INTERVAL seconds"""
+    while True:
+        try:
+            # Small batches keep each delete short; keep going while batches come back full
+            deleted = USED_CODE_EXPIRY_BATCH
+            while deleted >= USED_CODE_EXPIRY_BATCH:
+                deleted = await run_in_threadpool(expire_used_codes, USED_CODE_RETENTION, USED_CODE_EXPIRY_BATCH)
+        except Exception as e:
+            logger.warning("Used code expiry failed: %s", e)
+        await asyncio.sleep(USED_CODE_EXPIRY_INTERVAL)
+
+_code_expiry = None
+
+def start_code_expiry():
+    """Start the used-code expiry task (called on app startup)"""
+    global _code_expiry
+    if _code_expiry is None:
+        _code_expiry = asyncio.ensure_future(_expire_codes_loop())
+
+async def stop_code_expiry():
+    """Stop the used-code expiry task (called on app shutdown)"""
+    global _code_expiry
+    if _code_expiry is not None:
+        _code_expiry.cancel()
+        await asyncio.gather(_code_expiry, return_exceptions=True)
+        _code_expiry = None
 
 # Login endpoint
 @router.get("/login")
 def login():
-    auth_url = sp_oauth.get_authorize_url()
+    auth_url = get_sp_oauth().get_authorize_url()
     return RedirectResponse(url=auth_url)
 
 @router.get("/callback")
 def callback(code: str, response: Response):
-    print("Received code:", code[:10] + "...")
+    logger.info("Received authorization code", extra={"code_prefix": code[:10]})
     
-    # Check if code was already used
-    if is_code_used(code):
-        print(f"Code {code[:10]}... was already used")
-        
-        # Get current token if it exists
-        token_info = get_token("current_token")
-        if token_info and "access_token" in token_info:
-            return JSONResponse({
-                "access_token": token_info["access_token"],
-                "token_type": "Bearer",
-                "expires_in": 3600,
-                "status": "reused_code_but_token_exists"
-            })
-        else:
-            return JSONResponse(status_code=400, content={"error": "Authorization code has already been used"})
+    # Mark the code as used; only the first callback with a code exchanges it
+    try:
+        claimed = _claim_code(code)
+    except Exception as e:
+        logger.error("Could not record authorization code: %s", e)
+        return JSONResponse(status_code=503, content={"error": "Could not verify the authorization code, please try again"})
+    if not claimed:
+        logger.warning("Authorization code was already used", extra={"code_prefix": code[:10]})
+        return JSONResponse(status_code=400, content={"error": "Authorization code has already been used"})
     
     try:
-        # Mark code as used
-        add_used_code(code)
-        
-        # Clean up old codes occasionally
-        if random.random() < 0.05:  # 5% chance to run cleanup
-            cleanup_old_codes()
-            
-        token_info = sp_oauth.get_access_token(code, check_cache=False)
+        token_info = get_sp_oauth().get_access_token(code, check_cache=False)
         
         if not token_info or "access_token" not in token_info:
             return JSONResponse(status_code=400, content={"error": "Token exchange failed"})
         
-        # Store token info
-        store_token("current_token", token_info)
+        # Store token info under the user's Spotify ID and start a session for them
+        import spotipy
+        profile = spotipy.Spotify(auth=token_info['access_token']).current_user()
+        user_id = profile['id']
+        save_token(user_id, token_info)
+        _cache_profile(user_id, profile)
+        session_id = create_session(user_id)
+        _cache_session(session_id, user_id, SESSION_CACHE_TTL)
+        enroll_history_user(user_id)
         
         # CHANGE THIS: Instead of returning JSON, redirect to the frontend with token
         frontend_url = os.environ.get("FRONTEND_URL", "https://rhythm-radar-spencer-kellys-projects.vercel.app")
-        redirect_url = f"{frontend_url}/callback?token={token_info['access_token']}&expires_in={token_info['expires_in']}"
+        redirect_url = f"{frontend_url}/callback?token={token_info['access_token']}&expires_in={token_info['expires_in']}&session={session_id}"
         
         return RedirectResponse(url=redirect_url)
         
     except Exception as e:
-        print(f"Error exchanging code for token: {str(e)}")
-        
-        # Check if we already have a valid token
-        token_info = get_token("current_token")
-        if token_info and "access_token" in token_info:
-            return JSONResponse({
-                "access_token": token_info["access_token"],
-                "token_type": "Bearer",
-                "status": "using_existing_token"
-            })
-        
+        logger.error("Error exchanging code for token: %s", e)
         return JSONResponse(status_code=400, content={"error": f"Token exchange failed: {str(e)}"})
 
-def get_spotify_client():
-    from spotipy import Spotify
-    
-    # Get token from database 
-    token_info = get_token("current_token")
-    
-    if not token_info:
-        print("No token found. User needs to authenticate.")
-        raise HTTPException(status_code=401, detail="No token found. Please authenticate.")
-    
-    # Check if token needs refresh
-    now = int(time.time())
-    expires_in = token_info.get('expires_at', 0) - now
-    is_token_expired = expires_in < 300  # 5 minutes buffer
-    
-    print(f"Token status: expires_in={expires_in} seconds, expired={is_token_expired}")
-    
-    if is_token_expired and 'refresh_token' in token_info:
+@router.post("/logout")
+def logout(session_id: Optional[str] = Depends(get_session_id)):
+    """End the caller's session"""
+    if session_id:
+        _forget_session(session_id)
+        delete_session(session_id)
+    return {"status": "logged_out"}
+
+# In-process token cache: user_id -> {"token_info": ..., "async_client": AsyncSpotify, "client": Spotify (added on first use)}
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+_refresh_locks = {}
+token_cache_lookups = counter("token_cache_lookups_total", "Token cache lookups by result")
+
+def _token_needs_refresh(token_info):
+    expires_in = token_info.get('expires_at', 0) - int(time.time())
+    return expires_in < 300  # 5 minutes buffer
+
+def _cache_token(user_id, token_info):
+    """Cache a token together with a long-lived Spotify client built from it"""
+    entry = {
+        "token_info": token_info,
+        "async_client": AsyncSpotify(token_info['access_token'], user_id=user_id),
+    }
+    with _token_cache_lock:
+        _token_cache[user_id] = entry
+    return entry
+
+def save_token(user_id, token_info):
+    """Write a token through to the database and the in-process cache"""
+    store_token(user_id, token_info)
+    return _cache_token(user_id, token_info)
+
+def invalidate_token(user_id):
+    """Drop a cached token so the next request reloads it from the database"""
+    with _token_cache_lock:
+        _token_cache.pop(user_id, None)
+
+def _get_refresh_lock(user_id):
+    with _token_cache_lock:
+        return _refresh_locks.setdefault(user_id, threading.Lock())
+
+def _refresh_token(user_id, entry):
+    """Refresh a token once, even if many requests notice the expiry at the same time"""
+    with _get_refresh_lock(user_id):
+        # Another request may have refreshed while we were waiting for the lock
+        current = _token_cache.get(user_id)
+        if current is not None and current is not entry and not _token_needs_refresh(current["token_info"]):
+            return current
+
+        # Another worker process may have already refreshed and stored a newer token
+        stored = get_token(user_id)
+        if stored and not _token_needs_refresh(stored):
+            return _cache_token(user_id, stored)
+
+        token_info = entry["token_info"]
+        if 'refresh_token' not in token_info:
+            return entry
+
+        expires_in = token_info.get('expires_at', 0) - int(time.time())
         try:
-            print(f"Attempting to refresh token which expires in {expires_in} seconds")
-            token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])
-            print("Token refresh successful")
-            store_token("current_token", token_info)
+            logger.info("Refreshing token", extra={"user_id": user_id, "expires_in": expires_in})
+            token_info = get_sp_oauth().refresh_access_token(token_info['refresh_token'])
+            logger.info("Token refresh successful", extra={"user_id": user_id})
         except Exception as e:
-            print(f"Error refreshing token: {type(e).__name__}: {e}")
+            logger.error("Error refreshing token: %s: %s", type(e).__name__, e, extra={"user_id": user_id})
+            invalidate_token(user_id)
             # Don't return JSONResponse here - raise an exception instead
             raise HTTPException(status_code=401, detail="Authentication expired, please log in again")
-    
-    return Spotify(auth=token_info['access_token'])
+        return save_token(user_id, token_info)
+
+def _get_token_entry(user_id):
+    """Return the cached token entry for a user, loading or refreshing it as needed"""
+    # Serve the hot path from the in-process cache
+    entry = _token_cache.get(user_id)
+    token_cache_lookups.inc(result="hit" if entry is not None else "miss")
+
+    if entry is None:
+        # Get token from database
+        token_info = get_token(user_id)
+
+        if not token_info:
+            logger.debug("No token found, user needs to authenticate", extra={"user_id": user_id})
+            raise HTTPException(status_code=401, detail="No token found. Please authenticate.")
+
+        entry = _cache_token(user_id, token_info)
+
+    # Check if token needs refresh
+    if _token_needs_refresh(entry["token_info"]):
+        entry = _refresh_token(user_id, entry)
+
+    return entry
+
+def get_spotify_client(user_id):
+    """Blocking spotipy client for a user, built the first time it's asked for"""
+    import spotipy
+    entry = _get_token_entry(user_id)
+    if "client" not in entry:
+        entry["client"] = spotipy.Spotify(auth=entry["token_info"]['access_token'])
+    return entry["client"]
+
+async def get_async_spotify_client(user_id):
+    """Async counterpart of get_spotify_client for the async routers"""
+    entry = _token_cache.get(user_id)
+    if entry is None or _token_needs_refresh(entry["token_info"]):
+        # Database reads and token refreshes block, so keep them off the event loop
+        # (_get_token_entry records the cache lookup itself)
+        entry = await run_in_threadpool(_get_token_entry, user_id)
+    else:
+        token_cache_lookups.inc(result="hit")
+    return entry["async_client"]
+
+# Background token refresh settings (seconds). TOKEN_REFRESH_AHEAD is longer than the
+# 5 minute request-path margin, so requests find an already refreshed token.
+TOKEN_REFRESH_AHEAD = int(os.environ.get("TOKEN_REFRESH_AHEAD", "600"))
+TOKEN_REFRESH_POLL_INTERVAL = float(os.environ.get("TOKEN_REFRESH_POLL_INTERVAL", "30"))
+TOKEN_REFRESH_BATCH_SIZE = int(os.environ.get("TOKEN_REFRESH_BATCH_SIZE", "50"))
+TOKEN_REFRESH_CONCURRENCY = int(os.environ.get("TOKEN_REFRESH_CONCURRENCY", "4"))
+TOKEN_REFRESH_LEASE_SECONDS = int(os.environ.get("TOKEN_REFRESH_LEASE_SECONDS", "120"))  # retry delay after a failure
+# Only users whose session was used this recently are kept refreshed; others refresh on their next request
+TOKEN_REFRESH_ACTIVE_WITHIN = int(os.environ.get("TOKEN_REFRESH_ACTIVE_WITHIN", "86400"))
+TOKEN_REFRESH_ENABLED = os.environ.get("TOKEN_REFRESH_ENABLED", "true").lower() == "true"
+
+refresher_stats = {"refreshed": 0, "errors": 0, "revoked": 0}
+register_collector(lambda: {f"token_refresher_{name}": value for name, value in refresher_stats.items()})
+
+_refresher = None
+
+def _refresh_leased_token(user_id, token_info):
+    """Refresh a token leased by the background refresher and store the new one"""
+    # Share the request path's lock so this process never refreshes a user twice at once
+    with _get_refresh_lock(user_id):
+        stored = get_token(user_id)
+        if stored and stored.get('expires_at', 0) > token_info.get('expires_at', 0):
+            # Refreshed by a request since the lease was taken (store_token ended the lease)
+            return
+        try:
+            new_token_info = get_sp_oauth().refresh_access_token(token_info['refresh_token'])
+        except Exception as e:
+            if getattr(e, 'error', None) == 'invalid_grant':
+                # Revoked or expired grant: the user has to log in again
+                refresher_stats["revoked"] += 1
+                disable_token_refresh(user_id)
+                invalidate_token(user_id)
+            raise
+        save_token(user_id, new_token_info)
+
+async def _refresh_user(user_id, token_info, semaphore):
+    async with semaphore:
+        try:
+            await run_in_threadpool(_refresh_leased_token, user_id, token_info)
+            refresher_stats["refreshed"] += 1
+        except Exception as e:
+            # The lease lapses after TOKEN_REFRESH_LEASE_SECONDS and the token is retried
+            logger.warning("Background token refresh failed: %s: %s", type(e).__name__, e, extra={"user_id": user_id})
+            refresher_stats["errors"] += 1
+
+async def _refresh_loop():
+    """Lease tokens nearing expiry and refresh them until cancelled"""
+    semaphore = asyncio.Semaphore(TOKEN_REFRESH_CONCURRENCY)
+    while True:
+        try:
+            due = await run_in_threadpool(
+                claim_expiring_tokens, TOKEN_REFRESH_AHEAD, TOKEN_REFRESH_BATCH_SIZE, TOKEN_REFRESH_LEASE_SECONDS,
+                TOKEN_REFRESH_ACTIVE_WITHIN
+            )
+        except Exception as e:
+            logger.warning("Token refresh claim failed: %s", e)
+            due = []
+
+        if due:
+            await asyncio.gather(
+                *(_refresh_user(user_id, token_info, semaphore) for user_id, token_info in due),
+                return_exceptions=True
+            )
+        if len(due) < TOKEN_REFRESH_BATCH_SIZE:
+            await asyncio.sleep(TOKEN_REFRESH_POLL_INTERVAL)
+
+def start_token_refresher():
+    """Start the background token refresher (called on app startup)"""
+    global _refresher
+    if TOKEN_REFRESH_ENABLED and _refresher is None:
+        _refresher = asyncio.ensure_future(_refresh_loop())
+
+async def stop_token_refresher():
+    """Stop the background token refresher (called on app shutdown); leased tokens are retried once the lease lapses"""
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        await asyncio.gather(_refresher, return_exceptions=True)
+        _refresher = None
+
+# User profile cache: user_id -> (profile, fetched_at), filled at login and refreshed lazily
+PROFILE_TTL = int(os.environ.get("PROFILE_TTL", "3600"))
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "10000"))
+_profile_cache = OrderedDict()
+_profile_cache_lock = threading.Lock()
+
+def _cache_profile(user_id, profile):
+    with _profile_cache_lock:
+        _profile_cache[user_id] = (profile, time.time())
+        _profile_cache.move_to_end(user_id)
+        while len(_profile_cache) > PROFILE_CACHE_SIZE:
+            _profile_cache.popitem(last=False)
+
+async def get_user_profile(sp):
+    """Return the Spotify profile for the client's user, calling /me only when the cache is stale"""
+    with _profile_cache_lock:
+        cached = _profile_cache.get(sp.user_id)
+        if cached is not None and time.time() - cached[1] < PROFILE_TTL:
+            _profile_cache.move_to_end(sp.user_id)
+            return cached[0]
+
+    profile = await sp.current_user()
+    _cache_profile(sp.user_id, profile)
+    return profile
 
 @router.get("/token-debug", include_in_schema=False)
-def token_debug():
+def token_debug(user_id: str = Depends(get_current_user)):
     """Debug endpoint to check token status"""
     try:
-        token_info = get_token("current_token")
+        token_info = get_token(user_id)
         
         if not token_info:
             return {"status": "No token found"}
@@ -0,0 +1,23 @@
+"""
+ASGI entry point for a baseline checkout of the app, used by run_scenarios --baseline.
+
+The pre-optimization app calls Spotify through spotipy, which always talks to
+api.spotify.com. This points every spotipy client at SPOTIFY_API_BASE (the
+mock) instead and lets raw ids contain "-", as the mock's playlist ids
+(bench-2000, ...) do, then loads the baseline's main module from the working
+directory, where run_scenarios has extracted the baseline Backend/.
+"""
+import os
+import spotipy
+
+SPOTIFY_API_BASE = os.environ["SPOTIFY_API_BASE"].rstrip("/") + "/"
+_spotify_init = spotipy.Spotify.__init__
+spotipy.Spotify._regex_base62 = r'^[0-9A-Za-z-]+$'
+
+def _init_against_mock(self, *args, **kwargs):
+    _spotify_init(self, *args, **kwargs)
+    self.prefix = SPOTIFY_API_BASE
+
+spotipy.Spotify.__init__ = _init_against_mock
+
+from main import app  # noqa: E402
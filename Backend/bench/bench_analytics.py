@@ -0,0 +1,123 @@
+"""
+Micro-benchmarks for the analytics module.
+
+Compares the old per-request list-based helpers from music_stats with the
+aggregate engine (full build, incremental update, cached summary) at
+50, 500 and 5000 artists per time range.
+
+Run from Backend/: python -m bench.bench_analytics
+"""
+import random
+import timeit
+import analytics
+from analytics import ArtistAggregate, UserAnalytics, compare_artist_trends, TIME_RANGES
+
+SIZES = (50, 500, 5000)
+GENRES = [f"genre {i}" for i in range(300)]
+
+def make_artists(n, offset=0, seed=0):
+    rng = random.Random(seed)
+    return [
+        {'id': f"artist{offset + i}", 'name': f"Artist {offset + i}", 'genres': rng.sample(GENRES, rng.randint(1, 4))}
+        for i in range(n)
+    ]
+
+# The list-based helpers music_stats used before the analytics module
+def legacy_extract_top_genres(artist_data):
+    all_genres = []
+    for artist in artist_data["items"]:
+        all_genres.extend(artist["genres"])
+    genre_count = {}
+    for genre in all_genres:
+        if genre in genre_count:
+            genre_count[genre] += 1
+        else:
+            genre_count[genre] = 1
+    sorted_genres = sorted(genre_count.items(), key=lambda x: x[1], reverse=True)
+    return [genre[0] for genre in sorted_genres[:5]]
+
+def legacy_compare_artist_trends(short_term, medium_term, long_term):
+    medium_ids = [artist["id"] for artist in medium_term["items"]]
+    long_ids = [artist["id"] for artist in long_term["items"]]
+    new_artists = [
+        {"id": artist["id"], "name": artist["name"]}
+        for artist in short_term["items"]
+        if artist["id"] not in medium_ids and artist["id"] not in long_ids
+    ]
+    consistent = [
+        {"id": artist["id"], "name": artist["name"]}
+        for artist in short_term["items"]
+        if artist["id"] in medium_ids and artist["id"] in long_ids
+    ]
+    return {"new_discoveries": new_artists, "consistent_favorites": consistent}
+
+def bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<34} {seconds * 1e6:>12.1f} us")
+
+def main():
+    for n in SIZES:
+        # Overlapping lists, like real short/medium/long term top artists
+        lists = {
+            'short_term': make_artists(n, 0, 1),
+            'medium_term': make_artists(n, n // 3, 2),
+            'long_term': make_artists(n, n // 2, 3),
+        }
+        # The short-term list after a refresh: 10% of artists replaced
+        refreshed = lists['short_term'][: n - n // 10] + make_artists(n // 10, 10 * n, 4)
+        number = max(1, 5000 // n)
+        print(f"{n} artists per time range")
+
+        def legacy():
+            wrapped = {time_range: {'items': artists} for time_range, artists in lists.items()}
+            for time_range in TIME_RANGES:
+                legacy_extract_top_genres(wrapped[time_range])
+            legacy_compare_artist_trends(*(wrapped[time_range] for time_range in TIME_RANGES))
+
+        def legacy_trends_only():
+            legacy_compare_artist_trends(*({'items': lists[time_range]} for time_range in TIME_RANGES))
+
+        def full_build():
+            user = UserAnalytics()
+            for time_range in TIME_RANGES:
+                user.update_range(time_range, lists[time_range])
+            user.summary()
+
+        def trends_only():
+            aggregates = []
+            for time_range in TIME_RANGES:
+                aggregate = ArtistAggregate()
+                aggregate.update(lists[time_range])
+                aggregates.append(aggregate)
+            compare_artist_trends(*aggregates)
+
+        user = UserAnalytics()
+        for time_range in TIME_RANGES:
+            user.update_range(time_range, lists[time_range])
+        user.summary()
+        toggle = [lists['short_term'], refreshed]
+
+        def incremental():
+            toggle.reverse()
+            user.update_range('short_term', toggle[0])
+            user.summary()
+
+        def cached():
+            user.update_range('short_term', toggle[0])
+            user.summary()
+
+        if n <= 500:
+            bench("legacy genres + trends", legacy, number)
+            bench("legacy trends only", legacy_trends_only, number)
+        else:
+            # Quadratic membership tests; a single run is enough to show the gap
+            bench("legacy genres + trends", legacy, 1)
+            bench("legacy trends only", legacy_trends_only, 1)
+        bench("aggregate trends only", trends_only, number)
+        bench("full build + summary", full_build, number)
+        bench("incremental update + summary", incremental, number)
+        bench("unchanged input (cached)", cached, number * 10)
+    print(analytics.stats)
+
+if __name__ == "__main__":
+    main()
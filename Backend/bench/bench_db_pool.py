@@ -0,0 +1,83 @@
+"""
+Pooled vs unpooled database latency.
+
+Runs the token lookup behind every authenticated request (get_token) two ways
+against a scratch Postgres (bench/pg_fixture.py): through the shared pool, and
+the way db.py did it before the pool, with a new connection per call. Reports
+p50/p95/p99 latency, throughput and connections opened at several
+concurrency levels.
+
+Run from Backend/:
+  python -m bench.bench_db_pool
+  BENCH_DATABASE_URL=postgresql://... python -m bench.bench_db_pool --calls 5000
+"""
+import os
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import RealDictCursor
+from bench.pg_fixture import postgres, seed_users
+
+CONCURRENCY = (1, 10, 50)
+
+def unpooled_get_token(user_id):
+    """get_token as it was before the pool: connect, query, close"""
+    import db
+    conn = db.get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("SELECT token_data FROM tokens WHERE user_id = %s", (user_id,))
+    result = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return result['token_data'] if result else None
+
+def run(lookup, user_ids, calls, concurrency):
+    """Time calls lookups spread over concurrency threads; returns (sorted latencies, wall seconds)"""
+    def timed(i):
+        start = time.perf_counter()
+        lookup(user_ids[i % len(user_ids)])
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        latencies = sorted(executor.map(timed, range(calls)))
+        wall = time.perf_counter() - start
+    return latencies, wall
+
+def report(label, latencies, wall, connections):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"  {label:<10} p50 {quantiles[49] * 1e3:7.2f} ms  p95 {quantiles[94] * 1e3:7.2f} ms  "
+        f"p99 {quantiles[98] * 1e3:7.2f} ms  {len(latencies) / wall:8.0f} calls/s  {connections:>6} connections"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pooled and unpooled database calls")
+    parser.add_argument("--calls", type=int, default=2000, help="lookups per mode and concurrency level")
+    parser.add_argument("--users", type=int, default=50)
+    options = parser.parse_args()
+
+    with postgres() as database_url:
+        user_ids = [user_id for user_id, _ in seed_users(database_url, options.users)]
+        os.environ["DATABASE_URL"] = database_url
+        import db
+
+        print(f"{options.calls} get_token calls per run (pool size {db.DB_POOL_MAX})")
+        for concurrency in CONCURRENCY:
+            print(f"concurrency {concurrency}")
+            latencies, wall = run(unpooled_get_token, user_ids, options.calls, concurrency)
+            report("unpooled", latencies, wall, options.calls)
+
+            db.close_pool()
+            db.get_token(user_ids[0])  # open the pool outside the measurement
+            waits = db.get_pool_stats()["waits"]
+            latencies, wall = run(db.get_token, user_ids, options.calls, concurrency)
+            stats = db.get_pool_stats()
+            report("pooled", latencies, wall, stats["open_connections"])
+            if stats["waits"] > waits:
+                print(f"  {'':<10} {stats['waits'] - waits} checkouts waited for a free connection")
+        db.close_pool()
+
+if __name__ == "__main__":
+    main()
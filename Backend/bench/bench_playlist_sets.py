@@ -0,0 +1,55 @@
+"""
+CPU cost of playlist set operations on large playlists.
+
+Times track keying (id, isrc, name_artist), each set operation and diff
+planning on synthetic playlists of 10,000 and 50,000 tracks that share half
+their tracks; the Spotify calls around them are not included.
+
+Run from Backend/: python -m bench.bench_playlist_sets
+"""
+import random
+import timeit
+from playlist_sets import track_key, combine, plan_diff
+
+SIZES = (10000, 50000)
+SUFFIXES = ["", " - Remastered 2011", " (feat. Someone)", " - Radio Edit"]
+
+def make_tracks(n, offset, seed):
+    rng = random.Random(seed)
+    return [
+        {
+            'id': f"{offset + i:022d}",
+            'name': f"Song Number {offset + i}" + rng.choice(SUFFIXES),
+            'artists': [{'name': f"Artist {(offset + i) % 997}"}],
+            'external_ids': {'isrc': f"US-ABC-{offset + i:08d}"}
+        }
+        for i in range(n)
+    ]
+
+def entries(tracks, match):
+    return [(position, track_key(track, match), track['id']) for position, track in enumerate(tracks)]
+
+def bench(label, func, number=5):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<34} {seconds * 1e3:>10.2f} ms")
+
+def main():
+    for n in SIZES:
+        a = make_tracks(n, 0, 1)
+        b = make_tracks(n, n // 2, 2)
+        print(f"{n} tracks per playlist")
+        for match in ("id", "isrc", "name_artist"):
+            bench(f"key tracks by {match}", lambda: entries(a, match))
+
+        a_entries, b_entries = entries(a, "id"), entries(b, "id")
+        for operation in ("union", "intersection", "difference"):
+            bench(operation, lambda: combine(operation, [a_entries, b_entries]))
+        bench("dedupe", lambda: combine("dedupe", [a_entries + a_entries[: n // 10]]))
+
+        result = combine("union", [a_entries, b_entries])
+        removals, additions = plan_diff(a_entries, result)
+        bench("plan diff (union into first)", lambda: plan_diff(a_entries, result))
+        print(f"  union writes {len(additions)} additions and {len(removals)} removals instead of {len(result)} tracks")
+
+if __name__ == "__main__":
+    main()
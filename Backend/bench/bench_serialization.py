@@ -0,0 +1,79 @@
+"""
+Serialization and payload-size benchmarks for large playlist responses.
+
+Encodes a synthetic 10,000-track playlist with json and orjson, then reports
+response sizes for the full payload, a projected payload (fields=) and a
+single-image payload (image_size=), raw and compressed with gzip (and brotli
+when installed).
+
+Run from Backend/: python -m bench.bench_serialization
+"""
+import gzip
+import json
+import random
+import timeit
+import orjson
+from projection import projector
+from compression import GZIP_LEVEL, BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TRACKS = 10000
+
+def make_image(url_id, size):
+    return {'url': f"https://i.scdn.co/image/ab67616d0000{url_id:028x}", 'height': size, 'width': size}
+
+def make_tracks(n, seed=0):
+    rng = random.Random(seed)
+    tracks = []
+    for i in range(n):
+        album_id = rng.randrange(n // 4)
+        tracks.append({
+            'id': f"{i:022x}",
+            'name': f"Track {i} " + "".join(rng.choices("abcdefghij ", k=rng.randint(4, 24))),
+            'artists': [
+                {'name': f"Artist {a}", 'id': f"{a:022x}"}
+                for a in rng.sample(range(n // 10), rng.randint(1, 3))
+            ],
+            'album': {
+                'name': f"Album {album_id}",
+                'images': [make_image(album_id * 3 + k, size) for k, size in enumerate((640, 300, 64))]
+            },
+            'duration_ms': rng.randint(90000, 420000),
+            'uri': f"spotify:track:{i:022x}",
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{i:022x}"}
+        })
+    return tracks
+
+def bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<34} {seconds * 1e3:>10.2f} ms")
+
+def sizes(label, payload):
+    raw = orjson.dumps(payload)
+    row = f"  {label:<42} {len(raw):>10,}  gzip {len(gzip.compress(raw, GZIP_LEVEL)):>9,}"
+    if brotli is not None:
+        row += f"  br {len(brotli.compress(raw, quality=BROTLI_QUALITY)):>9,}"
+    print(row)
+
+def main():
+    playlist = {'playlist': {'id': "bench", 'name': "Bench", 'total_tracks': TRACKS}, 'tracks': make_tracks(TRACKS)}
+    project = projector("id,name,artists.name,album.images", None)
+    single_image = projector(None, "small")
+
+    print(f"Encode {TRACKS} tracks")
+    bench("json.dumps", lambda: json.dumps(playlist).encode(), 5)
+    bench("orjson.dumps", lambda: orjson.dumps(playlist), 5)
+    bench("projection (fields=)", lambda: project(playlist['tracks']), 5)
+    bench("projection (image_size=small)", lambda: single_image(playlist['tracks']), 5)
+
+    print("Response bytes" + ("" if brotli is not None else " (brotli not installed)"))
+    sizes("full", playlist)
+    sizes("fields=id,name,artists.name,album.images", dict(playlist, tracks=project(playlist['tracks'])))
+    sizes("image_size=small", dict(playlist, tracks=single_image(playlist['tracks'])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Startup-time benchmark.
+
+Starts fresh interpreters that import main (as uvicorn does) and serve one
+request, reporting import time and time to the first response, plus the
+slowest imports from python -X importtime. Startup hooks are not run, so
+no database is needed.
+
+Run from Backend/: python -m bench.bench_startup
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+RUNS = 5
+
+# Runs in a fresh interpreter for each measurement
+PROBE = """
+import json, time
+start = time.perf_counter()
+import main
+import_ms = (time.perf_counter() - start) * 1000
+# TestClient pulls in httpx, which the app itself only imports on its first Spotify call
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+start = time.perf_counter()
+response = client.get("/")
+first_request_ms = (time.perf_counter() - start) * 1000
+assert response.status_code == 200
+print(json.dumps({"import_ms": import_ms, "first_request_ms": first_request_ms}))
+"""
+
+ENV = dict(
+    os.environ,
+    DATABASE_URL=os.environ.get("DATABASE_URL", "postgresql://localhost/unused"),
+    MIGRATE_ON_STARTUP="false",
+)
+
+def probe():
+    output = subprocess.run([sys.executable, "-c", PROBE], env=ENV, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def slowest_imports(n=10):
+    """Top-level-ish modules by cumulative import time (microseconds)"""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=ENV, capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+def main():
+    results = [probe() for _ in range(RUNS)]
+    for key in ("import_ms", "first_request_ms"):
+        values = [result[key] for result in results]
+        print(f"  {key:<20} median {statistics.median(values):>8.1f} ms   min {min(values):>8.1f} ms")
+    print("Slowest imports (cumulative)")
+    for cumulative, name in slowest_imports():
+        print(f"  {name:<30} {cumulative / 1000:>8.1f} ms")
+
+if __name__ == "__main__":
+    main()
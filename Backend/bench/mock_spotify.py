@@ -0,0 +1,301 @@
+"""
+Local stand-in for the Spotify Web API, for benchmarks and load tests.
+
+Serves the endpoints AsyncSpotify (and spotipy, for bench baselines) calls
+with deterministic synthetic data.
+Point the app at it with SPOTIFY_API_BASE=http://127.0.0.1:<port>/v1.
+
+Settings (environment variables):
+  MOCK_LATENCY_MS     added to every response (default 30)
+  MOCK_JITTER_MS      random extra latency, uniform 0..jitter (default 10)
+  MOCK_429_RATE       fraction of requests answered 429 (default 0)
+  MOCK_RETRY_AFTER    Retry-After seconds sent with a 429 (default 1)
+  MOCK_PLAYLIST_SIZE  tracks per playlist unless the id says otherwise (default 1000)
+  MOCK_LIBRARY_SIZE   playlists in each user's library (default 200)
+
+A playlist id ending in "-<n>" (e.g. "big-10000") has n tracks; ids starting
+with "dupes-" repeat every tenth track. Playlists sharing a "<name>-" prefix
+share their first half of tracks, for set operations. The access
+token is used as the user id. GET /_stats returns upstream call counts by
+endpoint; POST /_reset clears them.
+
+Run from Backend/: python -m bench.mock_spotify --port 8900
+"""
+import os
+import random
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+MOCK_LATENCY_MS = float(os.environ.get("MOCK_LATENCY_MS", "30"))
+MOCK_JITTER_MS = float(os.environ.get("MOCK_JITTER_MS", "10"))
+MOCK_429_RATE = float(os.environ.get("MOCK_429_RATE", "0"))
+MOCK_RETRY_AFTER = int(os.environ.get("MOCK_RETRY_AFTER", "1"))
+MOCK_PLAYLIST_SIZE = int(os.environ.get("MOCK_PLAYLIST_SIZE", "1000"))
+MOCK_LIBRARY_SIZE = int(os.environ.get("MOCK_LIBRARY_SIZE", "200"))
+
+GENRES = ["indie rock", "bedroom pop", "uk garage", "deep house", "jazz fusion", "k-pop", "trap", "post-punk", "ambient", "neo soul"]
+ARTISTS = 2000
+ALBUMS = 5000
+
+app = FastAPI(title="Mock Spotify Web API")
+calls = Counter()
+rate_limited = Counter()
+
+# Playlists changed through the API: playlist id -> track ids; and snapshot numbers
+_changed = {}
+_snapshots = Counter()
+_created = itertools.count()
+
+def _id(prefix, n):
+    return f"{prefix}{n:0{22 - len(prefix)}d}"
+
+def _index(spotify_id):
+    return int(spotify_id.lstrip("abcdefghijklmnopqrstuvwxyz-") or 0)
+
+def image_list(seed):
+    return [
+        {"url": f"https://i.scdn.co/image/{seed}-{size}", "height": size, "width": size}
+        for size in (640, 300, 64)
+    ]
+
+def artist(n):
+    rng = random.Random(n)
+    return {
+        "id": _id("ar", n),
+        "name": f"Artist {n}",
+        "genres": rng.sample(GENRES, rng.randint(0, 3)),
+        "popularity": rng.randint(0, 100),
+        "images": image_list(_id("ar", n)),
+        "external_urls": {"spotify": f"https://open.spotify.com/artist/{_id('ar', n)}"},
+    }
+
+def album(n):
+    return {
+        "id": _id("al", n),
+        "name": f"Album {n}",
+        "images": image_list(_id("al", n)),
+        "artists": [{"id": _id("ar", n % ARTISTS), "name": f"Artist {n % ARTISTS}"}],
+        "external_urls": {"spotify": f"https://open.spotify.com/album/{_id('al', n)}"},
+    }
+
+def track(n):
+    rng = random.Random(-n - 1)
+    artist_ids = rng.sample(range(ARTISTS), rng.randint(1, 3))
+    return {
+        "id": _id("tr", n),
+        "name": f"Track {n}",
+        "uri": f"spotify:track:{_id('tr', n)}",
+        "artists": [{"id": _id("ar", a), "name": f"Artist {a}"} for a in artist_ids],
+        "album": {"id": _id("al", n % ALBUMS), "name": f"Album {n % ALBUMS}", "images": image_list(_id("al", n % ALBUMS))},
+        "duration_ms": rng.randint(90000, 420000),
+        "popularity": rng.randint(0, 100),
+        "preview_url": None,
+        "external_ids": {"isrc": f"QZ{n:010d}"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{_id('tr', n)}"},
+    }
+
+def _user(request):
+    return request.headers.get("Authorization", "Bearer anonymous").split(" ", 1)[-1]
+
+def _playlist_size(playlist_id):
+    size = playlist_id.rsplit("-", 1)[-1]
+    return int(size) if size.isdigit() else MOCK_PLAYLIST_SIZE
+
+def _playlist_items(playlist_id):
+    """Track ids in the playlist: generated ones until the playlist is changed through the API"""
+    if playlist_id in _changed:
+        return _changed[playlist_id]
+    size = _playlist_size(playlist_id)
+    shared_seed = sum(map(ord, playlist_id.split("-", 1)[0])) * 7919
+    own_seed = sum(map(ord, playlist_id)) * 7919 + 10 ** 7
+    ids = [_id("tr", (shared_seed if i < size // 2 else own_seed) + i) for i in range(size)]
+    if playlist_id.startswith("dupes-"):
+        ids = [ids[i - 5] if i % 10 == 9 else track_id for i, track_id in enumerate(ids)]
+    return ids
+
+def _page(request, items, offset, limit, total):
+    next_url = None
+    if offset + limit < total:
+        next_url = str(request.url.include_query_params(offset=offset + limit, limit=limit))
+    return {"items": items, "total": total, "offset": offset, "limit": limit, "next": next_url, "href": str(request.url)}
+
+def _playlist_tracks_page(request, playlist_id, offset, limit):
+    ids = _playlist_items(playlist_id)
+    items = [
+        {"added_at": "2024-01-01T00:00:00Z", "track": track(_index(track_id))}
+        for track_id in ids[offset:offset + limit]
+    ]
+    return _page(request, items, offset, limit, len(ids))
+
+def _playlist(request, playlist_id):
+    return {
+        "id": playlist_id,
+        "name": f"Playlist {playlist_id}",
+        "description": "Synthetic playlist",
+        "snapshot_id": f"snap-{_snapshots[playlist_id]}",
+        "owner": {"id": _user(request), "display_name": _user(request)},
+        "images": image_list(playlist_id),
+        "public": False,
+        "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist_id}"},
+        "tracks": _playlist_tracks_page(request, playlist_id, 0, 100),
+    }
+
+@app.middleware("http")
+async def simulate_upstream(request: Request, call_next):
+    """Count the call, then add latency and inject 429s like the real API"""
+    if request.url.path.startswith("/_"):
+        return await call_next(request)
+    endpoint = f"{request.method} {request.url.path}"
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match.name == "FULL":
+            endpoint = f"{request.method} {route.path}"
+            break
+    calls[endpoint] += 1
+    await asyncio.sleep((MOCK_LATENCY_MS + random.uniform(0, MOCK_JITTER_MS)) / 1000)
+    if MOCK_429_RATE and random.random() < MOCK_429_RATE:
+        rate_limited[endpoint] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(MOCK_RETRY_AFTER)},
+            content={"error": {"status": 429, "message": "API rate limit exceeded"}},
+        )
+    return await call_next(request)
+
+@app.get("/_stats")
+def stats():
+    return {"calls": dict(calls), "total": sum(calls.values()), "rate_limited": dict(rate_limited)}
+
+@app.post("/_reset")
+def reset():
+    calls.clear()
+    rate_limited.clear()
+    return {"status": "reset"}
+
+@app.get("/v1/me")
+@app.get("/v1/me/")  # spotipy's path; answered directly rather than redirected, like the real API
+def me(request: Request):
+    return {"id": _user(request), "display_name": _user(request), "product": "premium"}
+
+@app.get("/v1/me/top/artists")
+def top_artists(limit: int = 20, offset: int = 0, time_range: str = "medium_term"):
+    shift = {"short_term": 0, "medium_term": 15, "long_term": 30}.get(time_range, 0)
+    return {"items": [artist(shift + i) for i in range(offset, offset + limit)], "total": 50}
+
+@app.get("/v1/me/top/tracks")
+def top_tracks(limit: int = 20, offset: int = 0, time_range: str = "medium_term"):
+    shift = {"short_term": 0, "medium_term": 15, "long_term": 30}.get(time_range, 0)
+    return {"items": [track(shift + i) for i in range(offset, offset + limit)], "total": 50}
+
+@app.get("/v1/me/player/recently-played")
+def recently_played(limit: int = 50, after: int = 0):
+    return {
+        "items": [
+            {"track": track(i), "played_at": f"2024-01-01T{i // 60:02d}:{i % 60:02d}:00.000Z"}
+            for i in range(limit)
+        ],
+        "cursors": {"after": str(after)},
+    }
+
+@app.get("/v1/me/player")
+def current_playback():
+    return {"is_playing": True, "progress_ms": 30000, "item": track(1)}
+
+@app.get("/v1/me/playlists")
+def user_playlists(request: Request, limit: int = 50, offset: int = 0):
+    user = _user(request)
+    items = [
+        {
+            "id": f"{user}-pl{i}",
+            "name": f"Playlist {i}",
+            "description": "",
+            "images": image_list(f"{user}-pl{i}"),
+            "owner": {"id": user if i % 2 else "someone-else", "display_name": user},
+            "tracks": {"total": _playlist_size(f"{user}-pl{i}")},
+            "external_urls": {"spotify": ""},
+        }
+        for i in range(offset, min(offset + limit, MOCK_LIBRARY_SIZE))
+    ]
+    return _page(request, items, offset, limit, MOCK_LIBRARY_SIZE)
+
+@app.get("/v1/playlists/{playlist_id}")
+def playlist(request: Request, playlist_id: str):
+    return _playlist(request, playlist_id)
+
+@app.get("/v1/playlists/{playlist_id}/tracks")
+@app.get("/v1/playlists/{playlist_id}/items")
+def playlist_tracks(request: Request, playlist_id: str, offset: int = 0, limit: int = 100):
+    return _playlist_tracks_page(request, playlist_id, offset, min(limit, 100))
+
+@app.post("/v1/playlists/{playlist_id}/tracks", status_code=201)
+@app.post("/v1/playlists/{playlist_id}/items", status_code=201)
+async def add_playlist_tracks(request: Request, playlist_id: str):
+    body = await request.json()
+    if isinstance(body, list):
+        # spotipy sends a bare list of uris, with any position as a query parameter
+        body = {"uris": body}
+        if "position" in request.query_params:
+            body["position"] = int(request.query_params["position"])
+    ids = _changed[playlist_id] = list(_playlist_items(playlist_id))
+    position = body.get("position", len(ids))
+    if position > len(ids):
+        return JSONResponse(status_code=400, content={"error": {"status": 400, "message": "Index out of bounds"}})
+    ids[position:position] = [uri.rsplit(":", 1)[-1] for uri in body["uris"]]
+    _snapshots[playlist_id] += 1
+    return {"snapshot_id": f"snap-{_snapshots[playlist_id]}"}
+
+@app.delete("/v1/playlists/{playlist_id}/tracks")
+@app.delete("/v1/playlists/{playlist_id}/items")
+async def remove_playlist_tracks(request: Request, playlist_id: str):
+    tracks = (await request.json())["tracks"]
+    ids = _changed[playlist_id] = list(_playlist_items(playlist_id))
+    # Items with positions remove just those occurrences, others every occurrence
+    positions = set()
+    for item in tracks:
+        track_id = item["uri"].rsplit(":", 1)[-1]
+        if "positions" in item:
+            if any(position >= len(ids) or ids[position] != track_id for position in item["positions"]):
+                return JSONResponse(status_code=400, content={"error": {"status": 400, "message": "Invalid track positions"}})
+            positions.update(item["positions"])
+        else:
+            positions.update(i for i, existing in enumerate(ids) if existing == track_id)
+    _changed[playlist_id] = [track_id for i, track_id in enumerate(ids) if i not in positions]
+    _snapshots[playlist_id] += 1
+    return {"snapshot_id": f"snap-{_snapshots[playlist_id]}"}
+
+@app.post("/v1/users/{user_id}/playlists", status_code=201)
+async def create_playlist(request: Request, user_id: str):
+    body = await request.json()
+    # New playlists start empty ("-0")
+    playlist_id = f"{user_id}-new{next(_created)}-0"
+    return {"id": playlist_id, "name": body["name"], "external_urls": {"spotify": ""}, "snapshot_id": "snap-0"}
+
+def _lookup(ids, make):
+    return [make(_index(spotify_id)) for spotify_id in ids.split(",") if spotify_id]
+
+@app.get("/v1/artists")
+def artists(ids: str):
+    return {"artists": _lookup(ids, artist)}
+
+@app.get("/v1/albums")
+def albums(ids: str):
+    return {"albums": _lookup(ids, album)}
+
+@app.get("/v1/tracks")
+def tracks(ids: str):
+    return {"tracks": _lookup(ids, track)}
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
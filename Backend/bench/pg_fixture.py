@@ -0,0 +1,84 @@
+"""
+Ephemeral PostgreSQL for benchmarks.
+
+postgres() yields a DATABASE_URL: BENCH_DATABASE_URL when set, otherwise a
+throwaway cluster created with initdb/pg_ctl in a temporary directory (on a
+free port, fsync off) and deleted afterwards. initdb refuses to run as root;
+set BENCH_DATABASE_URL to a scratch database there.
+
+seed_users() creates the schema and a token and session per bench user.
+"""
+import os
+import glob
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _pg_binary(name):
+    found = shutil.which(name)
+    if found:
+        return found
+    # Debian/Ubuntu and Homebrew keep the server binaries off PATH
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}") + glob.glob(f"/opt/homebrew/opt/postgresql*/bin/{name}"))
+    if not candidates:
+        raise RuntimeError(f"{name} not found; install PostgreSQL or set BENCH_DATABASE_URL")
+    return candidates[-1]
+
+@contextmanager
+def postgres():
+    """Yield a DATABASE_URL for a scratch database"""
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if url:
+        yield url
+        return
+
+    root = tempfile.mkdtemp(prefix="rhythm-radar-bench-pg-")
+    data_dir = os.path.join(root, "data")
+    port = free_port()
+    pg_ctl = _pg_binary("pg_ctl")
+    try:
+        subprocess.run(
+            [_pg_binary("initdb"), "-D", data_dir, "-U", "bench", "--auth=trust", "-E", "UTF8"],
+            check=True, capture_output=True
+        )
+        subprocess.run(
+            [
+                pg_ctl, "-D", data_dir, "-l", os.path.join(root, "postgres.log"), "-w", "start",
+                "-o", f"-p {port} -k {root} -c listen_addresses=127.0.0.1 -c fsync=off -c synchronous_commit=off"
+            ],
+            check=True, capture_output=True
+        )
+        yield f"postgresql://bench@127.0.0.1:{port}/postgres"
+    finally:
+        if os.path.exists(os.path.join(data_dir, "postmaster.pid")):
+            subprocess.run([pg_ctl, "-D", data_dir, "-m", "immediate", "stop"], capture_output=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+def seed_users(database_url, count):
+    """Create the schema and count users with long-lived tokens; returns [(user_id, session_id)]"""
+    os.environ["DATABASE_URL"] = database_url
+    import db
+
+    db.init_db()
+    users = []
+    for i in range(count):
+        user_id = f"bench-user-{i}"
+        # The mock Spotify API treats the access token as the user id
+        db.store_token(user_id, {
+            "access_token": user_id,
+            "refresh_token": "bench",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "expires_at": int(time.time()) + 7 * 86400
+        })
+        users.append((user_id, db.create_session(user_id)))
+    db.close_pool()
+    return users
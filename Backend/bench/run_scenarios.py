@@ -0,0 +1,358 @@
+"""
+Endpoint load benchmarks against a local Spotify stand-in.
+
+Starts a scratch Postgres (bench/pg_fixture.py), the mock Spotify API
+(bench/mock_spotify.py) and the app under uvicorn, seeds bench users, then
+drives each scenario at a fixed concurrency. For every scenario it reports
+p50/p95/p99 latency, time to first byte, throughput, errors, upstream Spotify
+calls and the app's RSS (current, and the peak sampled while the scenario
+ran), and saves the results to bench/results/<commit>.json.
+
+--baseline runs an earlier commit (by default the first one, before the
+async client, pool and caches) against the same mock instead of the working
+tree, so both sides of a comparison see identical upstream behaviour. It
+serves the single "current_token" user that commit knows about and only the
+scenarios that commit has endpoints for.
+
+Run from Backend/:
+  python -m bench.run_scenarios
+  python -m bench.run_scenarios --scenario playlist --requests 50
+  python -m bench.run_scenarios --concurrency 10,100,500 --baseline
+  python -m bench.run_scenarios --concurrency 10,100,500 --compare bench/results/<baseline commit>.json
+
+Mock settings (MOCK_LATENCY_MS, MOCK_429_RATE, ...) and app settings are read
+from the environment and passed through to both servers; MOCK_* and the
+app's client-side rate limit (SPOTIFY_RATE_*) are saved with the results.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import httpx
+from bench.pg_fixture import postgres, seed_users, free_port
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+# Endpoints the first commit already had; the rest were added later
+BASELINE_SCENARIOS = {
+    "top-artists", "top-tracks", "listening-stats", "now-playing", "user-playlists",
+    "playlist-fetch", "playlist-fetch-10k", "playlist-create", "playlist-add-tracks",
+}
+
+def scenarios(playlist_size):
+    """(name, method, path, json body) for each endpoint under test"""
+    playlist = f"bench-{playlist_size}"
+    return [
+        ("top-artists", "GET", "/api/top-artists?time_range=short_term&limit=20", None),
+        ("top-tracks", "GET", "/api/top-tracks?limit=20", None),
+        ("top-tracks-enriched", "GET", "/api/top-tracks?limit=50&enrich=true", None),
+        ("listening-stats", "GET", "/api/listening-stats", None),
+        ("now-playing", "GET", "/api/now-playing", None),
+        ("genre-profile", "GET", "/api/genre-profile?time_range=medium_term", None),
+        ("genre-similarity", "GET", "/api/genre-profile/similarity", None),
+        ("user-playlists", "GET", "/api/playlist/user-playlists", None),
+        ("playlist-fetch", "GET", f"/api/playlist/fetch?playlist_input={playlist}", None),
+        ("playlist-fetch-stream", "GET", f"/api/playlist/fetch?playlist_input={playlist}&stream=true", None),
+        # 10k tracks: TTFB and peak RSS show what streaming saves over building the whole response
+        ("playlist-fetch-10k", "GET", "/api/playlist/fetch?playlist_input=bench-10000", None),
+        ("playlist-fetch-stream-10k", "GET", "/api/playlist/fetch?playlist_input=bench-10000&stream=true", None),
+        ("playlist-fetch-projected", "GET", f"/api/playlist/fetch?playlist_input={playlist}&fields=id,name&image_size=small", None),
+        ("playlist-create", "POST", "/api/playlist/create", {"name": "Bench playlist"}),
+        # skip_duplicates off: the mock keeps added tracks, so every request after the first
+        # would skip them all (the baseline has no such option and always adds)
+        ("playlist-add-tracks", "POST", "/api/playlist/add-tracks", {
+            "playlist_id": "bench-add-100",
+            "track_ids": [f"tr{i:020d}" for i in range(200)],
+            "skip_duplicates": False
+        }),
+        ("job-fetch-enqueue", "POST", "/api/playlist/jobs/fetch", {"playlist_input": playlist}),
+        ("playlist-sets-union-dry-run", "POST", "/api/playlist/sets", {
+            "operation": "union", "playlists": [playlist, f"bench-b-{playlist_size}"], "dry_run": True
+        }),
+        ("playlist-sets-dedupe-isrc-dry-run", "POST", "/api/playlist/sets", {
+            "operation": "dedupe", "playlists": [f"dupes-{playlist_size}"], "match": "isrc", "dry_run": True
+        }),
+    ]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def rss_mb(pid):
+    """Current and peak resident memory of a process in MB (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        return None, None
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+
+def git_commit():
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    return commit, bool(git("status", "--porcelain", "--", "."))
+
+def extract_baseline(ref, directory):
+    """Write Backend/ as of ref into directory; returns the short commit"""
+    if ref == "root":
+        ref = git("rev-list", "--max-parents=0", "HEAD").split()[-1]
+    commit = git("rev-parse", "--short", ref)
+    if not commit:
+        raise RuntimeError(f"unknown commit {ref}")
+    # Run from Backend/, git archive writes that directory's contents only
+    archive = subprocess.run(["git", "archive", commit, "."], cwd=BACKEND_DIR, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+    return commit
+
+def seed_baseline_token(database_url):
+    """Store the token the baseline reads for every request; the mock takes it as bench-user-0"""
+    os.environ["DATABASE_URL"] = database_url
+    import db
+
+    db.store_token("current_token", {
+        "access_token": "bench-user-0",
+        "refresh_token": "bench",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "expires_at": int(time.time()) + 7 * 86400
+    })
+    db.close_pool()
+
+def start_server(args, env, port, cwd=BACKEND_DIR, stdout=None):
+    process = subprocess.Popen([sys.executable, "-m", *args], cwd=cwd, env=env, stdout=stdout)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{args[0]} exited with {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{args[0]} did not start on port {port}")
+
+async def run_scenario(client, scenario, sessions, requests, concurrency):
+    """
+    Send requests at the given concurrency; returns (latencies, time to first body
+    byte per request, errors, wall seconds)
+    """
+    _, method, path, body = scenario
+    sessions = itertools.cycle(sessions)
+    remaining = iter(range(requests))
+    latencies = []
+    ttfbs = []
+    errors = {}
+
+    async def worker():
+        for _ in remaining:
+            headers = {"X-Session-Id": next(sessions)}
+            start = time.perf_counter()
+            first_byte = None
+            try:
+                async with client.stream(method, path, json=body, headers=headers) as response:
+                    async for chunk in response.aiter_raw():
+                        if first_byte is None and chunk:
+                            first_byte = time.perf_counter() - start
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if first_byte is not None:
+                ttfbs.append(first_byte)
+            if not isinstance(status, int) or status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, ttfbs, errors, time.perf_counter() - start
+
+async def sample_peak_rss(pid, interval=0.05):
+    """Sample a process's RSS until cancelled; returns the highest value seen in MB"""
+    peak = 0.0
+    try:
+        while True:
+            rss, _ = rss_mb(pid)
+            peak = max(peak, rss or 0.0)
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        return peak
+
+async def run_all(options, app_port, mock_port, app_pid, sessions):
+    """
+    Run the selected scenarios at each concurrency level. Results are keyed by
+    scenario name, or "name@c<concurrency>" when several levels are run.
+    """
+    results = {}
+    selected = [
+        s for s in scenarios(options.playlist_size)
+        if (not options.scenario or options.scenario in s[0]) and (not options.baseline or s[0] in BASELINE_SCENARIOS)
+    ]
+    limits = httpx.Limits(max_connections=max(options.concurrency), max_keepalive_connections=max(options.concurrency))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=600, limits=limits) as client:
+        for concurrency, scenario in itertools.product(options.concurrency, selected):
+            name = scenario[0] if len(options.concurrency) == 1 else f"{scenario[0]}@c{concurrency}"
+            # At least two requests per worker, so high concurrency levels are not a single burst
+            requests = max(options.requests, 2 * concurrency)
+            if options.warmup:
+                await run_scenario(client, scenario, sessions, options.warmup, min(options.warmup, concurrency))
+            await client.post(f"http://127.0.0.1:{mock_port}/_reset")
+            sampler = asyncio.ensure_future(sample_peak_rss(app_pid))
+            try:
+                latencies, ttfbs, errors, wall = await run_scenario(client, scenario, sessions, requests, concurrency)
+            finally:
+                sampler.cancel()
+            peak_rss = await sampler
+            upstream = (await client.get(f"http://127.0.0.1:{mock_port}/_stats")).json()
+            rss, _ = rss_mb(app_pid)
+            latencies.sort()
+            ttfbs.sort()
+            results[name] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+                "ttfb_p50_ms": ttfbs and round(percentile(ttfbs, 0.50) * 1000, 2),
+                "ttfb_p95_ms": ttfbs and round(percentile(ttfbs, 0.95) * 1000, 2),
+                "throughput_rps": round(len(latencies) / wall, 1),
+                "upstream_calls": upstream["total"],
+                "upstream_calls_per_request": round(upstream["total"] / max(len(latencies), 1), 2),
+                "upstream_by_endpoint": upstream["calls"],
+                "upstream_rate_limited": sum(upstream["rate_limited"].values()),
+                "rss_mb": rss and round(rss, 1),
+                "peak_rss_mb": peak_rss and round(peak_rss, 1),  # highest sampled while the scenario ran
+            }
+            print_row(name, results[name])
+    return results
+
+HEADER = (
+    f"{'scenario':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb ms':>9} {'req/s':>8} {'errors':>7} "
+    f"{'upstream':>9} {'rss MB':>8} {'peak MB':>8}"
+)
+
+def print_row(name, result, baseline=None):
+    def delta(key):
+        if not baseline or key not in baseline or not baseline[key]:
+            return ""
+        return f" ({(result[key] - baseline[key]) / baseline[key]:+.0%})"
+    print(
+        f"{name:<34.34} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+        f"{result.get('ttfb_p50_ms') or 0:>9.1f} {result['throughput_rps']:>8.1f} {sum(result['errors'].values()):>7} "
+        f"{result['upstream_calls_per_request']:>9.2f} {result['rss_mb'] or 0:>8.1f} {result['peak_rss_mb'] or 0:>8.1f}"
+        + (f"   p95{delta('p95_ms')} ttfb{delta('ttfb_p50_ms')} req/s{delta('throughput_rps')} peak{delta('peak_rss_mb')}" if baseline else "")
+    )
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline['commit']} ({baseline['time']})")
+    print(HEADER)
+    for name, result in results.items():
+        print_row(name, result, baseline["scenarios"].get(name))
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive every endpoint against a mock Spotify API")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[16],
+        help="concurrent requests, or a comma-separated list of levels to run each scenario at"
+    )
+    parser.add_argument("--warmup", type=int, default=16, help="unmeasured requests per scenario (0 to measure cold caches)")
+    parser.add_argument("--users", type=int, default=20, help="bench users; requests rotate through their sessions")
+    parser.add_argument("--playlist-size", type=int, default=2000)
+    parser.add_argument("--scenario", help="only run scenarios whose name contains this")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--output", help="results file (default bench/results/<commit>.json)")
+    parser.add_argument(
+        "--baseline", nargs="?", const="root", metavar="COMMIT",
+        help="benchmark COMMIT (default: the first commit) instead of the working tree"
+    )
+    options = parser.parse_args()
+
+    checkout = tempfile.TemporaryDirectory(prefix="rhythm-radar-baseline-")
+    app_dir, app_module = BACKEND_DIR, "main:app"
+    commit, dirty = git_commit()
+    if options.baseline:
+        commit, dirty = extract_baseline(options.baseline, checkout.name), False
+        app_dir, app_module = checkout.name, "baseline_app:app"
+
+    with checkout, postgres() as database_url:
+        sessions = [session_id for _, session_id in seed_users(database_url, options.users)]
+        if options.baseline:
+            seed_baseline_token(database_url)
+        mock_port, app_port = free_port(), free_port()
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            SPOTIFY_API_BASE=f"http://127.0.0.1:{mock_port}/v1",
+            MIGRATE_ON_STARTUP="false",
+            HISTORY_ENABLED=os.environ.get("HISTORY_ENABLED", "false"),
+            TOKEN_REFRESH_ENABLED="false",
+            LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+        )
+        mock = start_server(["bench.mock_spotify", "--port", str(mock_port)], env, mock_port)
+        app_env = env
+        if options.baseline:
+            # The baseline builds its OAuth client at import and prints token status on every
+            # request; baseline_app.py is loaded from bench/
+            app_env = dict(
+                env,
+                PYTHONPATH=os.path.join(BACKEND_DIR, "bench"),
+                SPOTIFY_CLIENT_ID=env.get("SPOTIFY_CLIENT_ID", "bench"),
+                SPOTIFY_CLIENT_SECRET=env.get("SPOTIFY_CLIENT_SECRET", "bench"),
+            )
+        app = None
+        try:
+            app = start_server(
+                ["uvicorn", app_module, "--port", str(app_port), "--log-level", "warning", "--no-access-log"],
+                app_env, app_port, cwd=app_dir, stdout=subprocess.DEVNULL if options.baseline else None
+            )
+            levels = ",".join(map(str, options.concurrency))
+            print(
+                f"{'baseline ' if options.baseline else ''}commit {commit}{' (uncommitted changes)' if dirty else ''}, "
+                f"at least {options.requests} requests per scenario at concurrency {levels}"
+            )
+            print(HEADER)
+            results = asyncio.run(run_all(options, app_port, mock_port, app.pid, sessions))
+        finally:
+            for process in (app, mock):
+                if process is not None:
+                    process.terminate()
+                    process.wait(timeout=10)
+
+    output = options.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "dirty": dirty,
+            "baseline": bool(options.baseline),
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "config": {
+                "requests": options.requests,
+                "concurrency": options.concurrency,
+                "warmup": options.warmup,
+                "users": options.users,
+                "playlist_size": options.playlist_size,
+                **{name: value for name, value in os.environ.items() if name.startswith(("MOCK_", "SPOTIFY_RATE_"))}
+            },
+            "scenarios": results
+        }, f, indent=2)
+    print(f"Saved {output}")
+
+    if options.compare:
+        compare(results, options.compare)
+
+if __name__ == "__main__":
+    main()
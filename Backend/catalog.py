@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from metrics import register_collector
+
+# Catalog cache settings
+CATALOG_TTL = int(os.environ.get("CATALOG_TTL", "86400"))  # seconds; catalog metadata changes rarely
+CATALOG_MAX_ENTRIES = int(os.environ.get("CATALOG_MAX_ENTRIES", "50000"))  # per kind
+
+# Batch size of each Spotify "several items" endpoint, and the fields kept per item
+CATALOG_KINDS = {
+    'artists': {'batch_size': 50, 'fields': ('id', 'name', 'genres', 'popularity', 'images')},
+    'albums': {'batch_size': 20, 'fields': ('id', 'name', 'album_type', 'release_date', 'images', 'label', 'genres')},
+    'tracks': {'batch_size': 50, 'fields': ('id', 'name', 'duration_ms', 'popularity', 'explicit', 'external_ids')},
+}
+
+class CatalogCache:
+    """
+    Artist, album and track metadata shared by every user (catalog data isn't user-specific).
+    Entries expire after CATALOG_TTL and the least recently used are evicted past
+    CATALOG_MAX_ENTRIES. Misses are fetched through Spotify's batch endpoints, and
+    ids already being fetched for another request are awaited rather than re-requested.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL, max_entries=CATALOG_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {kind: OrderedDict() for kind in CATALOG_KINDS}  # kind -> id -> (item, expires_at)
+        self._inflight = {kind: {} for kind in CATALOG_KINDS}  # kind -> id -> future
+        self.stats = {"hits": 0, "misses": 0, "batch_calls": 0, "evictions": 0}
+
+    def _get(self, kind, item_id, now):
+        entries = self._entries[kind]
+        entry = entries.get(item_id)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            del entries[item_id]
+            return None
+        entries.move_to_end(item_id)
+        return entry[0]
+
+    def _put(self, kind, item, now):
+        entries = self._entries[kind]
+        fields = CATALOG_KINDS[kind]['fields']
+        entries[item['id']] = ({field: item.get(field) for field in fields}, now + self.ttl)
+        entries.move_to_end(item['id'])
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get_many(self, sp, kind, ids):
+        """Return {id: item} for ids (unknown ids are left out), fetching misses in batches"""
+        now = time.time()
+        found = {}
+        missing = []
+        waiting = {}
+        for item_id in dict.fromkeys(ids):
+            if not item_id:
+                continue
+            item = self._get(kind, item_id, now)
+            if item is not None:
+                found[item_id] = item
+            elif item_id in self._inflight[kind]:
+                waiting[item_id] = self._inflight[kind][item_id]
+            else:
+                missing.append(item_id)
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(missing)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {item_id: loop.create_future() for item_id in missing}
+            self._inflight[kind].update(futures)
+            batch_size = CATALOG_KINDS[kind]['batch_size']
+            batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+            try:
+                await asyncio.gather(*(self._fetch_batch(sp, kind, batch, futures) for batch in batches))
+            finally:
+                for item_id, future in futures.items():
+                    self._inflight[kind].pop(item_id, None)
+                    if not future.done():
+                        future.set_result(None)
+            waiting.update(futures)
+
+        for item_id, future in waiting.items():
+            item = await asyncio.shield(future)
+            if item is not None:
+                found[item_id] = item
+        return found
+
+    async def _fetch_batch(self, sp, kind, batch, futures):
+        self.stats["batch_calls"] += 1
+        try:
+            results = await getattr(sp, kind)(batch)
+        except Exception as e:
+            for item_id in batch:
+                if not futures[item_id].done():
+                    futures[item_id].set_exception(e)
+                    # Mark retrieved so an unawaited failure doesn't log a warning
+                    futures[item_id].exception()
+            raise
+
+        now = time.time()
+        for item in results[kind]:
+            # Unknown ids come back as null
+            if item is not None:
+                self._put(kind, item, now)
+        for item_id in batch:
+            if not futures[item_id].done():
+                futures[item_id].set_result(self._get(kind, item_id, now))
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        for kind, entries in self._entries.items():
+            stats[f"{kind}_cached"] = len(entries)
+        return stats
+
+# Shared catalog cache
+catalog = CatalogCache()
+register_collector(lambda: {f"catalog_{name}": value for name, value in catalog.get_stats().items()})
+
+async def enrich_artist_genres(sp, tracks):
+    """
+    Return copies of formatted tracks with 'genres' added to each artist.
+    Every distinct artist is looked up once through the catalog.
+    """
+    artist_ids = [artist['id'] for track in tracks for artist in track['artists']]
+    artists = await catalog.get_many(sp, 'artists', artist_ids)
+    return [
+        dict(track, artists=[
+            dict(artist, genres=(artists.get(artist['id']) or {}).get('genres', []))
+            for artist in track['artists']
+        ])
+        for track in tracks
+    ]
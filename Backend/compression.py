@@ -0,0 +1,66 @@
+import os
+from starlette.middleware.gzip import GZipMiddleware
+
+# Brotli is optional; without it responses are gzip-compressed only
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))  # bytes
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+
+# Streamed line by line; compressors buffer output, which would hold back the first lines
+STREAMING_MEDIA_TYPES = (b"text/event-stream", b"application/x-ndjson")
+# Set on streaming responses so the compressors leave them alone (both skip responses that
+# already have a Content-Encoding), then removed again before the response goes out
+_PASSTHROUGH_HEADER = (b"content-encoding", b"identity")
+
+def _is_streaming_request(scope, headers):
+    if b"text/event-stream" in headers.get(b"accept", b"") or scope["path"].endswith(("/stream", "/events")):
+        return True
+    return b"stream=true" in scope.get("query_string", b"").lower()
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli when installed and accepted, otherwise gzip.
+    Server-sent event and NDJSON streams are passed through so each line is delivered immediately.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.gzip = GZipMiddleware(self._mark_streams, minimum_size=minimum_size, compresslevel=GZIP_LEVEL)
+        self.brotli = None
+        if BrotliMiddleware is not None:
+            self.brotli = BrotliMiddleware(self._mark_streams, minimum_size=minimum_size, quality=BROTLI_QUALITY, gzip_fallback=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if _is_streaming_request(scope, headers):
+            return await self.app(scope, receive, send)
+
+        async def send_unmarked(message):
+            if message["type"] == "http.response.start" and _PASSTHROUGH_HEADER in message["headers"]:
+                message["headers"] = [header for header in message["headers"] if header != _PASSTHROUGH_HEADER]
+            await send(message)
+
+        if self.brotli is not None and b"br" in headers.get(b"accept-encoding", b""):
+            return await self.brotli(scope, receive, send_unmarked)
+        return await self.gzip(scope, receive, send_unmarked)
+
+    async def _mark_streams(self, scope, receive, send):
+        """Run the app, marking streaming responses (by media type) as not to be compressed"""
+        async def send_marked(message):
+            if message["type"] == "http.response.start":
+                content_type = dict(message["headers"]).get(b"content-type", b"")
+                if content_type.startswith(STREAMING_MEDIA_TYPES) and not any(
+                    name == b"content-encoding" for name, _ in message["headers"]
+                ):
+                    message["headers"] = [*message["headers"], _PASSTHROUGH_HEADER]
+            await send(message)
+
+        await self.app(scope, receive, send_marked)
@@ -1,21 +1,232 @@
 import os
 import json
+import time
 import hashlib
+import secrets
+import uuid
+import threading
+import weakref
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor, execute_values
+from metrics import timed_db, register_collector
+
+# Connection pool settings (override through environment variables)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))  # max connection age in seconds
+DB_POOL_PING_AFTER = int(os.environ.get("DB_POOL_PING_AFTER", "30"))  # health check connections idle this long
+
+SESSION_MAX_AGE_DAYS = int(os.environ.get("SESSION_MAX_AGE_DAYS", "30"))
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+
+# Per-connection bookkeeping, keyed by the connection itself. Weak keys: the pool closes
+# and drops connections above DB_POOL_MIN on its own, and their entries go with them.
+_conn_created = weakref.WeakKeyDictionary()
+_conn_last_used = weakref.WeakKeyDictionary()
+
+pool_stats = {
+    "checkouts": 0,
+    "waits": 0,
+    "exhausted": 0,
+    "recycled": 0,
+    "health_check_failures": 0,
+    "in_use": 0,
+}
+
+def _bump(name, amount=1):
+    with _stats_lock:
+        pool_stats[name] += amount
 
 def get_db_connection():
-    """Create a connection to the PostgreSQL database"""
+    """Create a standalone (unpooled) connection to the PostgreSQL database"""
     conn = psycopg2.connect(os.environ["DATABASE_URL"])
     conn.autocommit = True
     return conn
 
+def _get_pool():
+    """Create the shared connection pool on first use"""
+    global _pool, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, os.environ["DATABASE_URL"])
+                # psycopg2 opens minconn connections up front but also closes any connection returned
+                # while minconn are idle; keep up to DB_POOL_MAX idle so connections are actually reused
+                _pool.minconn = DB_POOL_MAX
+    return _pool
+
+def _ping(conn):
+    """Return True if the connection still answers a trivial query"""
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _discard(db_pool, conn):
+    _conn_created.pop(conn, None)
+    _conn_last_used.pop(conn, None)
+    db_pool.putconn(conn, close=True)
+
+def _checkout():
+    """Take a healthy connection from the pool, waiting up to DB_POOL_TIMEOUT"""
+    db_pool = _get_pool()
+    if not _pool_slots.acquire(blocking=False):
+        _bump("waits")
+        if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            _bump("exhausted")
+            raise pool.PoolError(f"Connection pool exhausted ({DB_POOL_MAX} connections in use)")
+
+    conn = None
+    try:
+        # Every candidate gets the same checks, including one taken to replace a discarded
+        # connection (it may be another stale pooled connection rather than a new one)
+        for attempt in range(DB_POOL_MAX + 1):
+            conn = db_pool.getconn()
+            now = time.time()
+            created = _conn_created.setdefault(conn, now)
+
+            # Recycle connections that are closed or too old
+            if conn.closed or now - created > DB_POOL_RECYCLE:
+                _bump("recycled")
+            else:
+                # New connections are not autocommit; set it before the health check, whose
+                # SELECT would otherwise leave a transaction open
+                if not conn.autocommit:
+                    conn.autocommit = True
+                # Health check replacements, and connections that have been idle for a while
+                if not (attempt or now - _conn_last_used.get(conn, now) > DB_POOL_PING_AFTER) or _ping(conn):
+                    break
+                _bump("health_check_failures")
+            _discard(db_pool, conn)
+            conn = None
+        else:
+            raise pool.PoolError("No healthy database connection available")
+
+        _bump("checkouts")
+        _bump("in_use")
+        return conn
+    except Exception:
+        # Hand back a connection taken from the pool, or it stays counted as in use for good
+        if conn is not None:
+            _discard(db_pool, conn)
+        _pool_slots.release()
+        raise
+
+def _checkin(conn, broken=False):
+    """Return a connection to the pool, closing it if it is no longer usable"""
+    db_pool = _get_pool()
+    try:
+        if broken or conn.closed:
+            _discard(db_pool, conn)
+        else:
+            _conn_last_used[conn] = time.time()
+            db_pool.putconn(conn)
+    finally:
+        _bump("in_use", -1)
+        _pool_slots.release()
+
+@contextmanager
+def get_db_cursor(cursor_factory=None):
+    """Yield a cursor on a pooled connection and return the connection afterwards"""
+    conn = _checkout()
+    broken = False
+    try:
+        cursor = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        _checkin(conn, broken)
+
+@contextmanager
+def get_db_transaction(cursor_factory=None):
+    """
+    Like get_db_cursor, but the statements run on the cursor form one transaction:
+    committed when the block exits, rolled back if it raises
+    """
+    conn = _checkout()
+    broken = False
+    try:
+        # Pooled connections are autocommit; _checkout turns it back on for the next user
+        conn.autocommit = False
+        cursor = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        _checkin(conn, broken)
+
+def get_pool_stats():
+    """Snapshot of pool usage counters"""
+    with _stats_lock:
+        stats = dict(pool_stats)
+    stats["max_size"] = DB_POOL_MAX
+    stats["open_connections"] = sum(1 for conn in list(_conn_created.keys()) if not conn.closed)
+    return stats
+
+register_collector(lambda: {f"db_pool_{name}": value for name, value in get_pool_stats().items()})
+
+def close_pool():
+    """Close every pooled connection (called on app shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _conn_created.clear()
+            _conn_last_used.clear()
+
+# Bump when the tables created in _create_tables change, so the next migration applies them
+SCHEMA_VERSION = 6
+# pg_advisory_lock key held while migrating, so concurrent workers don't race
+MIGRATION_LOCK_ID = int(os.environ.get("MIGRATION_LOCK_ID", "726879746"))
+
+@timed_db
 def init_db():
-    """Initialize database tables if they don't exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create tokens table
+    """
+    Create or update the database tables; returns True if anything was applied.
+    Runs under an advisory lock: other workers wait, then find the schema current.
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            cursor.execute("SELECT max(version) FROM schema_version")
+            if (cursor.fetchone()[0] or 0) >= SCHEMA_VERSION:
+                return False
+            _create_tables(cursor)
+            cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
+            return True
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+def _create_tables(cursor):
+    """Create tables and indexes that don't exist yet (every statement is idempotent)"""
+    # Create tokens table (expires_at and refresh_lease_until, unix seconds, drive the background refresher)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS tokens (
         user_id VARCHAR(255) PRIMARY KEY,
@@ -23,31 +234,149 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
+    ALTER TABLE tokens ADD COLUMN IF NOT EXISTS expires_at BIGINT;
+    ALTER TABLE tokens ADD COLUMN IF NOT EXISTS refresh_lease_until DOUBLE PRECISION NOT NULL DEFAULT 0;
+    UPDATE tokens SET expires_at = (token_data->>'expires_at')::bigint
+    WHERE expires_at IS NULL AND token_data ? 'expires_at';
+    CREATE INDEX IF NOT EXISTS tokens_expires_at_idx ON tokens (expires_at);
     """)
-    
+
     # Create used_codes table
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS used_codes (
         code VARCHAR(255) PRIMARY KEY,
         used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
+    CREATE INDEX IF NOT EXISTS used_codes_used_at_idx ON used_codes (used_at);
+    """)
+
+    # Create sessions table (maps a hashed session id to a Spotify user id)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_hash VARCHAR(255) PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ALTER TABLE sessions ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+    CREATE INDEX IF NOT EXISTS sessions_user_id_idx ON sessions (user_id, last_seen_at);
+    """)
+
+    # Create jobs table (background playlist operations) and the result chunks they write
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id VARCHAR(64) PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL,
+        kind VARCHAR(32) NOT NULL,
+        params JSONB NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'queued',
+        progress JSONB NOT NULL DEFAULT '{}',
+        checkpoint JSONB NOT NULL DEFAULT '{}',
+        result JSONB,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_until TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ALTER TABLE jobs ADD COLUMN IF NOT EXISTS run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+    CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, created_at);
+    CREATE TABLE IF NOT EXISTS job_chunks (
+        job_id VARCHAR(64) NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+        chunk_index INTEGER NOT NULL,
+        data JSONB NOT NULL,
+        PRIMARY KEY (job_id, chunk_index)
+    );
+    """)
+
+    # Create response_cache table (shared response cache, times are unix seconds)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS response_cache (
+        cache_key VARCHAR(512) PRIMARY KEY,
+        value JSONB NOT NULL,
+        fresh_until DOUBLE PRECISION NOT NULL,
+        stale_until DOUBLE PRECISION NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS response_cache_stale_until_idx ON response_cache (stale_until);
+    """)
+
+    # Create playlist_snapshots table (compressed track columns per playlist snapshot)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS playlist_snapshots (
+        playlist_id VARCHAR(64) PRIMARY KEY,
+        snapshot_id VARCHAR(255) NOT NULL,
+        data BYTEA NOT NULL,
+        size INTEGER NOT NULL,
+        accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS playlist_snapshots_accessed_at_idx ON playlist_snapshots (accessed_at);
+    """)
+
+    # Create listening history tables: append-only plays, per-day rollups, and the ingest schedule
+    # (schedule times are unix seconds)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS play_history (
+        user_id VARCHAR(255) NOT NULL,
+        played_at TIMESTAMPTZ NOT NULL,
+        track_id VARCHAR(64) NOT NULL,
+        track_name TEXT NOT NULL,
+        artist_ids TEXT[] NOT NULL,
+        artist_names TEXT[] NOT NULL,
+        duration_ms INTEGER NOT NULL,
+        PRIMARY KEY (user_id, played_at)
+    );
+    CREATE TABLE IF NOT EXISTS play_daily (
+        user_id VARCHAR(255) NOT NULL,
+        day DATE NOT NULL,
+        plays INTEGER NOT NULL,
+        listened_ms BIGINT NOT NULL,
+        PRIMARY KEY (user_id, day)
+    );
+    CREATE TABLE IF NOT EXISTS play_daily_artists (
+        user_id VARCHAR(255) NOT NULL,
+        day DATE NOT NULL,
+        artist_id VARCHAR(64) NOT NULL,
+        artist_name TEXT NOT NULL,
+        plays INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, artist_id)
+    );
+    CREATE TABLE IF NOT EXISTS history_ingest (
+        user_id VARCHAR(255) PRIMARY KEY,
+        cursor_ms BIGINT,
+        next_run_at DOUBLE PRECISION NOT NULL,
+        lease_until DOUBLE PRECISION NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS history_ingest_next_run_at_idx ON history_ingest (next_run_at);
+    """)
+
+    # Create genre_profiles table (per-user genre family weights for each time range)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS genre_profiles (
+        user_id VARCHAR(255) NOT NULL,
+        time_range VARCHAR(32) NOT NULL,
+        weights JSONB NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, time_range)
+    );
+    """)
+
+    # Create genre_profile_shares table (hashed share tokens a user created to let others compare with them)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS genre_profile_shares (
+        token_hash VARCHAR(64) PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS genre_profile_shares_user_id_idx ON genre_profile_shares (user_id);
     """)
-    
-    cursor.close()
-    conn.close()
 
 # Functions for token storage
+@timed_db
 def get_token(user_id):
     """Retrieve a token from the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute("SELECT token_data FROM tokens WHERE user_id = %s", (user_id,))
-    result = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
+    with get_db_cursor(RealDictCursor) as cursor:
+        cursor.execute("SELECT token_data FROM tokens WHERE user_id = %s", (user_id,))
+        result = cursor.fetchone()
+
     if result:
         token_data = result['token_data']
         # Handle both cases: when token_data is already a dict or when it's a string
@@ -61,66 +390,490 @@ def get_token(user_id):
                 return token_data
     return None
 
+@timed_db
 def store_token(user_id, token_info):
     """Store a token in the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Ensure token_info is properly serialized as JSON string
     if isinstance(token_info, dict):
         token_json = json.dumps(token_info)
     else:
         token_json = token_info  # Assume it's already a JSON string
-    
-    cursor.execute(
-        """
-        INSERT INTO tokens (user_id, token_data)
-        VALUES (%s, %s)
-        ON CONFLICT (user_id) 
-        DO UPDATE SET token_data = %s, updated_at = CURRENT_TIMESTAMP
-        """,
-        (user_id, token_json, token_json)
-    )
-    
-    cursor.close()
-    conn.close()
-
-def add_used_code(code):
-    """Add a code to the used_codes table"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create a hash of the code instead of storing the full code
-    code_hash = hashlib.sha256(code.encode()).hexdigest()
-    
-    cursor.execute("INSERT INTO used_codes (code) VALUES (%s) ON CONFLICT DO NOTHING", (code_hash,))
-    
-    cursor.close()
-    conn.close()
-
-def is_code_used(code):
-    """Check if a code has been used before"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create a hash of the code for comparison
+
+    with get_db_cursor() as cursor:
+        # A new token also ends any refresh lease (or a refresh disabled by a revoked grant)
+        cursor.execute(
+            """
+            INSERT INTO tokens (user_id, token_data, expires_at)
+            VALUES (%s, %s, (%s::jsonb->>'expires_at')::bigint)
+            ON CONFLICT (user_id)
+            DO UPDATE SET token_data = EXCLUDED.token_data, expires_at = EXCLUDED.expires_at,
+                refresh_lease_until = 0, updated_at = CURRENT_TIMESTAMP
+            """,
+            (user_id, token_json, token_json)
+        )
+
+@timed_db
+def claim_expiring_tokens(within_seconds, limit, lease_seconds, active_seconds):
+    """
+    Lease up to limit refreshable tokens expiring within within_seconds, soonest first;
+    returns [(user_id, token_data)]. Workers skip each other's locked and leased rows.
+    Only users with a live session used in the last active_seconds are included; anyone
+    else gets a fresh token on demand when they next make a request.
+    """
+    now = time.time()
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE tokens SET refresh_lease_until = %s
+            WHERE user_id IN (
+                SELECT user_id FROM tokens
+                WHERE expires_at < %s AND refresh_lease_until < %s AND token_data ? 'refresh_token'
+                AND EXISTS (
+                    SELECT 1 FROM sessions
+                    WHERE sessions.user_id = tokens.user_id
+                    AND sessions.last_seen_at > NOW() - %s * INTERVAL '1 second'
+                    AND sessions.created_at > NOW() - %s * INTERVAL '1 day'
+                )
+                ORDER BY expires_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT %s
+            )
+            RETURNING user_id, token_data
+            """,
+            (now + lease_seconds, now + within_seconds, now, active_seconds, SESSION_MAX_AGE_DAYS, limit)
+        )
+        return cursor.fetchall()
+
+@timed_db
+def disable_token_refresh(user_id):
+    """Stop background refreshes for a token whose grant was revoked (until the user logs in again)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("UPDATE tokens SET refresh_lease_until = 'Infinity' WHERE user_id = %s", (user_id,))
+
+# Functions for session storage
+def _hash_session(session_id):
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+@timed_db
+def create_session(user_id):
+    """Create a new session for a user and return its id"""
+    session_id = secrets.token_urlsafe(32)
+
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO sessions (session_hash, user_id) VALUES (%s, %s)",
+            (_hash_session(session_id), user_id)
+        )
+
+    return session_id
+
+@timed_db
+def get_session(session_id):
+    """
+    Return (user id, seconds until the session expires) for a session, or None if it is
+    unknown or expired. Records the session as seen (the token refresher uses this).
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE sessions SET last_seen_at = LOCALTIMESTAMP
+            WHERE session_hash = %s AND created_at > NOW() - %s * INTERVAL '1 day'
+            RETURNING user_id, EXTRACT(EPOCH FROM created_at + %s * INTERVAL '1 day' - LOCALTIMESTAMP)
+            """,
+            (_hash_session(session_id), SESSION_MAX_AGE_DAYS, SESSION_MAX_AGE_DAYS)
+        )
+        result = cursor.fetchone()
+
+    return (result[0], float(result[1])) if result else None
+
+@timed_db
+def delete_session(session_id):
+    """Remove a session"""
+    with get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM sessions WHERE session_hash = %s", (_hash_session(session_id),))
+
+@timed_db
+def claim_code(code):
+    """Record an authorization code as used; returns False if it had been used already"""
+    # Store a hash of the code instead of the full code
     code_hash = hashlib.sha256(code.encode()).hexdigest()
-    
-    cursor.execute("SELECT 1 FROM used_codes WHERE code = %s", (code_hash,))
-    result = cursor.fetchone() is not None
-    
-    cursor.close()
-    conn.close()
-    
-    return result
-
-def cleanup_old_codes():
-    """Remove codes older than 30 days"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM used_codes WHERE used_at < NOW() - INTERVAL '30 days'")
-    
-    cursor.close()
-    conn.close()
 
+    with get_db_cursor() as cursor:
+        # One atomic statement, so two callbacks with the same code can't both succeed
+        cursor.execute(
+            "INSERT INTO used_codes (code) VALUES (%s) ON CONFLICT DO NOTHING RETURNING 1",
+            (code_hash,)
+        )
+        return cursor.fetchone() is not None
+
+@timed_db
+def expire_used_codes(max_age_seconds, batch_size):
+    """Delete up to batch_size codes used more than max_age_seconds ago; returns the number deleted"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM used_codes WHERE code IN (
+                SELECT code FROM used_codes
+                WHERE used_at < NOW() - make_interval(secs => %s)
+                LIMIT %s
+            )
+            """,
+            (max_age_seconds, batch_size)
+        )
+        return cursor.rowcount
+
+# Functions for background jobs
+@timed_db
+def create_job(user_id, kind, params):
+    """Queue a job and return its id"""
+    job_id = uuid.uuid4().hex
+
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO jobs (id, user_id, kind, params) VALUES (%s, %s, %s, %s)",
+            (job_id, user_id, kind, json.dumps(params))
+        )
+
+    return job_id
+
+@timed_db
+def get_job(job_id, user_id):
+    """Return a job owned by user_id, or None"""
+    with get_db_cursor(RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            SELECT id, kind, status, progress, result, error, attempts, created_at, updated_at
+            FROM jobs WHERE id = %s AND user_id = %s
+            """,
+            (job_id, user_id)
+        )
+        return cursor.fetchone()
+
+@timed_db
+def claim_job(lease_seconds):
+    """
+    Claim the oldest runnable job: queued and past its run_after (retries back off),
+    or running with an expired lease (its worker died). Returns the job row or None.
+    """
+    with get_db_cursor(RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1,
+                lease_until = NOW() + %s * INTERVAL '1 second', updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status = 'queued' AND run_after <= NOW()) OR (status = 'running' AND lease_until < NOW())
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, user_id, kind, params, progress, checkpoint, attempts
+            """,
+            (lease_seconds,)
+        )
+        return cursor.fetchone()
+
+@timed_db
+def update_job(job_id, lease_seconds, progress=None, checkpoint=None):
+    """Renew a job's lease and record its progress and/or checkpoint"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET progress = COALESCE(%s::jsonb, progress),
+                checkpoint = COALESCE(%s::jsonb, checkpoint),
+                lease_until = NOW() + %s * INTERVAL '1 second',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            """,
+            (
+                json.dumps(progress) if progress is not None else None,
+                json.dumps(checkpoint) if checkpoint is not None else None,
+                lease_seconds,
+                job_id
+            )
+        )
+
+@timed_db
+def finish_job(job_id, status, result=None, error=None, retry_in=None):
+    """Mark a job done, failed, or queued again for another attempt (no sooner than retry_in seconds)"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = %s, result = %s, error = %s, lease_until = NULL, updated_at = CURRENT_TIMESTAMP,
+                run_after = COALESCE(NOW() + %s::double precision * INTERVAL '1 second', run_after)
+            WHERE id = %s
+            """,
+            (status, json.dumps(result) if result is not None else None, error, retry_in, job_id)
+        )
+
+@timed_db
+def store_job_chunk(job_id, chunk_index, data, checkpoint, lease_seconds):
+    """Save one chunk of a job's output together with the checkpoint that follows it"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            WITH chunk AS (
+                INSERT INTO job_chunks (job_id, chunk_index, data)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (job_id, chunk_index) DO UPDATE SET data = EXCLUDED.data
+            )
+            UPDATE jobs
+            SET checkpoint = %s, lease_until = NOW() + %s * INTERVAL '1 second', updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            """,
+            (job_id, chunk_index, json.dumps(data), json.dumps(checkpoint), lease_seconds, job_id)
+        )
+
+@timed_db
+def get_job_chunks(job_id):
+    """Return a job's output chunks in order"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT data FROM job_chunks WHERE job_id = %s ORDER BY chunk_index", (job_id,))
+        return [row[0] for row in cursor.fetchall()]
+
+@timed_db
+def delete_job_chunks(job_id):
+    """Drop a job's output chunks (when it has to start over)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM job_chunks WHERE job_id = %s", (job_id,))
+
+# Functions for the shared response cache
+@timed_db
+def get_cached_response(cache_key):
+    """Return (value, fresh_until, stale_until) for a cache key, or None if missing or expired"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "SELECT value, fresh_until, stale_until FROM response_cache WHERE cache_key = %s AND stale_until > %s",
+            (cache_key, time.time())
+        )
+        return cursor.fetchone()
+
+@timed_db
+def store_cached_response(cache_key, value, fresh_until, stale_until):
+    """Store a cached response and drop entries that have fully expired"""
+    value_json = json.dumps(value)
+
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO response_cache (cache_key, value, fresh_until, stale_until)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (cache_key)
+            DO UPDATE SET value = EXCLUDED.value, fresh_until = EXCLUDED.fresh_until, stale_until = EXCLUDED.stale_until
+            """,
+            (cache_key, value_json, fresh_until, stale_until)
+        )
+        cursor.execute("DELETE FROM response_cache WHERE stale_until < %s", (time.time(),))
+
+# Functions for the playlist snapshot store
+
+@timed_db
+def get_playlist_snapshot(playlist_id):
+    """Return (snapshot_id, data) for a stored playlist (marking it as accessed), or None"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE playlist_snapshots SET accessed_at = CURRENT_TIMESTAMP
+            WHERE playlist_id = %s
+            RETURNING snapshot_id, data
+            """,
+            (playlist_id,)
+        )
+        row = cursor.fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+@timed_db
+def store_playlist_snapshot(playlist_id, snapshot_id, data, max_bytes, max_age_days):
+    """
+    Store a playlist snapshot, then evict snapshots not accessed in max_age_days
+    and the least recently accessed ones until the store fits in max_bytes
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO playlist_snapshots (playlist_id, snapshot_id, data, size, accessed_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (playlist_id)
+            DO UPDATE SET snapshot_id = EXCLUDED.snapshot_id, data = EXCLUDED.data,
+                          size = EXCLUDED.size, accessed_at = CURRENT_TIMESTAMP
+            """,
+            (playlist_id, snapshot_id, psycopg2.Binary(data), len(data))
+        )
+        cursor.execute(
+            """
+            DELETE FROM playlist_snapshots
+            WHERE accessed_at < NOW() - %s * INTERVAL '1 day'
+               OR playlist_id IN (
+                   SELECT playlist_id FROM (
+                       SELECT playlist_id, SUM(size) OVER (ORDER BY accessed_at DESC, playlist_id) AS running_size
+                       FROM playlist_snapshots
+                   ) ranked
+                   WHERE running_size > %s
+               )
+            """,
+            (max_age_days, max_bytes)
+        )
+
+# Functions for listening history
+
+@timed_db
+def enroll_history_user(user_id):
+    """Add a user to the history ingest schedule (first run as soon as possible)"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO history_ingest (user_id, next_run_at) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
+            (user_id, time.time())
+        )
+
+@timed_db
+def claim_history_users(limit, lease_seconds):
+    """Lease up to limit users whose next ingest run is due; returns [(user_id, cursor_ms)]"""
+    now = time.time()
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE history_ingest SET lease_until = %s
+            WHERE user_id IN (
+                SELECT user_id FROM history_ingest
+                WHERE next_run_at <= %s AND lease_until < %s
+                ORDER BY next_run_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT %s
+            )
+            RETURNING user_id, cursor_ms
+            """,
+            (now + lease_seconds, now, now, limit)
+        )
+        return cursor.fetchall()
+
+@timed_db
+def store_plays(user_id, plays, cursor_ms, next_run_at):
+    """
+    Append plays [(played_at, track_id, track_name, artist_ids, artist_names, duration_ms)],
+    skipping ones already stored, add the new ones to the daily rollups, and advance
+    the user's cursor and schedule, all in one transaction
+    """
+    with get_db_transaction() as cursor:
+        if plays:
+            execute_values(
+                cursor,
+                """
+                WITH new AS (
+                    INSERT INTO play_history (user_id, played_at, track_id, track_name, artist_ids, artist_names, duration_ms)
+                    VALUES %s
+                    ON CONFLICT (user_id, played_at) DO NOTHING
+                    RETURNING user_id, (played_at AT TIME ZONE 'UTC')::date AS day, artist_ids, artist_names, duration_ms
+                ),
+                daily AS (
+                    INSERT INTO play_daily (user_id, day, plays, listened_ms)
+                    SELECT user_id, day, COUNT(*), SUM(duration_ms) FROM new GROUP BY user_id, day
+                    ON CONFLICT (user_id, day)
+                    DO UPDATE SET plays = play_daily.plays + EXCLUDED.plays,
+                                  listened_ms = play_daily.listened_ms + EXCLUDED.listened_ms
+                )
+                INSERT INTO play_daily_artists (user_id, day, artist_id, artist_name, plays)
+                SELECT user_id, day, artist_id, MAX(artist_name), COUNT(*)
+                FROM new, UNNEST(artist_ids, artist_names) AS artist (artist_id, artist_name)
+                GROUP BY user_id, day, artist_id
+                ON CONFLICT (user_id, day, artist_id)
+                DO UPDATE SET plays = play_daily_artists.plays + EXCLUDED.plays
+                """,
+                [(user_id,) + tuple(play) for play in plays],
+                template="(%s, %s, %s, %s, %s::text[], %s::text[], %s)"
+            )
+        cursor.execute(
+            "UPDATE history_ingest SET cursor_ms = COALESCE(%s, cursor_ms), next_run_at = %s, lease_until = 0 WHERE user_id = %s",
+            (cursor_ms, next_run_at, user_id)
+        )
+
+@timed_db
+def reschedule_history_user(user_id, next_run_at):
+    """Release a user's ingest lease and set their next run (after a failed run)"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "UPDATE history_ingest SET next_run_at = %s, lease_until = 0 WHERE user_id = %s",
+            (next_run_at, user_id)
+        )
+
+@timed_db
+def get_listening_summary(user_id, days, top_artists=5):
+    """Plays, listening time and top artists over the last `days` days, from the daily rollups"""
+    with get_db_cursor(RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            SELECT COALESCE(SUM(plays), 0)::bigint AS plays, COALESCE(SUM(listened_ms), 0)::bigint AS listened_ms,
+                   COUNT(*) AS active_days
+            FROM play_daily
+            WHERE user_id = %s AND day > (NOW() AT TIME ZONE 'UTC')::date - %s
+            """,
+            (user_id, days)
+        )
+        summary = dict(cursor.fetchone())
+        cursor.execute(
+            """
+            SELECT artist_id AS id, MAX(artist_name) AS name, SUM(plays)::bigint AS plays
+            FROM play_daily_artists
+            WHERE user_id = %s AND day > (NOW() AT TIME ZONE 'UTC')::date - %s
+            GROUP BY artist_id
+            ORDER BY plays DESC, artist_id
+            LIMIT %s
+            """,
+            (user_id, days, top_artists)
+        )
+        summary["top_artists"] = [dict(row) for row in cursor.fetchall()]
+        return summary
+
+# Functions for genre profiles
+
+@timed_db
+def store_genre_profile(user_id, time_range, weights):
+    """Save a user's genre family weights for a time range"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO genre_profiles (user_id, time_range, weights, updated_at)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id, time_range)
+            DO UPDATE SET weights = EXCLUDED.weights, updated_at = CURRENT_TIMESTAMP
+            """,
+            (user_id, time_range, json.dumps(weights))
+        )
+
+@timed_db
+def create_genre_share(user_id):
+    """Create a token that lets other users compare against this user's genre profile; returns it"""
+    share_token = secrets.token_urlsafe(16)
+
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO genre_profile_shares (token_hash, user_id) VALUES (%s, %s)",
+            (hashlib.sha256(share_token.encode()).hexdigest(), user_id)
+        )
+
+    return share_token
+
+@timed_db
+def delete_genre_shares(user_id):
+    """Revoke every share token a user created; returns how many there were"""
+    with get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM genre_profile_shares WHERE user_id = %s", (user_id,))
+        return cursor.rowcount
+
+@timed_db
+def get_shared_genre_profile(share_token, time_range):
+    """Return the saved genre family weights of the user who created share_token, or None"""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT genre_profiles.weights
+            FROM genre_profile_shares
+            JOIN genre_profiles ON genre_profiles.user_id = genre_profile_shares.user_id
+            WHERE genre_profile_shares.token_hash = %s AND genre_profiles.time_range = %s
+            """,
+            (hashlib.sha256(share_token.encode()).hexdigest(), time_range)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
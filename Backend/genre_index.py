@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import math
+from array import array
+from collections import Counter
+
+# Bundled genre family data (see data/genre_families.json)
+GENRE_DATA_PATH = os.environ.get(
+    "GENRE_DATA_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "genre_families.json")
+)
+GENRE_INDEX_MAX_GENRES = int(os.environ.get("GENRE_INDEX_MAX_GENRES", "20000"))  # cap on genres remembered at runtime
+
+OTHER_FAMILY = "other"
+
+class GenreIndex:
+    """
+    Maps Spotify's fine-grained genre strings to broad families.
+
+    Families and genres get small integer ids; genre strings are interned and
+    each genre's family is kept in a compact array, so classifying a genre
+    that has been seen before is one dict lookup.
+    """
+
+    def __init__(self, families):
+        self.families = [sys.intern(name) for name in families] + [OTHER_FAMILY]
+        self.other_id = len(self.families) - 1
+        self._phrases = {}
+        self._tokens = {}
+        for family_id, name in enumerate(families):
+            for phrase in families[name].get("phrases", ()):
+                self._phrases[sys.intern(phrase.lower())] = family_id
+            for token in families[name].get("tokens", ()):
+                self._tokens[sys.intern(token.lower())] = family_id
+
+        self._genre_ids = {}  # genre -> genre id
+        self._genre_family = array("H")  # genre id -> family id
+
+    @classmethod
+    def load(cls, path=GENRE_DATA_PATH):
+        with open(path) as f:
+            return cls(json.load(f)["families"])
+
+    def _match(self, genre):
+        """Family id for a genre: exact phrase, else its tokens from last to first"""
+        family_id = self._phrases.get(genre)
+        if family_id is None:
+            family_id = self._tokens.get(genre)
+        if family_id is not None:
+            return family_id
+        for token in reversed(genre.split()):
+            family_id = self._tokens.get(token)
+            if family_id is not None:
+                return family_id
+            # Hyphenated words ("post-rock", "afro-cuban") fall back to their parts
+            for part in reversed(token.split("-")):
+                family_id = self._tokens.get(part)
+                if family_id is not None:
+                    return family_id
+        return self.other_id
+
+    def genre_id(self, genre):
+        """Integer id for a genre string, classifying it on first sight"""
+        genre_id = self._genre_ids.get(genre)
+        if genre_id is None:
+            if len(self._genre_ids) >= GENRE_INDEX_MAX_GENRES:
+                return None
+            genre_id = self._genre_ids[sys.intern(genre)] = len(self._genre_family)
+            self._genre_family.append(self._match(genre.lower()))
+        return genre_id
+
+    def family_id(self, genre):
+        genre_id = self.genre_id(genre)
+        if genre_id is None:
+            # Index is full: classify without remembering
+            return self._match(genre.lower())
+        return self._genre_family[genre_id]
+
+    def family(self, genre):
+        return self.families[self.family_id(genre)]
+
+    def vector(self, artists, weight):
+        """
+        Family vector for ranked artists: each artist adds weight(artist_id), split
+        evenly across its genres' families. Returned L2-normalized, so the dot
+        product of two vectors is their cosine similarity.
+        """
+        values = [0.0] * len(self.families)
+        for artist_id, artist in artists.items():
+            genres = artist["genres"]
+            if not genres:
+                continue
+            share = weight(artist_id) / len(genres)
+            for genre in genres:
+                values[self.family_id(genre)] += share
+        return normalize(values)
+
+    def family_counts(self, genres):
+        """Counter of family names for a Counter of genre strings"""
+        counts = Counter()
+        for genre, count in genres.items():
+            counts[self.family(genre)] += count
+        return counts
+
+    def describe(self, vector, n=None):
+        """Families with non-zero weight, largest first"""
+        ranked = sorted(
+            ((self.families[family_id], value) for family_id, value in enumerate(vector) if value > 0),
+            key=lambda item: (-item[1], item[0])
+        )
+        return [{"family": family, "weight": round(value, 4)} for family, value in ranked[:n]]
+
+    def weights(self, vector):
+        """Vector as {family: weight}, for storage that outlives changes to the family list"""
+        return {self.families[family_id]: round(value, 6) for family_id, value in enumerate(vector) if value > 0}
+
+    def from_weights(self, weights):
+        """Normalized vector from a {family: weight} mapping (unknown families are dropped)"""
+        family_ids = {family: family_id for family_id, family in enumerate(self.families)}
+        values = [0.0] * len(self.families)
+        for family, value in weights.items():
+            if family in family_ids:
+                values[family_ids[family]] = value
+        return normalize(values)
+
+def normalize(values):
+    norm = math.sqrt(sum(value * value for value in values))
+    return array("f", (value / norm for value in values) if norm else values)
+
+def cosine(a, b):
+    """Cosine similarity of two normalized vectors (0 when either is empty)"""
+    if len(a) != len(b):
+        return 0.0
+    return round(sum(x * y for x, y in zip(a, b)), 4)
+
+# Built once when the app starts
+genre_index = GenreIndex.load()
@@ -0,0 +1,147 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from auth import get_async_spotify_client, get_current_user
+from music_stats import get_top_artists_cached
+from analytics import get_user_analytics, top_counts, TIME_RANGES
+from genre_index import genre_index, cosine
+from db import store_genre_profile, create_genre_share, delete_genre_shares, get_shared_genre_profile
+import json
+import asyncio
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/api/genre-profile",
+    tags=["genre_profile"]
+)
+
+# Aggregate -> version last saved to genre_profiles (entries go when analytics evicts the user)
+_saved_versions = weakref.WeakKeyDictionary()
+
+def _vector(aggregate):
+    return aggregate.derived("genre_vector", lambda a: genre_index.vector(a.artists, a.weight))
+
+async def _load_ranges(user_id, time_ranges):
+    """Refresh the user's aggregates for time_ranges and return them"""
+    sp = await get_async_spotify_client(user_id)
+    results = await asyncio.gather(*(get_top_artists_cached(sp, time_range) for time_range in time_ranges))
+
+    analytics = get_user_analytics(user_id)
+    aggregates = {}
+    for time_range, artists in zip(time_ranges, results):
+        analytics.update_range(time_range, artists)
+        aggregate = aggregates[time_range] = analytics.ranges[time_range]
+
+        # Keep the saved profile (used to compare users) in step with the aggregate
+        if _saved_versions.get(aggregate) != aggregate.version:
+            try:
+                await run_in_threadpool(store_genre_profile, user_id, time_range, genre_index.weights(_vector(aggregate)))
+                _saved_versions[aggregate] = aggregate.version
+            except Exception as e:
+                logger.warning("Saving genre profile failed: %s", e, extra={"user_id": user_id})
+    return aggregates
+
+def _check_time_range(time_range):
+    if time_range not in TIME_RANGES:
+        raise HTTPException(status_code=400, detail=f"time_range must be one of {', '.join(TIME_RANGES)}")
+
+def _error_response(e, action):
+    error_msg = str(e)
+    # Handle case where error might be a dict
+    if hasattr(e, '__dict__'):
+        try:
+            error_msg = json.dumps(e.__dict__)
+        except:
+            error_msg = "Error serializing exception"
+    return JSONResponse(
+        status_code=500,
+        content={"error": f"Failed to {action}: {error_msg}"}
+    )
+
+@router.get("")
+async def genre_profile(time_range: str = "medium_term", user_id: str = Depends(get_current_user)):
+    """
+    Genre profile for a time range: weights of broad genre families (from the
+    user's top 50 artists, weighted by rank) and the most common specific genres
+    """
+    _check_time_range(time_range)
+    try:
+        aggregate = (await _load_ranges(user_id, (time_range,)))[time_range]
+        return {
+            'time_range': time_range,
+            'families': genre_index.describe(_vector(aggregate)),
+            'top_genres': [
+                {'genre': genre, 'family': genre_index.family(genre), 'count': count}
+                for genre, count in top_counts(aggregate.genres, 10)
+            ]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _error_response(e, "build genre profile")
+
+@router.get("/similarity")
+async def genre_similarity(user_id: str = Depends(get_current_user)):
+    """Cosine similarity of the user's genre profiles between time ranges"""
+    try:
+        aggregates = await _load_ranges(user_id, TIME_RANGES)
+        vectors = {time_range: _vector(aggregate) for time_range, aggregate in aggregates.items()}
+        return {
+            'short_vs_medium': cosine(vectors['short_term'], vectors['medium_term']),
+            'medium_vs_long': cosine(vectors['medium_term'], vectors['long_term']),
+            'short_vs_long': cosine(vectors['short_term'], vectors['long_term'])
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _error_response(e, "compare genre profiles")
+
+@router.post("/share")
+async def share_genre_profile(user_id: str = Depends(get_current_user)):
+    """
+    Opt in to comparisons: returns a share token that lets whoever holds it compare
+    their genre profile with this user's (they only ever see the similarity score)
+    """
+    try:
+        share_token = await run_in_threadpool(create_genre_share, user_id)
+        return {'share_token': share_token}
+    except Exception as e:
+        return _error_response(e, "share genre profile")
+
+@router.delete("/share")
+async def unshare_genre_profile(user_id: str = Depends(get_current_user)):
+    """Opt out again: revoke every share token the user has handed out"""
+    try:
+        revoked = await run_in_threadpool(delete_genre_shares, user_id)
+        return {'revoked': revoked}
+    except Exception as e:
+        return _error_response(e, "revoke genre profile shares")
+
+@router.get("/compare/{share_token}")
+async def compare_genre_profiles(
+    share_token: str,
+    time_range: str = "medium_term",
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Cosine similarity between the user's genre profile and the saved profile of the
+    user who created share_token (see POST /share), for the same time range
+    """
+    _check_time_range(time_range)
+    try:
+        other = await run_in_threadpool(get_shared_genre_profile, share_token, time_range)
+        if other is None:
+            # Same answer for unknown, revoked and not-yet-saved profiles
+            raise HTTPException(status_code=404, detail="No shared genre profile for that token")
+        aggregate = (await _load_ranges(user_id, (time_range,)))[time_range]
+        return {
+            'time_range': time_range,
+            'similarity': cosine(_vector(aggregate), genre_index.from_weights(other))
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _error_response(e, "compare genre profiles")
@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from auth import get_async_spotify_client
+from db import claim_history_users, store_plays, reschedule_history_user
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# History ingest settings (seconds)
+HISTORY_INTERVAL = int(os.environ.get("HISTORY_INTERVAL", "1800"))  # per-user poll period; recently-played only keeps 50 plays
+HISTORY_POLL_INTERVAL = float(os.environ.get("HISTORY_POLL_INTERVAL", "5"))  # how often to look for due users
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "50"))  # users claimed per round
+HISTORY_CONCURRENCY = int(os.environ.get("HISTORY_CONCURRENCY", "8"))
+HISTORY_LEASE_SECONDS = int(os.environ.get("HISTORY_LEASE_SECONDS", "300"))
+HISTORY_MAX_PAGES = int(os.environ.get("HISTORY_MAX_PAGES", "5"))  # recently-played pages per user per run
+HISTORY_ENABLED = os.environ.get("HISTORY_ENABLED", "true").lower() == "true"
+
+RECENTLY_PLAYED_LIMIT = 50
+
+stats = {"runs": 0, "plays_fetched": 0, "errors": 0}
+register_collector(lambda: {f"history_{name}": value for name, value in stats.items()})
+
+_ingester = None
+
+def next_run_at(user_id, now):
+    """
+    Next slot in the user's fixed phase of the HISTORY_INTERVAL cycle.
+    Phases come from a hash of the user id, so polls are spread evenly over the
+    interval instead of bunching up behind logins or restarts.
+    """
+    phase = int(hashlib.blake2b(user_id.encode(), digest_size=8).hexdigest(), 16) % HISTORY_INTERVAL
+    return ((now - phase) // HISTORY_INTERVAL + 1) * HISTORY_INTERVAL + phase
+
+def _played_at_ms(played_at):
+    return int(datetime.fromisoformat(played_at.replace("Z", "+00:00")).timestamp() * 1000)
+
+def _format_play(item):
+    track = item['track']
+    return (
+        item['played_at'],
+        track['id'],
+        track['name'],
+        [artist['id'] for artist in track['artists']],
+        [artist['name'] for artist in track['artists']],
+        track['duration_ms']
+    )
+
+async def ingest_user(user_id, cursor_ms):
+    """Fetch a user's plays since cursor_ms and store them; returns the number fetched"""
+    sp = await get_async_spotify_client(user_id)
+    plays = []
+    for _ in range(HISTORY_MAX_PAGES):
+        results = await sp.current_user_recently_played(limit=RECENTLY_PLAYED_LIMIT, after=cursor_ms)
+        items = [item for item in results['items'] if item.get('track') and item['track'].get('id')]
+        if not items:
+            break
+        plays.extend(_format_play(item) for item in items)
+        cursor_ms = max(_played_at_ms(item['played_at']) for item in items)
+        if len(results['items']) < RECENTLY_PLAYED_LIMIT:
+            break
+
+    await run_in_threadpool(store_plays, user_id, plays, cursor_ms, next_run_at(user_id, time.time()))
+    return len(plays)
+
+async def _run_user(user_id, cursor_ms, semaphore):
+    async with semaphore:
+        try:
+            stats["plays_fetched"] += await ingest_user(user_id, cursor_ms)
+            stats["runs"] += 1
+        except Exception as e:
+            logger.warning("History ingest failed: %s", e, extra={"user_id": user_id})
+            stats["errors"] += 1
+            await run_in_threadpool(reschedule_history_user, user_id, next_run_at(user_id, time.time()))
+
+async def _ingest_loop():
+    """Claim due users and ingest their plays until cancelled"""
+    semaphore = asyncio.Semaphore(HISTORY_CONCURRENCY)
+    while True:
+        try:
+            due = await run_in_threadpool(claim_history_users, HISTORY_BATCH_SIZE, HISTORY_LEASE_SECONDS)
+        except Exception as e:
+            logger.warning("History claim failed: %s", e)
+            due = []
+
+        if due:
+            await asyncio.gather(
+                *(_run_user(user_id, cursor_ms, semaphore) for user_id, cursor_ms in due),
+                return_exceptions=True
+            )
+        if len(due) < HISTORY_BATCH_SIZE:
+            await asyncio.sleep(HISTORY_POLL_INTERVAL)
+
+def start_history_ingester():
+    """Start the history ingester (called on app startup)"""
+    global _ingester
+    if HISTORY_ENABLED and _ingester is None:
+        _ingester = asyncio.ensure_future(_ingest_loop())
+
+async def stop_history_ingester():
+    """Stop the history ingester (called on app shutdown); leased users are retried once the lease lapses"""
+    global _ingester
+    if _ingester is not None:
+        _ingester.cancel()
+        await asyncio.gather(_ingester, return_exceptions=True)
+        _ingester = None
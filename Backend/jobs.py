@@ -0,0 +1,308 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from auth import get_async_spotify_client, get_current_user, get_stream_user
+from playlist_tool import (
+    AddTracks, extract_playlist_id, format_track, format_playlist, iter_playlist_pages,
+    get_playlist_track_ids, add_tracks_in_batches, dedupe_track_ids, ADD_TRACKS_BATCH_SIZE, PLAYLIST_PAGE_SIZE
+)
+from db import (
+    create_job, get_job, claim_job, update_job, finish_job,
+    store_job_chunk, get_job_chunks, delete_job_chunks
+)
+import os
+import json
+import random
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/api/playlist/jobs",
+    tags=["jobs"]
+)
+
+# Worker settings
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))  # seconds between claims when idle
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))  # a job whose lease lapses is picked up again
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.environ.get("JOB_RETRY_BACKOFF", "30"))  # seconds before the first retry, doubling after
+JOB_CHECKPOINT_PAGES = int(os.environ.get("JOB_CHECKPOINT_PAGES", "10"))  # fetch pages per saved chunk
+
+_workers = []
+
+class FetchJob(BaseModel):
+    playlist_input: str
+
+# Job runners. Each one reads job["checkpoint"] to resume, keeps state["progress"]
+# (and state["checkpoint"] if it isn't saved with a chunk) current for the heartbeat,
+# and returns the job result.
+async def _run_fetch(job, sp, state):
+    params = job['params']
+    checkpoint = job['checkpoint']
+    playlist_id = extract_playlist_id(params['playlist_input'])
+
+    playlist = await sp.playlist(playlist_id)
+    next_offset = checkpoint.get('next_offset', 0)
+    chunk_index = checkpoint.get('chunks', 0)
+    fetched = checkpoint.get('tracks_fetched', 0)
+
+    # Start over if the playlist changed since the last attempt
+    if next_offset and checkpoint.get('snapshot_id') != playlist.get('snapshot_id'):
+        await run_in_threadpool(delete_job_chunks, job['id'])
+        next_offset = chunk_index = fetched = 0
+
+    if next_offset:
+        first_page = await sp.playlist_items(playlist_id, limit=PLAYLIST_PAGE_SIZE, offset=next_offset)
+    else:
+        first_page = playlist['tracks']
+
+    total = playlist['tracks']['total']
+    state['progress'] = {'tracks_fetched': fetched, 'tracks_total': total}
+
+    tracks = []
+    pages_in_chunk = 0
+    async for page in iter_playlist_pages(sp, playlist_id, first_page):
+        tracks.extend(format_track(item['track']) for item in page['items'] if item['track'])
+        next_offset = page.get('offset', next_offset) + len(page['items'])
+        pages_in_chunk += 1
+
+        if pages_in_chunk == JOB_CHECKPOINT_PAGES or next_offset >= total:
+            fetched += len(tracks)
+            await run_in_threadpool(
+                store_job_chunk,
+                job['id'],
+                chunk_index,
+                tracks,
+                {
+                    'next_offset': next_offset,
+                    'chunks': chunk_index + 1,
+                    'tracks_fetched': fetched,
+                    'snapshot_id': playlist.get('snapshot_id')
+                },
+                JOB_LEASE_SECONDS
+            )
+            chunk_index += 1
+            tracks = []
+            pages_in_chunk = 0
+            state['progress'] = {'tracks_fetched': fetched, 'tracks_total': total}
+
+    # Tracks stay in job_chunks; the result only records the metadata
+    return {'playlist': format_playlist(playlist), 'chunks': chunk_index}
+
+async def _landed_batches(sp, playlist_id, track_ids, base_position, batches_done):
+    """Count on from batches_done past batches that are already at their positions in the playlist"""
+    batches_total = -(-len(track_ids) // ADD_TRACKS_BATCH_SIZE)
+    while batches_done < batches_total:
+        expected = track_ids[batches_done * ADD_TRACKS_BATCH_SIZE:(batches_done + 1) * ADD_TRACKS_BATCH_SIZE]
+        page = await sp.playlist_items(
+            playlist_id,
+            fields="items(track(id))",
+            limit=len(expected),
+            offset=base_position + batches_done * ADD_TRACKS_BATCH_SIZE
+        )
+        if [item['track'] and item['track'].get('id') for item in page['items']] != expected:
+            break
+        batches_done += 1
+    return batches_done
+
+async def _run_add_tracks(job, sp, state):
+    params = job['params']
+    checkpoint = job['checkpoint']
+    playlist_id = params['playlist_id']
+
+    if 'base_position' in checkpoint:
+        # Resuming: the track list and insert position were fixed by the first attempt, and
+        # batches_done batches are known to have landed. If the playlist changed since that
+        # checkpoint, look for later batches that landed before it could be saved.
+        track_ids = checkpoint['track_ids']
+        base_position = checkpoint['base_position']
+        playlist = await sp.playlist(playlist_id, fields="id,name,external_urls,snapshot_id,tracks(total)")
+        start_batch = checkpoint.get('batches_done', 0)
+        if playlist.get('snapshot_id') != checkpoint.get('snapshot_id'):
+            start_batch = await _landed_batches(sp, playlist_id, track_ids, base_position, start_batch)
+    else:
+        if params.get('skip_duplicates', True):
+            playlist, existing = await get_playlist_track_ids(sp, playlist_id)
+            track_ids = dedupe_track_ids(params['track_ids'], existing)
+        else:
+            playlist = await sp.playlist(playlist_id, fields="id,name,external_urls,snapshot_id,tracks(total)")
+            track_ids = params['track_ids']
+        base_position = playlist['tracks']['total']
+        start_batch = 0
+        # Save the plan before writing anything so a retry adds exactly the same tracks
+        await run_in_threadpool(
+            update_job, job['id'], JOB_LEASE_SECONDS, None,
+            {
+                'track_ids': track_ids,
+                'base_position': base_position,
+                'batches_done': 0,
+                'snapshot_id': playlist.get('snapshot_id')
+            }
+        )
+
+    batches_total = -(-len(track_ids) // ADD_TRACKS_BATCH_SIZE)
+
+    def on_progress(report):
+        # Batches are sent in order, so every batch up to this one has landed
+        batches_done = report['index'] + 1
+        state['progress'] = {'batches_done': batches_done, 'batches_total': batches_total}
+        state['checkpoint'] = {
+            'track_ids': track_ids,
+            'base_position': base_position,
+            'batches_done': batches_done,
+            'snapshot_id': report['snapshot_id']
+        }
+
+    state['progress'] = {'batches_done': start_batch, 'batches_total': batches_total}
+    batches = await add_tracks_in_batches(
+        sp, playlist_id, track_ids, base_position, start_batch=start_batch, on_progress=on_progress
+    )
+
+    failed = [batch for batch in batches if 'error' in batch]
+    if failed:
+        raise RuntimeError(f"Failed to add {len(failed)} of {len(batches)} batches: {failed[0]['error']}")
+
+    return {
+        'playlist_id': playlist_id,
+        'playlist_name': playlist['name'],
+        'external_url': playlist['external_urls']['spotify'],
+        'added': len(track_ids),
+        'skipped_duplicates': len(params['track_ids']) - len(track_ids)
+    }
+
+_RUNNERS = {
+    'fetch': _run_fetch,
+    'add-tracks': _run_add_tracks,
+}
+
+async def _save_state(job_id, state):
+    """Renew the lease and save progress and any pending checkpoint (dropped only once it is written)"""
+    checkpoint = state.get('checkpoint')
+    await run_in_threadpool(update_job, job_id, JOB_LEASE_SECONDS, state.get('progress'), checkpoint)
+    if checkpoint is not None and state.get('checkpoint') is checkpoint:
+        del state['checkpoint']
+
+async def _heartbeat(job_id, state):
+    """Renew the job lease and publish progress until cancelled"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await _save_state(job_id, state)
+        except Exception as e:
+            logger.warning("Job heartbeat failed: %s", e, extra={"job_id": job_id})
+
+async def _run_job(job):
+    state = {'progress': job['progress']}
+    heartbeat = asyncio.ensure_future(_heartbeat(job['id'], state))
+    try:
+        sp = await get_async_spotify_client(job['user_id'])
+        result = await _RUNNERS[job['kind']](job, sp, state)
+        heartbeat.cancel()
+        await _save_state(job['id'], state)
+        await run_in_threadpool(finish_job, job['id'], 'done', result)
+        logger.info("Job finished", extra={"job_id": job['id'], "kind": job['kind']})
+    except asyncio.CancelledError:
+        # Shutting down: leave the job leased so another worker resumes it once the lease lapses
+        raise
+    except Exception as e:
+        heartbeat.cancel()
+        # Keep the latest checkpoint so the retry resumes where this attempt stopped
+        if 'checkpoint' in state:
+            await _save_state(job['id'], state)
+        status = 'failed' if job['attempts'] >= JOB_MAX_ATTEMPTS else 'queued'
+        # Back off before the retry (doubling per attempt, with jitter) so a failing upstream isn't hammered
+        retry_in = JOB_RETRY_BACKOFF * 2 ** (job['attempts'] - 1) * random.uniform(0.5, 1) if status == 'queued' else None
+        error_msg = getattr(e, 'detail', None) or str(e)
+        await run_in_threadpool(finish_job, job['id'], status, None, error_msg, retry_in)
+        logger.warning("Job attempt failed: %s", error_msg, extra={"job_id": job['id'], "status": status, "retry_in": retry_in})
+    finally:
+        heartbeat.cancel()
+
+async def _worker():
+    """Claim and run jobs until cancelled"""
+    while True:
+        try:
+            job = await run_in_threadpool(claim_job, JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.warning("Job claim failed: %s", e)
+            job = None
+
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        await _run_job(job)
+
+def start_job_workers():
+    """Start the job workers (called on app startup)"""
+    for _ in range(JOB_WORKERS):
+        _workers.append(asyncio.ensure_future(_worker()))
+
+async def stop_job_workers():
+    """Stop the job workers (called on app shutdown); running jobs resume after their lease lapses"""
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+async def _job_status(job_id, user_id):
+    job = await run_in_threadpool(get_job, job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'attempts': job['attempts'],
+        'result': job['result']
+    }
+
+@router.post("/fetch", status_code=202)
+async def create_fetch_job(job_data: FetchJob, user_id: str = Depends(get_current_user)):
+    """Queue a playlist fetch; poll /api/playlist/jobs/{job_id} for the result"""
+    job_id = await run_in_threadpool(create_job, user_id, 'fetch', job_data.model_dump())
+    return {'job_id': job_id, 'status': 'queued'}
+
+@router.post("/add-tracks", status_code=202)
+async def create_add_tracks_job(track_data: AddTracks, user_id: str = Depends(get_current_user)):
+    """Queue a bulk add; poll /api/playlist/jobs/{job_id} for progress"""
+    job_id = await run_in_threadpool(create_job, user_id, 'add-tracks', track_data.model_dump())
+    return {'job_id': job_id, 'status': 'queued'}
+
+@router.get("/{job_id}")
+async def job_status(job_id: str, user_id: str = Depends(get_current_user)):
+    """Job status and progress; a finished fetch job includes its tracks"""
+    status = await _job_status(job_id, user_id)
+    if status['kind'] == 'fetch' and status['status'] == 'done':
+        chunks = await run_in_threadpool(get_job_chunks, job_id)
+        status['result'] = {
+            'playlist': status['result']['playlist'],
+            'tracks': [track for chunk in chunks for track in chunk]
+        }
+    return status
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, user_id: str = Depends(get_stream_user)):
+    """Server-sent events with the job's status and progress until it finishes"""
+    status = await _job_status(job_id, user_id)
+
+    async def events():
+        last = None
+        current = status
+        while True:
+            payload = {key: current[key] for key in ('job_id', 'status', 'progress', 'error')}
+            if payload != last:
+                yield f"data: {json.dumps(payload)}\n\n"
+                last = payload
+            if current['status'] in ('done', 'failed'):
+                return
+            await asyncio.sleep(1)
+            current = await _job_status(job_id, user_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -1,17 +1,65 @@
+import os
+import json
+import logging
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, ORJSONResponse
 from dotenv import load_dotenv
 
 # Import routers
-from auth import router as auth_router, REDIRECT_URI
+from auth import (
+    router as auth_router, REDIRECT_URI, start_code_expiry, stop_code_expiry,
+    start_token_refresher, stop_token_refresher
+)
 from music_stats import router as music_stats_router
 from playlist_tool import router as playlist_tool_router
+from jobs import router as jobs_router, start_job_workers, stop_job_workers
+from genre_profile import router as genre_profile_router
+from playlist_sets import router as playlist_sets_router
+from now_playing import now_playing_hub
+from history import start_history_ingester, stop_history_ingester
+from db import close_pool, init_db
+from spotify_api import close_http_client
+from metrics import MetricsMiddleware, render_prometheus
+from compression import CompressionMiddleware
 
 # Load environment variables
 load_dotenv()
 
+# Attributes every LogRecord has; anything else was passed through extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class StructuredFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, including any extra fields"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Structured logging; set LOG_LEVEL=WARNING to silence the per-request info logs
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(StructuredFormatter())
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), handlers=[_log_handler])
+# httpx logs every upstream request at INFO; those are already counted in /metrics
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
 # Create FastAPI app
-app = FastAPI(title="Rhythm Radar API")
+app = FastAPI(title="Rhythm Radar API", default_response_class=ORJSONResponse)
+
+# Compress responses (gzip, or brotli when installed); SSE streams are left alone
+app.add_middleware(CompressionMiddleware)
+
+# Record per-route latency for /metrics
+app.add_middleware(MetricsMiddleware)
 
 # CORS setup for React frontend
 app.add_middleware(
@@ -30,6 +78,38 @@ app.add_middleware(
 app.include_router(auth_router)
 app.include_router(music_stats_router)
 app.include_router(playlist_tool_router)
+app.include_router(jobs_router)
+app.include_router(genre_profile_router)
+app.include_router(playlist_sets_router)
+
+# Apply schema migrations here unless a release step runs migrate.py (MIGRATE_ON_STARTUP=false)
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+# Migrate, then start background workers for queued playlist jobs, listening history ingest, used-code expiry and token refresh
+@app.on_event("startup")
+async def startup():
+    if MIGRATE_ON_STARTUP:
+        await run_in_threadpool(init_db)
+    start_job_workers()
+    start_history_ingester()
+    start_code_expiry()
+    start_token_refresher()
+
+# Stop background workers and now-playing pollers, and release pooled database and Spotify connections on shutdown
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_job_workers()
+    await now_playing_hub.close()
+    await stop_history_ingester()
+    await stop_code_expiry()
+    await stop_token_refresher()
+    close_pool()
+    await close_http_client()
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 # Root endpoint
 @app.get("/")
@@ -0,0 +1,154 @@
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+# Latency buckets in seconds, shared by every histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with _lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered the way Prometheus expects"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        samples = []
+        with _lock:
+            items = [(key, list(series)) for key, series in self.values.items()]
+        for key, series in items:
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=str(bound)), cumulative))
+            samples.append((f"{self.name}_count", labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, series[-1]))
+        return samples
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+def register_collector(collect):
+    """
+    Register a callable returning {name: value} gauges that are read at scrape time
+    (used for pool, scheduler and cache stats that their modules already keep)
+    """
+    _collectors.append(collect)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus():
+    """Render every metric in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    for collect in _collectors:
+        for name, value in collect().items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# Metrics recorded across the app
+http_requests = counter("http_requests_total", "HTTP requests by route, method and status")
+http_latency = histogram("http_request_duration_seconds", "HTTP request latency by route")
+spotify_requests = counter("spotify_requests_total", "Upstream Spotify API calls by endpoint and status")
+spotify_latency = histogram("spotify_request_duration_seconds", "Upstream Spotify API latency by endpoint")
+db_calls = counter("db_calls_total", "Database calls by operation")
+db_latency = histogram("db_call_duration_seconds", "Database call latency by operation")
+
+def timed_db(func):
+    """Record count and latency of a db.py function"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_calls.inc(operation=func.__name__)
+            db_latency.observe(time.perf_counter() - start, operation=func.__name__)
+    return wrapper
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request counts and latency"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # FastAPI records the matched route in the scope; use its template to keep labels bounded
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            http_requests.inc(route=path, method=scope["method"], status=status["code"])
+            http_latency.observe(time.perf_counter() - start, route=path)
@@ -0,0 +1,30 @@
+"""
+Apply database schema migrations, then exit.
+
+Run once per deploy before the web processes start (the Procfile release
+step does this) and set MIGRATE_ON_STARTUP=false for the web workers.
+Safe to run concurrently: init_db holds an advisory lock while migrating.
+
+Usage, from Backend/: python migrate.py
+"""
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from db import init_db, close_pool, SCHEMA_VERSION
+
+logger = logging.getLogger("migrate")
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if init_db():
+            logger.info("Migrated database schema to version %s", SCHEMA_VERSION)
+        else:
+            logger.info("Database schema already at version %s", SCHEMA_VERSION)
+    finally:
+        close_pool()
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,68 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from auth import get_spotify_client
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from auth import get_async_spotify_client, get_current_user, get_stream_user
+from response_cache import response_cache, cache_key, ttl_for
+from now_playing import now_playing_hub, format_now_playing, NOW_PLAYING_KEEPALIVE
+from db import get_listening_summary, enroll_history_user
+from analytics import get_user_analytics, ANALYTICS_TOP_LIMIT, TIME_RANGES
+from catalog import enrich_artist_genres
+from projection import projector
+import os
 import json
+import asyncio
+from typing import Optional
 
 router = APIRouter(
     prefix="/api",
     tags=["music_stats"]
 )
 
+async def _fetch_top_artists(sp, time_range, limit):
+    results = await sp.current_user_top_artists(time_range=time_range, limit=limit)
+    
+    # Format the response
+    artists = []
+    for artist in results['items']:
+        artists.append({
+            'id': artist['id'],
+            'name': artist['name'],
+            'popularity': artist['popularity'],
+            'genres': artist['genres'],
+            'images': artist['images'],
+            'external_urls': artist['external_urls']
+        })
+    
+    return {'artists': artists}
+
 # Get user's top artists
 @router.get("/top-artists")
-def top_artists(time_range: str = "medium_term", limit: int = 10):
+async def top_artists(
+    time_range: str = "medium_term",
+    limit: int = 10,
+    fields: Optional[str] = None,
+    image_size: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
     """
     Get user's top artists
     time_range: short_term (4 weeks), medium_term (6 months), long_term (years)
+    fields: comma-separated artist fields to return, e.g. "id,name,images"
+    image_size: small, medium or large to return a single image per artist
     """
     try:
-        sp = get_spotify_client()
-        results = sp.current_user_top_artists(time_range=time_range, limit=limit)
-        
-        # Format the response
-        artists = []
-        for artist in results['items']:
-            artists.append({
-                'id': artist['id'],
-                'name': artist['name'],
-                'popularity': artist['popularity'],
-                'genres': artist['genres'],
-                'images': artist['images'],
-                'external_urls': artist['external_urls']
-            })
-        
-        return {'artists': artists}
+        project = projector(fields, image_size)
+        sp = await get_async_spotify_client(user_id)
+        result = await response_cache.get_or_fetch(
+            cache_key(sp.user_id, "top-artists", time_range, limit),
+            ttl_for(time_range),
+            lambda: _fetch_top_artists(sp, time_range, limit)
+        )
+        if project is not None:
+            result = dict(result, artists=project(result['artists']))
+        return ORJSONResponse(result)
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -46,34 +77,61 @@ def top_artists(time_range: str = "medium_term", limit: int = 10):
         content={"error": f"Failed to fetch top artists: {error_msg}"}
     )
 
+async def _fetch_top_tracks(sp, time_range, limit):
+    results = await sp.current_user_top_tracks(time_range=time_range, limit=limit)
+    
+    # Format the response
+    tracks = []
+    for track in results['items']:
+        tracks.append({
+            'id': track['id'],
+            'name': track['name'],
+            'album': {
+                'name': track['album']['name'],
+                'images': track['album']['images']
+            },
+            'artists': [{'name': artist['name'], 'id': artist['id']} for artist in track['artists']],
+            'popularity': track['popularity'],
+            'preview_url': track['preview_url'],
+            'external_urls': track['external_urls']
+        })
+    
+    return {'tracks': tracks}
+
 # Get user's top tracks
 @router.get("/top-tracks")
-def top_tracks(time_range: str = "medium_term", limit: int = 10):
+async def top_tracks(
+    time_range: str = "medium_term",
+    limit: int = 10,
+    enrich: bool = False,
+    fields: Optional[str] = None,
+    image_size: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
     """
     Get user's top tracks
     time_range: short_term (4 weeks), medium_term (6 months), long_term (years)
+    enrich: add each artist's genres from the shared catalog cache
+    fields: comma-separated track fields to return, e.g. "id,name,artists.name,album.images"
+    image_size: small, medium or large to return a single album image
     """
     try:
-        sp = get_spotify_client()
-        results = sp.current_user_top_tracks(time_range=time_range, limit=limit)
-        
-        # Format the response
-        tracks = []
-        for track in results['items']:
-            tracks.append({
-                'id': track['id'],
-                'name': track['name'],
-                'album': {
-                    'name': track['album']['name'],
-                    'images': track['album']['images']
-                },
-                'artists': [{'name': artist['name'], 'id': artist['id']} for artist in track['artists']],
-                'popularity': track['popularity'],
-                'preview_url': track['preview_url'],
-                'external_urls': track['external_urls']
-            })
-        
-        return {'tracks': tracks}
+        project = projector(fields, image_size)
+        sp = await get_async_spotify_client(user_id)
+        result = await response_cache.get_or_fetch(
+            cache_key(sp.user_id, "top-tracks", time_range, limit),
+            ttl_for(time_range),
+            lambda: _fetch_top_tracks(sp, time_range, limit)
+        )
+        # Enrich and project copies; the cached response stays as fetched
+        tracks = result['tracks']
+        if enrich:
+            tracks = await enrich_artist_genres(sp, tracks)
+        if project is not None:
+            tracks = project(tracks)
+        return ORJSONResponse(dict(result, tracks=tracks))
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -88,31 +146,97 @@ def top_tracks(time_range: str = "medium_term", limit: int = 10):
         content={"error": f"Failed to fetch top tracks: {error_msg}"}
     )
 
+# Per-call timeout for the Spotify calls behind /listening-stats
+STATS_CALL_TIMEOUT = float(os.environ.get("STATS_CALL_TIMEOUT", "5"))
+
+async def _fetch_concurrently(calls, timeout):
+    """
+    Await named Spotify calls in parallel, each bounded by timeout.
+    Returns (results, errors); a call that fails or times out maps to None in results.
+    """
+    names = list(calls)
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(calls[name], timeout) for name in names),
+        return_exceptions=True
+    )
+    results, errors = {}, {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            results[name] = None
+            errors[name] = "Timed out"
+        elif isinstance(outcome, Exception):
+            results[name] = None
+            errors[name] = str(outcome)
+        else:
+            results[name] = outcome
+    return results, errors
+
+_EMPTY_SUMMARY = {"plays": 0, "listened_ms": 0, "active_days": 0, "top_artists": []}
+
+# Windows (days) for the listening history summaries
+HISTORY_RECENT_DAYS = int(os.environ.get("HISTORY_RECENT_DAYS", "7"))
+HISTORY_MONTH_DAYS = int(os.environ.get("HISTORY_MONTH_DAYS", "30"))
+
+async def get_top_artists_cached(sp, time_range):
+    """Top-50 artists for a time range through the response cache (shared with /top-artists?limit=50)"""
+    result = await response_cache.get_or_fetch(
+        cache_key(sp.user_id, "top-artists", time_range, ANALYTICS_TOP_LIMIT),
+        ttl_for(time_range),
+        lambda: _fetch_top_artists(sp, time_range, ANALYTICS_TOP_LIMIT)
+    )
+    return result['artists']
+
 # Get user's listening statistics
 @router.get("/listening-stats")
-def listening_stats():
+async def listening_stats(user_id: str = Depends(get_current_user)):
     """Get user's listening statistics and recent trends"""
     try:
-        sp = get_spotify_client()
+        sp = await get_async_spotify_client(user_id)
         
-        # Get recently played tracks
-        recent_tracks = sp.current_user_recently_played(limit=50)
-        
-        # Get top artists for different time ranges
-        short_term = sp.current_user_top_artists(time_range="short_term", limit=5)
-        medium_term = sp.current_user_top_artists(time_range="medium_term", limit=5)
-        long_term = sp.current_user_top_artists(time_range="long_term", limit=5)
+        # Get listening history summaries (precomputed from ingested plays) and
+        # top artists for each time range in parallel
+        results, errors = await _fetch_concurrently({
+            "recent": run_in_threadpool(get_listening_summary, user_id, HISTORY_RECENT_DAYS),
+            "month": run_in_threadpool(get_listening_summary, user_id, HISTORY_MONTH_DAYS, ANALYTICS_TOP_LIMIT),
+            **{time_range: get_top_artists_cached(sp, time_range) for time_range in TIME_RANGES}
+        }, STATS_CALL_TIMEOUT)
+
+        if len(errors) == len(results):
+            raise Exception(f"All requests failed: {errors}")
+
+        recent = results["recent"] or _EMPTY_SUMMARY
+        month = results["month"] or _EMPTY_SUMMARY
+        if results["month"] is not None and not month["active_days"]:
+            # No history yet (e.g. signed in before ingestion existed): make sure it's scheduled
+            await run_in_threadpool(enroll_history_user, user_id)
+
+        # Update the user's aggregates with whatever arrived; failed parts keep their last data
+        analytics = get_user_analytics(user_id)
+        for time_range in TIME_RANGES:
+            if results[time_range] is not None:
+                analytics.update_range(time_range, results[time_range])
+        analytics.update_history(month["top_artists"])
         
         # Process data
-        stats = {
-            "recent_count": len(recent_tracks["items"]),
-            "short_term_genres": _extract_top_genres(short_term),
-            "medium_term_genres": _extract_top_genres(medium_term),
-            "long_term_genres": _extract_top_genres(long_term),
-            "trend": _compare_artist_trends(short_term, medium_term, long_term)
-        }
+        stats = dict(
+            analytics.summary(),
+            recent_count=recent["plays"],
+            history={
+                "recent_days": HISTORY_RECENT_DAYS,
+                "recent": recent,
+                "month_days": HISTORY_MONTH_DAYS,
+                "month": dict(month, top_artists=month["top_artists"][:5])
+            }
+        )
+
+        # Report which parts are missing when only some requests failed
+        if errors:
+            stats["partial"] = True
+            stats["errors"] = errors
         
         return stats
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -127,75 +251,16 @@ def listening_stats():
         content={"error": f"Failed to fetch stats: {error_msg}"}
     )
 
-# Helper functions for data processing
-def _extract_top_genres(artist_data):
-    all_genres = []
-    for artist in artist_data["items"]:
-        all_genres.extend(artist["genres"])
-    
-    # Count genres and find most common
-    genre_count = {}
-    for genre in all_genres:
-        if genre in genre_count:
-            genre_count[genre] += 1
-        else:
-            genre_count[genre] = 1
-    
-    # Sort by count
-    sorted_genres = sorted(genre_count.items(), key=lambda x: x[1], reverse=True)
-    return [genre[0] for genre in sorted_genres[:5]]
-
-def _compare_artist_trends(short_term, medium_term, long_term):
-    # Get IDs of top artists in each time range
-    short_ids = [artist["id"] for artist in short_term["items"]]
-    medium_ids = [artist["id"] for artist in medium_term["items"]]
-    long_ids = [artist["id"] for artist in long_term["items"]]
-    
-    # Find new artists (in short term but not medium term)
-    new_artists = [
-        {"id": artist["id"], "name": artist["name"]}
-        for artist in short_term["items"]
-        if artist["id"] not in medium_ids and artist["id"] not in long_ids
-    ]
-    
-    # Find consistent favorites (in all time ranges)
-    consistent = [
-        {"id": artist["id"], "name": artist["name"]}
-        for artist in short_term["items"]
-        if artist["id"] in medium_ids and artist["id"] in long_ids
-    ]
-    
-    return {
-        "new_discoveries": new_artists,
-        "consistent_favorites": consistent
-    }
-
 # Get user's currently playing track
 @router.get("/now-playing")
-def get_now_playing():
+async def get_now_playing(user_id: str = Depends(get_current_user)):
     """Get user's currently playing track"""
     try:
-        sp = get_spotify_client()
-        current = sp.current_playback()
-        
-        if current and current.get('item'):
-            return {
-                'is_playing': current['is_playing'],
-                'track': {
-                    'id': current['item']['id'],
-                    'name': current['item']['name'],
-                    'artists': [{'name': artist['name'], 'id': artist['id']} for artist in current['item']['artists']],
-                    'album': {
-                        'name': current['item']['album']['name'],
-                        'images': current['item']['album']['images']
-                    },
-                    'preview_url': current['item'].get('preview_url'),
-                    'external_urls': current['item']['external_urls'],
-                    'progress_ms': current.get('progress_ms'),
-                    'duration_ms': current['item']['duration_ms']
-                }
-            }
-        return {'is_playing': False}
+        sp = await get_async_spotify_client(user_id)
+        current = await sp.current_playback()
+        return format_now_playing(current)
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -208,4 +273,28 @@ def get_now_playing():
     return JSONResponse(
         status_code=500, 
         content={"error": f"Failed to fetch now playing: {error_msg}"}
-    )
\ No newline at end of file
+    )
+
+# Stream the currently playing track as server-sent events
+@router.get("/now-playing/stream")
+async def now_playing_stream(user_id: str = Depends(get_stream_user)):
+    """
+    Server-sent events with the user's playback state: one event on connect, then one
+    per track change, play/pause or seek. A single server-side poller per user feeds
+    every open stream, so tabs no longer poll /now-playing themselves.
+    """
+    async def events():
+        queue = now_playing_hub.subscribe(user_id)
+        try:
+            while True:
+                try:
+                    state = await asyncio.wait_for(queue.get(), NOW_PLAYING_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(state)}\n\n"
+        finally:
+            now_playing_hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
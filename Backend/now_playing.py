@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import logging
+from auth import get_async_spotify_client
+from spotify_api import SpotifyRateLimitError
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Now-playing poller settings (seconds)
+NOW_PLAYING_MIN_INTERVAL = float(os.environ.get("NOW_PLAYING_MIN_INTERVAL", "2"))
+NOW_PLAYING_MAX_INTERVAL = float(os.environ.get("NOW_PLAYING_MAX_INTERVAL", "20"))  # longest wait while playing (catches pauses and skips)
+NOW_PLAYING_IDLE_INTERVAL = float(os.environ.get("NOW_PLAYING_IDLE_INTERVAL", "15"))  # wait while nothing is playing
+NOW_PLAYING_SEEK_TOLERANCE_MS = int(os.environ.get("NOW_PLAYING_SEEK_TOLERANCE_MS", "5000"))
+NOW_PLAYING_KEEPALIVE = float(os.environ.get("NOW_PLAYING_KEEPALIVE", "15"))  # SSE comment interval
+
+def format_now_playing(current):
+    """Format a current_playback response for the client"""
+    if current and current.get('item'):
+        return {
+            'is_playing': current['is_playing'],
+            'track': {
+                'id': current['item']['id'],
+                'name': current['item']['name'],
+                'artists': [{'name': artist['name'], 'id': artist['id']} for artist in current['item']['artists']],
+                'album': {
+                    'name': current['item']['album']['name'],
+                    'images': current['item']['album']['images']
+                },
+                'preview_url': current['item'].get('preview_url'),
+                'external_urls': current['item']['external_urls'],
+                'progress_ms': current.get('progress_ms'),
+                'duration_ms': current['item']['duration_ms']
+            }
+        }
+    return {'is_playing': False}
+
+def _next_interval(state):
+    """Poll again around when the current track ends, within the min/max bounds"""
+    if not state.get('is_playing'):
+        return NOW_PLAYING_IDLE_INTERVAL
+    track = state['track']
+    remaining = (track['duration_ms'] - (track['progress_ms'] or 0)) / 1000
+    return min(max(remaining + 0.5, NOW_PLAYING_MIN_INTERVAL), NOW_PLAYING_MAX_INTERVAL)
+
+def _advance(state, elapsed):
+    """Copy of state with progress moved on by elapsed seconds of playback"""
+    if not state.get('is_playing'):
+        return state
+    track = state['track']
+    progress = min((track['progress_ms'] or 0) + int(elapsed * 1000), track['duration_ms'])
+    return dict(state, track=dict(track, progress_ms=progress))
+
+def _has_changed(previous, state, elapsed):
+    """True for a new track, play/pause, or a seek; ordinary progress isn't a change"""
+    if previous is None or previous.get('is_playing') != state.get('is_playing'):
+        return True
+    previous_track, track = previous.get('track'), state.get('track')
+    if (previous_track or {}).get('id') != (track or {}).get('id'):
+        return True
+    if track is None:
+        return False
+    expected = (previous_track['progress_ms'] or 0) + (elapsed * 1000 if state['is_playing'] else 0)
+    return abs((track['progress_ms'] or 0) - expected) > NOW_PLAYING_SEEK_TOLERANCE_MS
+
+class NowPlayingHub:
+    """
+    One upstream poller per user with open now-playing streams.
+    Each poll result that changes something is pushed to every subscriber of that user.
+    """
+
+    def __init__(self):
+        self._subscribers = {}  # user_id -> set of queues
+        self._pollers = {}  # user_id -> task
+        self._latest = {}  # user_id -> (state, fetched_at)
+        self.stats = {"polls": 0, "pushes": 0, "errors": 0}
+
+    def subscribe(self, user_id):
+        """Register a subscriber queue, starting the user's poller if needed"""
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        if user_id in self._latest:
+            # Catch the new subscriber up with the last poll, advanced to now
+            state, fetched_at = self._latest[user_id]
+            queue.put_nowait(_advance(state, time.monotonic() - fetched_at))
+        if user_id not in self._pollers:
+            self._pollers[user_id] = asyncio.ensure_future(self._poll(user_id))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        """Remove a subscriber; the poller stops with the user's last subscriber"""
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+            self._latest.pop(user_id, None)
+            poller = self._pollers.pop(user_id, None)
+            if poller is not None:
+                poller.cancel()
+
+    def _publish(self, user_id, state):
+        self.stats["pushes"] += 1
+        for queue in self._subscribers.get(user_id, ()):
+            # Subscribers only need the newest state; replace anything not yet sent
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(state)
+
+    async def _poll(self, user_id):
+        previous = None
+        previous_at = time.monotonic()
+        while True:
+            try:
+                sp = await get_async_spotify_client(user_id)
+                state = format_now_playing(await sp.current_playback())
+                self.stats["polls"] += 1
+            except asyncio.CancelledError:
+                raise
+            except SpotifyRateLimitError as e:
+                self.stats["errors"] += 1
+                await asyncio.sleep(max(e.retry_after, NOW_PLAYING_IDLE_INTERVAL))
+                continue
+            except Exception as e:
+                logger.warning("Now-playing poll failed: %s", e, extra={"user_id": user_id})
+                self.stats["errors"] += 1
+                await asyncio.sleep(NOW_PLAYING_IDLE_INTERVAL)
+                continue
+
+            now = time.monotonic()
+            self._latest[user_id] = (state, now)
+            if _has_changed(previous, state, now - previous_at):
+                self._publish(user_id, state)
+            previous, previous_at = state, now
+            await asyncio.sleep(_next_interval(state))
+
+    async def close(self):
+        """Stop every poller (called on app shutdown)"""
+        pollers = list(self._pollers.values())
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        self._pollers.clear()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["active_users"] = len(self._pollers)
+        stats["subscribers"] = sum(len(queues) for queues in self._subscribers.values())
+        return stats
+
+# Shared hub used by the now-playing endpoints
+now_playing_hub = NowPlayingHub()
+register_collector(lambda: {f"now_playing_{name}": value for name, value in now_playing_hub.get_stats().items()})
@@ -0,0 +1,230 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from auth import get_async_spotify_client, get_current_user, get_user_profile
+from playlist_tool import extract_playlist_id, iter_playlist_pages, add_tracks_in_batches
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+import re
+import json
+import asyncio
+import hashlib
+import unicodedata
+
+router = APIRouter(
+    prefix="/api/playlist/sets",
+    tags=["playlist_sets"]
+)
+
+# Only the fields needed to key and place tracks
+SET_PLAYLIST_FIELDS = "id,name,external_urls,snapshot_id,tracks(total,offset,items(track(id,name,artists(name),external_ids(isrc))))"
+SET_PAGE_FIELDS = "total,offset,items(track(id,name,artists(name),external_ids(isrc)))"
+REMOVE_TRACKS_BATCH_SIZE = 100  # Spotify's maximum per request
+
+# "Song (feat. X)", "Song [with Y]", "Song - Remastered 2011", "Song - Radio Edit"
+_TITLE_SUFFIX = re.compile(
+    r"\s*(?:[(\[](?:feat|ft|with)\b[^)\]]*[)\]]|-\s.*\b(?:remaster(?:ed)?|version|edit|mix|mono|stereo|live)\b.*)$",
+    re.IGNORECASE
+)
+_NON_WORD = re.compile(r"[\W_]+")
+
+def normalize_text(text):
+    """Casefolded text without accents, punctuation or featured-artist/remaster suffixes"""
+    text = unicodedata.normalize("NFKD", _TITLE_SUFFIX.sub("", text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", text.casefold()).strip()
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+def track_key(track, match):
+    """
+    64-bit key identifying a track for set operations:
+    id: the Spotify track id
+    isrc: the recording's ISRC (falls back to name_artist when missing)
+    name_artist: normalized title and first artist, so re-releases and remasters match
+    """
+    if match == "id":
+        return _hash(track['id'])
+    if match == "isrc":
+        isrc = (track.get('external_ids') or {}).get('isrc')
+        if isrc:
+            return _hash("isrc:" + isrc.upper().replace("-", "").strip())
+    artists = track.get('artists') or [{}]
+    return _hash("name:" + normalize_text(track['name']) + "\0" + normalize_text(artists[0].get('name') or ""))
+
+async def load_playlist_entries(sp, playlist_id, match):
+    """Return (playlist metadata, [(position, key, track_id)]); positions count every item, including local files"""
+    playlist = await sp.playlist(playlist_id, fields=SET_PLAYLIST_FIELDS)
+    pages = iter_playlist_pages(sp, playlist_id, playlist['tracks'], fields=SET_PAGE_FIELDS)
+    entries = []
+    async for page in pages:
+        for position, item in enumerate(page['items'], page.get('offset', 0)):
+            track = item['track']
+            if track and track.get('id'):
+                entries.append((position, track_key(track, match), track['id']))
+    return playlist, entries
+
+def combine(operation, playlists):
+    """
+    Apply a set operation to lists of (position, key, track_id); returns [(key, track_id)]
+    in first-seen order with one entry per key.
+    union: tracks in any playlist; intersection: tracks of the first in every other;
+    difference: tracks of the first in none of the others; dedupe: the first without repeats
+    """
+    first, others = playlists[0], playlists[1:]
+    if operation == "union":
+        entries = [entry for entries in playlists for entry in entries]
+    elif operation == "intersection":
+        common = set.intersection(*({key for _, key, _ in entries} for entries in others))
+        entries = [entry for entry in first if entry[1] in common]
+    elif operation == "difference":
+        excluded = {key for entries in others for _, key, _ in entries}
+        entries = [entry for entry in first if entry[1] not in excluded]
+    else:
+        entries = first
+
+    seen = set()
+    result = []
+    for _, key, track_id in entries:
+        if key not in seen:
+            seen.add(key)
+            result.append((key, track_id))
+    return result
+
+def plan_diff(current, result):
+    """
+    Minimal changes turning a playlist (current entries) into result: keep the first
+    occurrence of every wanted key where it is, remove everything else, append what's missing.
+    Returns (removals [(track_id, position)], additions [track_id]).
+    """
+    wanted = {key for key, _ in result}
+    kept = set()
+    removals = []
+    for position, key, track_id in current:
+        if key in wanted and key not in kept:
+            kept.add(key)
+        else:
+            removals.append((track_id, position))
+    additions = [track_id for key, track_id in result if key not in kept]
+    return removals, additions
+
+async def remove_positions(sp, playlist_id, removals, snapshot_id):
+    """
+    Remove tracks at the given positions, last positions first so earlier ones stay valid;
+    each request names the snapshot the previous one produced. Returns the final snapshot id.
+    """
+    removals = sorted(removals, key=lambda removal: removal[1], reverse=True)
+    for i in range(0, len(removals), REMOVE_TRACKS_BATCH_SIZE):
+        positions = {}
+        for track_id, position in removals[i:i + REMOVE_TRACKS_BATCH_SIZE]:
+            positions.setdefault(f"spotify:track:{track_id}", []).append(position)
+        result = await sp.playlist_remove_specific_occurrences_of_items(
+            playlist_id,
+            [{'uri': uri, 'positions': uri_positions} for uri, uri_positions in positions.items()],
+            snapshot_id=snapshot_id
+        )
+        snapshot_id = result['snapshot_id']
+    return snapshot_id
+
+class SetOperation(BaseModel):
+    operation: Literal["union", "intersection", "difference", "dedupe"]
+    playlists: List[str]
+    match: Literal["id", "isrc", "name_artist"] = "id"
+    target_playlist_id: Optional[str] = None
+    name: Optional[str] = None
+    dry_run: bool = False
+
+@router.post("")
+async def playlist_set_operation(request: SetOperation, user_id: str = Depends(get_current_user)):
+    """
+    Combine playlists server-side and write the result as a minimal diff
+    playlists: URLs or IDs; the first is the base for intersection, difference and dedupe
+    match: compare tracks by Spotify id, ISRC, or normalized name and first artist
+    target_playlist_id: playlist to write to (default: the playlist itself for dedupe,
+    otherwise a new playlist called name)
+    dry_run: report the changes without writing them
+    """
+    playlist_ids = [extract_playlist_id(playlist) for playlist in request.playlists]
+    if request.operation == "dedupe" and len(playlist_ids) != 1:
+        raise HTTPException(status_code=400, detail="dedupe takes exactly one playlist")
+    if request.operation != "dedupe" and len(playlist_ids) < 2:
+        raise HTTPException(status_code=400, detail=f"{request.operation} needs at least two playlists")
+
+    try:
+        sp = await get_async_spotify_client(user_id)
+        target_id = request.target_playlist_id and extract_playlist_id(request.target_playlist_id)
+        if target_id is None and request.operation == "dedupe":
+            target_id = playlist_ids[0]
+
+        # Load every playlist once, in parallel (the target too if it isn't a source)
+        to_load = list(dict.fromkeys(playlist_ids + ([target_id] if target_id else [])))
+        loaded = dict(zip(to_load, await asyncio.gather(
+            *(load_playlist_entries(sp, playlist_id, request.match) for playlist_id in to_load)
+        )))
+
+        result = combine(request.operation, [loaded[playlist_id][1] for playlist_id in playlist_ids])
+        if target_id:
+            target, current = loaded[target_id]
+        else:
+            target, current = None, []
+        removals, additions = plan_diff(current, result)
+
+        response = {
+            'operation': request.operation,
+            'match': request.match,
+            'playlists': playlist_ids,
+            'result_count': len(result),
+            'target_playlist_id': target_id,
+            'removed': len(removals),
+            'added': len(additions),
+            'unchanged': len(current) - len(removals),
+            'dry_run': request.dry_run
+        }
+        if request.dry_run or not (removals or additions):
+            return response
+
+        if target is None:
+            user_info = await get_user_profile(sp)
+            target = await sp.user_playlist_create(
+                user=user_info['id'],
+                name=request.name or f"{request.operation.title()} of {len(playlist_ids)} playlists",
+                public=False,
+                description="Created with Rhythm Radar"
+            )
+            response['target_playlist_id'] = target['id']
+
+        snapshot_id = target.get('snapshot_id')
+        if removals:
+            snapshot_id = await remove_positions(sp, target['id'], removals, snapshot_id)
+        # Append after everything left (the total also counts local files, which are never touched)
+        remaining = target.get('tracks', {}).get('total', 0) - len(removals)
+        batches = await add_tracks_in_batches(sp, target['id'], additions, remaining)
+        failed = [batch for batch in batches if 'error' in batch]
+        snapshot_ids = [batch['snapshot_id'] for batch in batches if batch.get('snapshot_id')]
+
+        response.update(
+            success=not failed,
+            snapshot_id=snapshot_ids[-1] if snapshot_ids else snapshot_id,
+            external_url=target['external_urls']['spotify'],
+            batches=batches
+        )
+        if failed:
+            response['error'] = f"Failed to add {len(failed)} of {len(batches)} batches"
+            return JSONResponse(status_code=502, content=response)
+        return response
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = str(e)
+        # Handle case where error might be a dict
+        if hasattr(e, '__dict__'):
+            try:
+                error_msg = json.dumps(e.__dict__)
+            except:
+                error_msg = "Error serializing exception"
+
+    return JSONResponse(
+        status_code=500,
+        content={"error": f"Failed to apply playlist {request.operation}: {error_msg}"}
+    )
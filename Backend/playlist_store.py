@@ -0,0 +1,103 @@
+import os
+import json
+import zlib
+import logging
+from fastapi.concurrency import run_in_threadpool
+from db import get_playlist_snapshot, store_playlist_snapshot
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Playlist snapshot store settings
+PLAYLIST_STORE_MAX_BYTES = int(os.environ.get("PLAYLIST_STORE_MAX_BYTES", str(256 * 1024 * 1024)))  # compressed size cap
+PLAYLIST_STORE_MAX_AGE_DAYS = int(os.environ.get("PLAYLIST_STORE_MAX_AGE_DAYS", "30"))  # evict snapshots not read for this long
+
+stats = {"hits": 0, "misses": 0, "stored": 0, "errors": 0}
+register_collector(lambda: {f"playlist_store_{name}": value for name, value in stats.items()})
+
+def pack_tracks(tracks):
+    """
+    Encode formatted tracks as compressed columns.
+    Each field becomes one list; albums and artists are stored once and referenced by index.
+    """
+    albums, album_index = [], {}
+    artists, artist_index = [], {}
+    columns = {
+        'id': [], 'name': [], 'duration_ms': [], 'preview_url': [],
+        'album': [], 'artist_offsets': [0], 'artist_refs': [],
+    }
+    for track in tracks:
+        columns['id'].append(track['id'])
+        columns['name'].append(track['name'])
+        columns['duration_ms'].append(track['duration_ms'])
+        columns['preview_url'].append(track['preview_url'])
+
+        album_key = json.dumps(track['album'], sort_keys=True)
+        if album_key not in album_index:
+            album_index[album_key] = len(albums)
+            albums.append([track['album']['name'], track['album']['images']])
+        columns['album'].append(album_index[album_key])
+
+        for artist in track['artists']:
+            artist_key = (artist['id'], artist['name'])
+            if artist_key not in artist_index:
+                artist_index[artist_key] = len(artists)
+                artists.append([artist['name'], artist['id']])
+            columns['artist_refs'].append(artist_index[artist_key])
+        columns['artist_offsets'].append(len(columns['artist_refs']))
+
+    columns['albums'] = albums
+    columns['artists'] = artists
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode())
+
+def unpack_tracks(data):
+    """Decode pack_tracks output back into formatted tracks"""
+    columns = json.loads(zlib.decompress(data))
+    albums = [{'name': name, 'images': images} for name, images in columns['albums']]
+    artists = [{'name': name, 'id': artist_id} for name, artist_id in columns['artists']]
+    offsets = columns['artist_offsets']
+    refs = columns['artist_refs']
+    return [
+        {
+            'id': columns['id'][i],
+            'name': columns['name'][i],
+            'artists': [dict(artists[ref]) for ref in refs[offsets[i]:offsets[i + 1]]],
+            'album': dict(albums[columns['album'][i]]),
+            'duration_ms': columns['duration_ms'][i],
+            'preview_url': columns['preview_url'][i]
+        }
+        for i in range(len(columns['id']))
+    ]
+
+async def load_snapshot(playlist_id):
+    """Return (snapshot_id, packed tracks) for the stored copy of a playlist, or None"""
+    try:
+        return await run_in_threadpool(get_playlist_snapshot, playlist_id)
+    except Exception as e:
+        # Fall back to fetching from Spotify if the store is unavailable
+        logger.warning("Playlist store read failed: %s", e)
+        stats["errors"] += 1
+        return None
+
+def current_tracks(stored, snapshot_id):
+    """Return the stored tracks if they belong to snapshot_id, else None"""
+    if stored is None or stored[0] != snapshot_id:
+        stats["misses"] += 1
+        return None
+    stats["hits"] += 1
+    return unpack_tracks(stored[1])
+
+async def save_tracks(playlist_id, snapshot_id, tracks):
+    """Store the tracks of a playlist snapshot, replacing any older snapshot"""
+    if not snapshot_id:
+        return
+    try:
+        data = pack_tracks(tracks)
+        await run_in_threadpool(
+            store_playlist_snapshot, playlist_id, snapshot_id, data,
+            PLAYLIST_STORE_MAX_BYTES, PLAYLIST_STORE_MAX_AGE_DAYS
+        )
+        stats["stored"] += 1
+    except Exception as e:
+        logger.warning("Playlist store write failed: %s", e)
+        stats["errors"] += 1
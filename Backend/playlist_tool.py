@@ -1,10 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Body
-from fastapi.responses import JSONResponse
-from auth import get_spotify_client
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from auth import get_async_spotify_client, get_current_user, get_user_profile
+from spotify_api import SpotifyAPIError, SPOTIFY_BACKOFF_BASE
+from playlist_store import load_snapshot, current_tracks, save_tracks
+from catalog import enrich_artist_genres
+from projection import projector
 from typing import List, Optional
 from pydantic import BaseModel
+import os
 import re
 import json
+import random
+import asyncio
+import itertools
+import orjson
+from collections import deque
 
 router = APIRouter(
     prefix="/api/playlist",
@@ -23,70 +33,191 @@ def extract_playlist_id(playlist_input: str) -> str:
     # Otherwise assume it's already an ID
     return playlist_input
 
+# Playlist pages are fetched this many at a time after the first page
+PLAYLIST_PAGE_SIZE = 100
+PLAYLIST_FETCH_CONCURRENCY = int(os.environ.get("PLAYLIST_FETCH_CONCURRENCY", "8"))
+
+# Playlist metadata without any tracks; enough to check a stored copy's snapshot_id
+PLAYLIST_META_FIELDS = "id,name,description,images,owner(display_name),snapshot_id,tracks(total)"
+
+def format_track(track):
+    """Format a playlist track for the response"""
+    return {
+        'id': track['id'],
+        'name': track['name'],
+        'artists': [{'name': artist['name'], 'id': artist['id']} for artist in track['artists']],
+        'album': {
+            'name': track['album']['name'],
+            'images': track['album']['images']
+        },
+        'duration_ms': track['duration_ms'],
+        'preview_url': track['preview_url']
+    }
+
+def format_playlist(playlist):
+    """Format playlist metadata for the response"""
+    return {
+        'id': playlist['id'],
+        'name': playlist['name'],
+        'description': playlist['description'],
+        'owner': playlist['owner']['display_name'],
+        'images': playlist['images'],
+        'tracks_total': playlist['tracks']['total']
+    }
+
+async def fetch_playlist_pages(sp, playlist_id):
+    """
+    Fetch playlist metadata and return it with an async iterator over its pages.
+    The metadata request also returns the first page, which reveals the total.
+    """
+    playlist = await sp.playlist(playlist_id)
+    return playlist, iter_playlist_pages(sp, playlist_id, playlist['tracks'])
+
+async def iter_playlist_pages(sp, playlist_id, first_page, fields=None):
+    """
+    Yield playlist pages in order, keeping up to PLAYLIST_FETCH_CONCURRENCY
+    of the following pages in flight while earlier ones are consumed
+    """
+    yield first_page
+
+    offsets = iter(range(
+        first_page.get('offset', 0) + len(first_page['items']),
+        first_page['total'],
+        PLAYLIST_PAGE_SIZE
+    ))
+
+    def fetch_page(offset):
+        return asyncio.ensure_future(
+            sp.playlist_items(playlist_id, fields=fields, limit=PLAYLIST_PAGE_SIZE, offset=offset)
+        )
+
+    pending = deque(fetch_page(offset) for offset in itertools.islice(offsets, PLAYLIST_FETCH_CONCURRENCY))
+    try:
+        while pending:
+            page = await pending.popleft()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(fetch_page(next_offset))
+            yield page
+    finally:
+        # Stop outstanding requests if the consumer goes away early
+        for task in pending:
+            task.cancel()
+
+def _ndjson(key, values):
+    """Encode values as NDJSON lines of {key: value}"""
+    return b"".join(orjson.dumps({key: value}) + b"\n" for value in values)
+
+async def _stream_playlist(playlist, pages, transform=None):
+    """
+    Yield NDJSON lines: playlist metadata first, then one line per track; store the tracks once complete.
+    transform(tracks), if given, returns the tracks as sent (the store keeps them as fetched).
+    """
+    yield _ndjson('playlist', [format_playlist(playlist)])
+    tracks = []
+    try:
+        async for page in pages:
+            page_tracks = [format_track(item['track']) for item in page['items'] if item['track']]
+            tracks.extend(page_tracks)
+            if page_tracks:
+                if transform is not None:
+                    page_tracks = await transform(page_tracks)
+                yield _ndjson('track', page_tracks)
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        yield _ndjson('error', [f"Failed to fetch playlist tracks: {e}"])
+        return
+    await save_tracks(playlist['id'], playlist.get('snapshot_id'), tracks)
+
+async def _stream_stored_playlist(playlist, tracks, transform=None):
+    """Yield the same NDJSON lines for tracks from the playlist store"""
+    yield _ndjson('playlist', [format_playlist(playlist)])
+    try:
+        for i in range(0, len(tracks), PLAYLIST_PAGE_SIZE):
+            page_tracks = tracks[i:i + PLAYLIST_PAGE_SIZE]
+            if transform is not None:
+                page_tracks = await transform(page_tracks)
+            yield _ndjson('track', page_tracks)
+    except Exception as e:
+        yield _ndjson('error', [f"Failed to fetch playlist tracks: {e}"])
+
+def _track_transform(sp, enrich, project):
+    """Combine genre enrichment and field projection into one async step, or None if neither is wanted"""
+    if not enrich and project is None:
+        return None
+
+    async def transform(tracks):
+        if enrich:
+            tracks = await enrich_artist_genres(sp, tracks)
+        if project is not None:
+            tracks = project(tracks)
+        return tracks
+    return transform
+
 @router.get("/fetch")
-def fetch_playlist(playlist_input: str):
+async def fetch_playlist(
+    playlist_input: str,
+    stream: bool = False,
+    enrich: bool = False,
+    fields: Optional[str] = None,
+    image_size: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
     """
     Fetch all tracks from a playlist
     playlist_input can be a URL or playlist ID
+    stream: return NDJSON (playlist line, then track lines) while pages are still arriving
+    enrich: add each artist's genres (looked up in batches through the shared catalog cache)
+    fields: comma-separated track fields to return, e.g. "id,name,artists.name"
+    image_size: small, medium or large to return a single album image per track
+    Tracks are kept in the playlist store; while the playlist's snapshot_id is
+    unchanged they are served from there without fetching any pages.
     """
     try:
-        sp = get_spotify_client()
+        sp = await get_async_spotify_client(user_id)
         playlist_id = extract_playlist_id(playlist_input)
-        
-        # Get playlist metadata
-        playlist = sp.playlist(playlist_id)
-        
-        # Prepare to collect all tracks
-        tracks = []
-        results = sp.playlist_items(playlist_id, limit=100)
-        
-        # Process first batch
-        for item in results['items']:
-            if item['track']:
-                track = item['track']
-                tracks.append({
-                    'id': track['id'],
-                    'name': track['name'],
-                    'artists': [{'name': artist['name'], 'id': artist['id']} for artist in track['artists']],
-                    'album': {
-                        'name': track['album']['name'],
-                        'images': track['album']['images']
-                    },
-                    'duration_ms': track['duration_ms'],
-                    'preview_url': track['preview_url']
+        transform = _track_transform(sp, enrich, projector(fields, image_size))
+
+        stored = await load_snapshot(playlist_id)
+        if stored is None:
+            # Nothing stored: get playlist metadata and an iterator over its pages of tracks
+            playlist, pages = await fetch_playlist_pages(sp, playlist_id)
+        else:
+            # Check the stored copy against the current snapshot (this also checks the user can see the playlist)
+            playlist = await sp.playlist(playlist_id, fields=PLAYLIST_META_FIELDS)
+            tracks = current_tracks(stored, playlist['snapshot_id'])
+            if tracks is not None:
+                if stream:
+                    return StreamingResponse(
+                        _stream_stored_playlist(playlist, tracks, transform),
+                        media_type="application/x-ndjson"
+                    )
+                return ORJSONResponse({
+                    'playlist': format_playlist(playlist),
+                    'tracks': await transform(tracks) if transform else tracks
                 })
+            first_page = await sp.playlist_items(playlist_id, limit=PLAYLIST_PAGE_SIZE)
+            pages = iter_playlist_pages(sp, playlist_id, first_page)
+
+        if stream:
+            return StreamingResponse(_stream_playlist(playlist, pages, transform), media_type="application/x-ndjson")
         
-        # Get remaining tracks if needed (pagination)
-        while results['next']:
-            results = sp.next(results)
-            for item in results['items']:
-                if item['track']:
-                    track = item['track']
-                    tracks.append({
-                        'id': track['id'],
-                        'name': track['name'],
-                        'artists': [{'name': artist['name'], 'id': artist['id']} for artist in track['artists']],
-                        'album': {
-                            'name': track['album']['name'],
-                            'images': track['album']['images']
-                        },
-                        'duration_ms': track['duration_ms'],
-                        'preview_url': track['preview_url']
-                    })
+        tracks = [
+            format_track(item['track'])
+            async for page in pages
+            for item in page['items']
+            if item['track']
+        ]
+        await save_tracks(playlist_id, playlist.get('snapshot_id'), tracks)
         
         # Return both playlist metadata and tracks
-        return {
-            'playlist': {
-                'id': playlist['id'],
-                'name': playlist['name'],
-                'description': playlist['description'],
-                'owner': playlist['owner']['display_name'],
-                'images': playlist['images'],
-                'tracks_total': playlist['tracks']['total']
-            },
-            'tracks': tracks
-        }
+        return ORJSONResponse({
+            'playlist': format_playlist(playlist),
+            'tracks': await transform(tracks) if transform else tracks
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -101,32 +232,53 @@ def fetch_playlist(playlist_input: str):
         content={"error": f"Failed to fetch top artists: {error_msg}"}
     )
 
+# Spotify returns at most this many playlists per page
+USER_PLAYLISTS_PAGE_SIZE = 50
+
 @router.get("/user-playlists")
-def get_user_playlists(limit: int = 50):
+async def get_user_playlists(limit: int = 50, user_id: str = Depends(get_current_user)):
     """
     Get the current user's playlists for selection
+    limit: page size used when walking the user's playlists (all pages are returned)
     """
     try:
-        sp = get_spotify_client()
+        sp = await get_async_spotify_client(user_id)
+        page_size = max(1, min(limit, USER_PLAYLISTS_PAGE_SIZE))
         
-        # Get current user's playlists
-        results = sp.current_user_playlists(limit=limit)
+        # The first page reveals the total; fetch the remaining pages concurrently
+        first_page, profile = await asyncio.gather(
+            sp.current_user_playlists(limit=page_size),
+            get_user_profile(sp)
+        )
+        semaphore = asyncio.Semaphore(PLAYLIST_FETCH_CONCURRENCY)
+
+        async def fetch_page(offset):
+            async with semaphore:
+                return await sp.current_user_playlists(limit=page_size, offset=offset)
+
+        pages = await asyncio.gather(*(
+            fetch_page(offset)
+            for offset in range(len(first_page['items']), first_page['total'], page_size)
+        ))
         
         # Format the response
         playlists = []
-        for item in results['items']:
-            # Only include playlists that the user owns and can modify
-            if item['owner']['id'] == sp.current_user()['id']:
-                playlists.append({
-                    'id': item['id'],
-                    'name': item['name'],
-                    'description': item.get('description', ''),
-                    'tracks_total': item['tracks']['total'],
-                    'images': item['images']
-                })
+        for page in [first_page] + pages:
+            for item in page['items']:
+                # Only include playlists that the user owns and can modify
+                if item['owner']['id'] == profile['id']:
+                    playlists.append({
+                        'id': item['id'],
+                        'name': item['name'],
+                        'description': item.get('description', ''),
+                        'tracks_total': item['tracks']['total'],
+                        'images': item['images']
+                    })
         
         return {'playlists': playlists}
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -150,22 +302,22 @@ class PlaylistCreate(BaseModel):
 class AddTracks(BaseModel):
     playlist_id: str
     track_ids: List[str]
+    skip_duplicates: bool = True
 
 @router.post("/create")
-def create_playlist(playlist_data: PlaylistCreate):
+async def create_playlist(playlist_data: PlaylistCreate, user_id: str = Depends(get_current_user)):
     """
     Create a new empty playlist for the current user
     """
     try:
-        sp = get_spotify_client()
+        sp = await get_async_spotify_client(user_id)
         
         # Get the current user's ID
-        user_info = sp.current_user()
-        user_id = user_info['id']
+        user_info = await get_user_profile(sp)
         
         # Create new playlist
-        playlist = sp.user_playlist_create(
-            user=user_id,
+        playlist = await sp.user_playlist_create(
+            user=user_info['id'],
             name=playlist_data.name,
             public=playlist_data.public,
             description=playlist_data.description
@@ -177,6 +329,8 @@ def create_playlist(playlist_data: PlaylistCreate):
             'external_url': playlist['external_urls']['spotify']
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
@@ -191,33 +345,133 @@ def create_playlist(playlist_data: PlaylistCreate):
         content={"error": f"Failed to fetch top artists: {error_msg}"}
     )
 
+# Bulk add settings
+ADD_TRACKS_BATCH_SIZE = 100  # Spotify's maximum per request
+ADD_TRACKS_MAX_ATTEMPTS = int(os.environ.get("ADD_TRACKS_MAX_ATTEMPTS", "5"))
+
+def _is_retryable_add(error):
+    """Rate limits and server errors; anything else (bad ids, missing playlist) fails the same way again"""
+    return error.http_status == 429 or error.http_status >= 500
+
+async def get_playlist_track_ids(sp, playlist_id):
+    """Return (playlist metadata, set of track IDs already in the playlist) using minimal fields"""
+    playlist = await sp.playlist(
+        playlist_id,
+        fields="id,name,external_urls,snapshot_id,tracks(total,offset,items(track(id)))"
+    )
+    pages = iter_playlist_pages(sp, playlist_id, playlist['tracks'], fields="total,offset,items(track(id))")
+    existing = {
+        item['track']['id']
+        async for page in pages
+        for item in page['items']
+        if item['track'] and item['track'].get('id')
+    }
+    return playlist, existing
+
+async def add_tracks_in_batches(sp, playlist_id, track_ids, base_position, start_batch=0, on_progress=None):
+    """
+    Insert track_ids at base_position in batches of ADD_TRACKS_BATCH_SIZE, keeping their order.
+
+    Batches are sent one after another, each at the position right after the previous
+    one, while the next batch's payload is prepared. 429s and 5xx are retried with
+    jittered exponential backoff; once a batch fails the rest are not sent, since they
+    could no longer land in order.
+    start_batch skips batches that an earlier (interrupted) run already added.
+    on_progress(batch_report) is called as each batch completes.
+    Returns one report per batch.
+    """
+    def batch_uris(index):
+        chunk = track_ids[index * ADD_TRACKS_BATCH_SIZE:(index + 1) * ADD_TRACKS_BATCH_SIZE]
+        return [f"spotify:track:{track_id}" for track_id in chunk]
+
+    async def add_batch(index, uris):
+        position = base_position + index * ADD_TRACKS_BATCH_SIZE
+        for attempt in range(1, ADD_TRACKS_MAX_ATTEMPTS + 1):
+            try:
+                return attempt, await sp.playlist_add_items(playlist_id, uris, position=position)
+            except SpotifyAPIError as e:
+                if not _is_retryable_add(e) or attempt == ADD_TRACKS_MAX_ATTEMPTS:
+                    raise
+                await asyncio.sleep(random.uniform(0, SPOTIFY_BACKOFF_BASE * 2 ** attempt))
+
+    batch_count = -(-len(track_ids) // ADD_TRACKS_BATCH_SIZE)
+    reports = []
+    failed = None
+    uris = batch_uris(start_batch) if start_batch < batch_count else []
+    for index in range(start_batch, batch_count):
+        if failed is not None:
+            reports.append({'index': index, 'count': len(batch_uris(index)), 'error': f"Not sent, batch {failed} failed"})
+            continue
+        request = asyncio.ensure_future(add_batch(index, uris))
+        next_uris = batch_uris(index + 1)
+        try:
+            attempts, result = await request
+        except Exception as e:
+            failed = index
+            reports.append({'index': index, 'count': len(uris), 'error': str(e)})
+        else:
+            report = {
+                'index': index,
+                'count': len(uris),
+                'attempts': attempts,
+                'snapshot_id': result.get('snapshot_id') if result else None
+            }
+            if on_progress is not None:
+                on_progress(report)
+            reports.append(report)
+        uris = next_uris
+    return reports
+
+def dedupe_track_ids(track_ids, existing=()):
+    """Drop repeated IDs and IDs already in the playlist, keeping first-seen order"""
+    seen = set(existing)
+    unique = []
+    for track_id in track_ids:
+        if track_id not in seen:
+            seen.add(track_id)
+            unique.append(track_id)
+    return unique
+
 @router.post("/add-tracks")
-def add_tracks(track_data: AddTracks):
+async def add_tracks(track_data: AddTracks, user_id: str = Depends(get_current_user)):
     """
     Add selected tracks to a playlist
+    skip_duplicates: leave out tracks already in the playlist (and repeats in track_ids)
     """
     try:
-        sp = get_spotify_client()
+        sp = await get_async_spotify_client(user_id)
         
-        # Format track IDs as required by Spotify API
-        track_uris = [f"spotify:track:{track_id}" for track_id in track_data.track_ids]
+        # Playlist name, current length and (optionally) existing tracks in one pass
+        if track_data.skip_duplicates:
+            playlist, existing = await get_playlist_track_ids(sp, track_data.playlist_id)
+            track_ids = dedupe_track_ids(track_data.track_ids, existing)
+        else:
+            playlist = await sp.playlist(track_data.playlist_id, fields="id,name,external_urls,snapshot_id,tracks(total)")
+            track_ids = track_data.track_ids
         
-        # Add tracks to playlist (max 100 at a time)
-        for i in range(0, len(track_uris), 100):
-            batch = track_uris[i:i+100]
-            sp.playlist_add_items(track_data.playlist_id, batch)
+        batches = await add_tracks_in_batches(sp, track_data.playlist_id, track_ids, playlist['tracks']['total'])
+        failed = [batch for batch in batches if 'error' in batch]
+        added = sum(batch['count'] for batch in batches if 'error' not in batch)
+        snapshot_ids = [batch['snapshot_id'] for batch in batches if batch.get('snapshot_id')]
         
-        # Get playlist info to return
-        playlist = sp.playlist(track_data.playlist_id)
-        
-        return {
-            'success': True,
-            'message': f"{len(track_data.track_ids)} tracks added to playlist",
+        result = {
+            'success': not failed,
+            'message': f"{added} tracks added to playlist",
             'playlist_id': track_data.playlist_id,
             'playlist_name': playlist['name'],
-            'external_url': playlist['external_urls']['spotify']
+            'external_url': playlist['external_urls']['spotify'],
+            'added': added,
+            'skipped_duplicates': len(track_data.track_ids) - len(track_ids),
+            'snapshot_id': snapshot_ids[-1] if snapshot_ids else playlist.get('snapshot_id'),
+            'batches': batches
         }
+        if failed:
+            result['error'] = f"Failed to add {len(failed)} of {len(batches)} batches"
+            return JSONResponse(status_code=502, content=result)
+        return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Handle case where error might be a dict
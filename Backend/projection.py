@@ -0,0 +1,72 @@
+from fastapi import HTTPException
+
+# Image sizes for image_size=; Spotify lists images largest first
+IMAGE_SIZES = ("small", "medium", "large")
+
+def parse_fields(fields):
+    """
+    Parse a fields= parameter such as "id,name,album.name,artists.id" into a tree
+    ({'id': None, 'album': {'name': None}, ...}); None means keep everything
+    """
+    if not fields:
+        return None
+    tree = {}
+    for path in fields.split(","):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is None:
+                # "album" and "album.name" together: the whole album wins
+                if part in node:
+                    break
+                child = node[part] = {}
+            node = child
+        else:
+            node[parts[-1]] = None
+    return tree or None
+
+def _pick_image(images, image_size):
+    if not images:
+        return images
+    index = {"large": 0, "medium": len(images) // 2, "small": -1}[image_size]
+    return [images[index]]
+
+def _project(value, tree, image_size):
+    if isinstance(value, list):
+        return [_project(item, tree, image_size) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    projected = {}
+    for key, item in value.items():
+        if tree is not None:
+            if key not in tree:
+                continue
+            subtree = tree[key]
+        else:
+            subtree = None
+        if key == "images" and image_size is not None:
+            projected[key] = _pick_image(item, image_size)
+        elif subtree is not None or (image_size is not None and isinstance(item, (dict, list))):
+            projected[key] = _project(item, subtree, image_size)
+        else:
+            # Shared with cached data; never modified in place
+            projected[key] = item
+    return projected
+
+def projector(fields=None, image_size=None):
+    """
+    Return a function that copies items keeping only the requested fields and,
+    with image_size, a single image per images list; None when nothing to do.
+    Cached items are never modified.
+    """
+    if image_size is not None and image_size not in IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"image_size must be one of {', '.join(IMAGE_SIZES)}")
+    tree = parse_fields(fields)
+    if tree is None and image_size is None:
+        return None
+    return lambda items: _project(items, tree, image_size)
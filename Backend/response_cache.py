@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from fastapi.concurrency import run_in_threadpool
+from db import get_cached_response, store_cached_response
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# How long cached responses stay fresh, per time_range (seconds)
+CACHE_TTLS = {
+    "short_term": int(os.environ.get("CACHE_TTL_SHORT_TERM", "3600")),
+    "medium_term": int(os.environ.get("CACHE_TTL_MEDIUM_TERM", "21600")),
+    "long_term": int(os.environ.get("CACHE_TTL_LONG_TERM", "86400")),
+}
+CACHE_DEFAULT_TTL = int(os.environ.get("CACHE_DEFAULT_TTL", "3600"))
+# After going stale, an entry is still served (and refreshed in the background) for this many seconds
+CACHE_STALE_SECONDS = int(os.environ.get("CACHE_STALE_SECONDS", "3600"))
+# "memory" keeps entries in this process; "postgres" shares them between workers
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+def cache_key(user_id, endpoint, time_range, limit):
+    return f"{user_id}:{endpoint}:{time_range}:{limit}"
+
+def ttl_for(time_range):
+    return CACHE_TTLS.get(time_range, CACHE_DEFAULT_TTL)
+
+class MemoryCacheBackend:
+    """In-process LRU cache capped by the approximate JSON size of its entries"""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, fresh_until, stale_until, size)
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[:3]
+
+    async def set(self, key, value, fresh_until, stale_until):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[3]
+            self._entries[key] = (value, fresh_until, stale_until, size)
+            self.total_bytes += size
+            # Evict least recently used entries until we are back under the cap
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted[3]
+                self.evictions += 1
+
+class PostgresCacheBackend:
+    """Cache stored in the response_cache table so every worker shares it"""
+
+    async def get(self, key):
+        return await run_in_threadpool(get_cached_response, key)
+
+    async def set(self, key, value, fresh_until, stale_until):
+        await run_in_threadpool(store_cached_response, key, value, fresh_until, stale_until)
+
+class ResponseCache:
+    """
+    Read-through response cache with stale-while-revalidate.
+    Concurrent misses (or revalidations) for the same key share one fetch.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "errors": 0}
+        self._inflight = {}
+
+    async def get_or_fetch(self, key, ttl, fetch):
+        """
+        Return the cached value for key, calling the async fetch() to fill it.
+        Stale entries are returned immediately while a refresh runs in the background.
+        """
+        try:
+            entry = await self.backend.get(key)
+        except Exception as e:
+            # A broken cache backend should never take the endpoint down
+            logger.warning("Response cache read failed: %s", e)
+            self.stats["errors"] += 1
+            entry = None
+
+        now = time.time()
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.stats["hits"] += 1
+                return value
+            if now < stale_until:
+                self.stats["stale_hits"] += 1
+                self._refresh(key, ttl, fetch)
+                return value
+
+        self.stats["misses"] += 1
+        # Shield so one cancelled request doesn't cancel the fetch for everyone else
+        return await asyncio.shield(self._refresh(key, ttl, fetch))
+
+    def _refresh(self, key, ttl, fetch):
+        """Start (or join) the fetch for key and return its task"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(key, ttl, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+
+    async def _fetch_and_store(self, key, ttl, fetch):
+        value = await fetch()
+        now = time.time()
+        try:
+            await self.backend.set(key, value, now + ttl, now + ttl + CACHE_STALE_SECONDS)
+        except Exception as e:
+            logger.warning("Response cache write failed: %s", e)
+            self.stats["errors"] += 1
+        return value
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        if isinstance(self.backend, MemoryCacheBackend):
+            stats["bytes"] = self.backend.total_bytes
+            stats["evictions"] = self.backend.evictions
+        return stats
+
+def _create_backend():
+    if RESPONSE_CACHE_BACKEND == "postgres":
+        return PostgresCacheBackend()
+    return MemoryCacheBackend()
+
+# Shared cache used by the routers
+response_cache = ResponseCache(_create_backend())
+register_collector(lambda: {f"response_cache_{name}": value for name, value in response_cache.get_stats().items()})
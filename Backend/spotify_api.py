@@ -0,0 +1,329 @@
+import os
+import time
+import random
+import asyncio
+from urllib.parse import urlsplit
+from fastapi import HTTPException
+from metrics import spotify_requests, spotify_latency, register_collector
+
+# Spotify Web API settings (the base URL can point at a local mock server)
+SPOTIFY_API_BASE = os.environ.get("SPOTIFY_API_BASE", "https://api.spotify.com/v1")
+SPOTIFY_TIMEOUT = float(os.environ.get("SPOTIFY_TIMEOUT", "10"))
+SPOTIFY_MAX_CONNECTIONS = int(os.environ.get("SPOTIFY_MAX_CONNECTIONS", "200"))
+SPOTIFY_MAX_KEEPALIVE = int(os.environ.get("SPOTIFY_MAX_KEEPALIVE", "50"))
+
+# Request scheduler settings
+SPOTIFY_RATE_LIMIT = float(os.environ.get("SPOTIFY_RATE_LIMIT", "20"))  # sustained requests per second
+SPOTIFY_RATE_BURST = int(os.environ.get("SPOTIFY_RATE_BURST", "40"))
+SPOTIFY_MAX_RETRIES = int(os.environ.get("SPOTIFY_MAX_RETRIES", "3"))
+SPOTIFY_BACKOFF_BASE = float(os.environ.get("SPOTIFY_BACKOFF_BASE", "0.5"))  # seconds
+SPOTIFY_MAX_RETRY_AFTER = int(os.environ.get("SPOTIFY_MAX_RETRY_AFTER", "30"))  # give up instead of waiting longer
+
+# One HTTP client (and connection pool) shared by every request in this process
+_http_client = None
+
+def get_http_client():
+    """Return the shared keep-alive HTTP client, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # httpx is imported on first use rather than at startup
+        import httpx
+        _http_client = httpx.AsyncClient(
+            base_url=SPOTIFY_API_BASE,
+            timeout=SPOTIFY_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=SPOTIFY_MAX_CONNECTIONS,
+                max_keepalive_connections=SPOTIFY_MAX_KEEPALIVE,
+            ),
+        )
+    return _http_client
+
+async def close_http_client():
+    """Close the shared HTTP client (called on app shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+class SpotifyAPIError(Exception):
+    """Error response from the Spotify Web API"""
+
+    def __init__(self, http_status, msg, retry_after=None):
+        super().__init__(f"http status: {http_status}, {msg}")
+        self.http_status = http_status
+        self.msg = msg
+        self.retry_after = retry_after
+
+class SpotifyRateLimitError(HTTPException):
+    """Spotify kept answering 429; passed through to the client as a 429"""
+
+    def __init__(self, retry_after):
+        super().__init__(
+            status_code=429,
+            detail="Spotify rate limit reached, please retry shortly",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.retry_after = retry_after
+
+class SpotifyScheduler:
+    """
+    Central gate for every Spotify Web API call in this process.
+    - token bucket: at most SPOTIFY_RATE_LIMIT requests/s with bursts of SPOTIFY_RATE_BURST
+    - a 429 pauses all requests until its Retry-After has passed
+    - retries with jittered exponential backoff (5xx and network errors only for GETs)
+    - identical in-flight GETs (same user, URL and params) share one upstream call
+    """
+
+    def __init__(self, rate=SPOTIFY_RATE_LIMIT, burst=SPOTIFY_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self._inflight = {}
+        self.stats = {
+            "requests": 0,
+            "queue_depth": 0,
+            "throttled": 0,
+            "retries": 0,
+            "coalesced": 0,
+            "rate_limit_failures": 0,
+        }
+
+    async def _acquire(self):
+        """Wait for a token from the bucket (and for any Retry-After pause to end)"""
+        self.stats["queue_depth"] += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self._blocked_until:
+                        await asyncio.sleep(self._blocked_until - now)
+                        continue
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self.stats["queue_depth"] -= 1
+
+    def _throttle(self, retry_after):
+        self.stats["throttled"] += 1
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    async def submit(self, key, send, method):
+        """
+        Run send() under the scheduler.
+        GET requests with the same key are coalesced into a single upstream call.
+        """
+        if method != "GET":
+            return await self._run(send, method)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(send, method))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # Shield so one cancelled caller doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _run(self, send, method):
+        import httpx
+        attempt = 0
+        while True:
+            await self._acquire()
+            self.stats["requests"] += 1
+            try:
+                return await send()
+            except SpotifyAPIError as e:
+                if e.http_status == 429:
+                    retry_after = e.retry_after if e.retry_after is not None else 1
+                    self._throttle(retry_after)
+                    if attempt >= SPOTIFY_MAX_RETRIES or retry_after > SPOTIFY_MAX_RETRY_AFTER:
+                        self.stats["rate_limit_failures"] += 1
+                        raise SpotifyRateLimitError(retry_after)
+                    # The pause itself is enforced by _acquire; just add jitter
+                    await asyncio.sleep(random.uniform(0, SPOTIFY_BACKOFF_BASE))
+                elif e.http_status >= 500 and method == "GET" and attempt < SPOTIFY_MAX_RETRIES:
+                    await asyncio.sleep(random.uniform(0, SPOTIFY_BACKOFF_BASE * 2 ** attempt))
+                else:
+                    raise
+            except httpx.TransportError:
+                if method != "GET" or attempt >= SPOTIFY_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(random.uniform(0, SPOTIFY_BACKOFF_BASE * 2 ** attempt))
+            except asyncio.CancelledError:
+                # GETs run in their own task (see submit), which nothing here cancels. Under load,
+                # anyio 3 can leak the cancellation it uses to end connect_tcp into the task that
+                # opened the connection; retry rather than fail every caller sharing the call.
+                if method != "GET" or attempt >= SPOTIFY_MAX_RETRIES:
+                    raise
+            attempt += 1
+            self.stats["retries"] += 1
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["in_flight"] = len(self._inflight)
+        stats["throttled_for"] = max(self._blocked_until - time.monotonic(), 0)
+        return stats
+
+# Every AsyncSpotify instance goes through this scheduler
+scheduler = SpotifyScheduler()
+register_collector(lambda: {f"spotify_scheduler_{name}": value for name, value in scheduler.get_stats().items()})
+
+# Path segments kept as-is in metric labels; anything else (IDs) becomes {id}
+_STATIC_SEGMENTS = {
+    "v1", "me", "top", "artists", "tracks", "player", "recently-played", "currently-playing",
+    "playlists", "users", "albums", "audio-features", "browse", "search",
+}
+
+def _endpoint_label(url):
+    """Turn a request URL into a bounded label such as /playlists/{id}/tracks"""
+    path = urlsplit(url).path
+    segments = [
+        segment if segment in _STATIC_SEGMENTS else "{id}"
+        for segment in path.split("/") if segment and segment != "v1"
+    ]
+    return "/" + "/".join(segments)
+
+class AsyncSpotify:
+    """
+    Minimal asyncio Spotify Web API client.
+    Method names mirror spotipy so routers read the same way.
+    """
+
+    def __init__(self, access_token, user_id=None):
+        self.access_token = access_token
+        self.user_id = user_id
+
+    async def _request(self, method, url, params=None, payload=None):
+        # Drop unset parameters so they don't show up as "None" in the query string
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+
+        async def send():
+            return await self._send(method, url, params, payload)
+
+        key = (self.user_id or self.access_token, url, tuple(sorted((params or {}).items())))
+        return await scheduler.submit(key, send, method)
+
+    async def _send(self, method, url, params, payload):
+        import httpx
+        endpoint = _endpoint_label(url)
+        start = time.perf_counter()
+        try:
+            response = await get_http_client().request(
+                method,
+                url,
+                params=params,
+                json=payload,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+            )
+        except httpx.TransportError:
+            spotify_requests.inc(endpoint=endpoint, method=method, status="error")
+            raise
+        finally:
+            spotify_latency.observe(time.perf_counter() - start, endpoint=endpoint)
+        spotify_requests.inc(endpoint=endpoint, method=method, status=response.status_code)
+
+        if response.status_code >= 400:
+            try:
+                msg = response.json()["error"]["message"]
+            except Exception:
+                msg = response.text or response.reason_phrase
+            retry_after = response.headers.get("Retry-After")
+            raise SpotifyAPIError(
+                response.status_code,
+                msg,
+                retry_after=int(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+    async def _get(self, url, **params):
+        return await self._request("GET", url, params=params)
+
+    async def _post(self, url, payload=None, **params):
+        return await self._request("POST", url, params=params, payload=payload)
+
+    async def _delete(self, url, payload=None, **params):
+        return await self._request("DELETE", url, params=params, payload=payload)
+
+    async def next(self, result):
+        """Fetch the next page of a paginated result"""
+        if result.get("next"):
+            return await self._get(result["next"])
+        return None
+
+    async def current_user(self):
+        return await self._get("/me")
+
+    async def current_user_top_artists(self, limit=20, offset=0, time_range="medium_term"):
+        return await self._get("/me/top/artists", time_range=time_range, limit=limit, offset=offset)
+
+    async def current_user_top_tracks(self, limit=20, offset=0, time_range="medium_term"):
+        return await self._get("/me/top/tracks", time_range=time_range, limit=limit, offset=offset)
+
+    async def current_user_recently_played(self, limit=50, after=None, before=None):
+        return await self._get("/me/player/recently-played", limit=limit, after=after, before=before)
+
+    async def current_playback(self, market=None):
+        return await self._get("/me/player", market=market)
+
+    async def current_user_playlists(self, limit=50, offset=0):
+        return await self._get("/me/playlists", limit=limit, offset=offset)
+
+    async def artists(self, artists):
+        """Several artists in one call (at most 50 ids)"""
+        return await self._get("/artists", ids=",".join(artists))
+
+    async def albums(self, albums, market=None):
+        """Several albums in one call (at most 20 ids)"""
+        return await self._get("/albums", ids=",".join(albums), market=market)
+
+    async def tracks(self, tracks, market=None):
+        """Several tracks in one call (at most 50 ids)"""
+        return await self._get("/tracks", ids=",".join(tracks), market=market)
+
+    async def playlist(self, playlist_id, fields=None, market=None):
+        return await self._get(f"/playlists/{playlist_id}", fields=fields, market=market)
+
+    async def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, market=None):
+        return await self._get(
+            f"/playlists/{playlist_id}/tracks",
+            fields=fields,
+            limit=limit,
+            offset=offset,
+            market=market,
+        )
+
+    async def user_playlist_create(self, user, name, public=True, collaborative=False, description=""):
+        return await self._post(
+            f"/users/{user}/playlists",
+            payload={
+                "name": name,
+                "public": public,
+                "collaborative": collaborative,
+                "description": description,
+            },
+        )
+
+    async def playlist_add_items(self, playlist_id, items, position=None):
+        payload = {"uris": items}
+        if position is not None:
+            payload["position"] = position
+        return await self._post(f"/playlists/{playlist_id}/tracks", payload=payload)
+
+    async def playlist_remove_specific_occurrences_of_items(self, playlist_id, items, snapshot_id=None):
+        """Remove tracks at given positions; items are [{"uri": ..., "positions": [...]}] (at most 100)"""
+        payload = {"tracks": items}
+        if snapshot_id is not None:
+            payload["snapshot_id"] = snapshot_id
+        return await self._delete(f"/playlists/{playlist_id}/tracks", payload=payload)
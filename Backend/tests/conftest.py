@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Backend modules import each other by bare name, as they do when run from Backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "postgresql://unused/tests")
@@ -0,0 +1,98 @@
+"""
+Authorization code handling in /callback, with the database and Spotify replaced by
+in-memory fakes. Run from Backend/: python -m pytest tests
+"""
+import time
+import threading
+import pytest
+import spotipy
+import auth
+
+CODE = "test-code"
+
+class FakeOAuth:
+    def __init__(self):
+        self.exchanges = 0
+        self._lock = threading.Lock()
+
+    def get_access_token(self, code, check_cache=False):
+        with self._lock:
+            self.exchanges += 1
+        return {"access_token": "access", "refresh_token": "refresh", "expires_in": 3600, "expires_at": int(time.time()) + 3600}
+
+class FakeSpotify:
+    def __init__(self, auth=None):
+        pass
+
+    def current_user(self):
+        return {"id": "user-1"}
+
+class FakeUsedCodes:
+    """used_codes table: INSERT ... ON CONFLICT DO NOTHING RETURNING 1"""
+
+    def __init__(self):
+        self.codes = set()
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def claim(self, code):
+        time.sleep(0.01)  # widen the window between concurrent callbacks
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        with self._lock:
+            if code in self.codes:
+                return False
+            self.codes.add(code)
+            return True
+
+@pytest.fixture
+def fakes(monkeypatch):
+    oauth = FakeOAuth()
+    used_codes = FakeUsedCodes()
+    monkeypatch.setattr(auth, "get_sp_oauth", lambda: oauth)
+    monkeypatch.setattr(auth, "claim_code", used_codes.claim)
+    monkeypatch.setattr(auth, "store_token", lambda user_id, token_info: None)
+    monkeypatch.setattr(auth, "create_session", lambda user_id: "session-1")
+    monkeypatch.setattr(auth, "enroll_history_user", lambda user_id: None)
+    monkeypatch.setattr(spotipy, "Spotify", FakeSpotify)
+    monkeypatch.setattr(auth, "_recent_codes", {})
+    return oauth, used_codes
+
+def callback():
+    return auth.callback(CODE, None)
+
+def test_concurrent_callbacks_exchange_once(fakes):
+    oauth, _ = fakes
+    callers = 8
+    barrier = threading.Barrier(callers)
+    statuses = []
+
+    def run():
+        barrier.wait()
+        statuses.append(callback().status_code)
+
+    threads = [threading.Thread(target=run) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert oauth.exchanges == 1
+    assert sorted(statuses) == [307] + [400] * (callers - 1)
+
+def test_code_used_on_another_worker_is_rejected(fakes, monkeypatch):
+    oauth, _ = fakes
+    assert callback().status_code == 307
+    # A different worker has no memory of the code; the database claim rejects it
+    monkeypatch.setattr(auth, "_recent_codes", {})
+    assert callback().status_code == 400
+    assert oauth.exchanges == 1
+
+def test_failed_database_claim_can_be_retried(fakes):
+    oauth, used_codes = fakes
+    used_codes.failures = 1
+    assert callback().status_code == 503
+    assert CODE not in auth._recent_codes
+    assert callback().status_code == 307
+    assert oauth.exchanges == 1
@@ -10,6 +10,7 @@ const Callback = () => {
   useEffect(() => {
     const urlParams = new URLSearchParams(window.location.search);
     const token = urlParams.get("token");
+    const sessionId = urlParams.get("session");
     const errorParam = urlParams.get("error");
 
     if (errorParam) {
@@ -19,7 +20,7 @@ const Callback = () => {
 
     // Direct token handling
     if (token) {
-      login(token);
+      login(token, sessionId);
       navigate("/");
       return;
     }
@@ -42,7 +43,7 @@ const Callback = () => {
         return res.json();
       })
       .then((data) => {
-        login(data.access_token);
+        login(data.access_token, data.session);
         navigate("/");
       })
       .catch((err) => {
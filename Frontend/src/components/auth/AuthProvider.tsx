@@ -9,10 +9,12 @@ import {
 interface AuthContextType {
   token: string | null;
   isAuthenticated: boolean;
-  login: (token: string) => void;
+  login: (token: string, sessionId?: string | null) => void;
   logout: () => void;
 }
 
+const API_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
+
 const AuthContext = createContext<AuthContextType | null>(null);
 
 export const useAuth = () => {
@@ -36,14 +38,26 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
     }
   }, []);
 
-  const login = (newToken: string) => {
+  const login = (newToken: string, sessionId?: string | null) => {
     localStorage.setItem("access_token", newToken);
+    if (sessionId) {
+      localStorage.setItem("session_id", sessionId);
+    }
     setToken(newToken);
     setIsAuthenticated(true);
   };
 
   const logout = () => {
+    // End the backend session as well; nothing to wait for
+    const sessionId = localStorage.getItem("session_id");
+    if (sessionId) {
+      fetch(`${API_URL}/logout`, {
+        method: "POST",
+        headers: { "X-Session-Id": sessionId },
+      }).catch(() => {});
+    }
     localStorage.removeItem("access_token");
+    localStorage.removeItem("session_id");
     setToken(null);
     setIsAuthenticated(false);
   };
@@ -3,7 +3,7 @@ import Card from "../common/Card";
 import { useNowPlaying } from "../../hooks/useSpotifyData";
 
 const NowPlayingCard = () => {
-  const { data, loading, error } = useNowPlaying(7500); // Poll API every 5 seconds
+  const { data, loading, error } = useNowPlaying(); // Updates pushed by the server
   const [audioPlaying, setAudioPlaying] = useState(false);
   const [audio] = useState(new Audio());
   const [localProgress, setLocalProgress] = useState(0);
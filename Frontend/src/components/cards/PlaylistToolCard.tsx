@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import Card from "../common/Card";
-import { usePlaylistTool } from "../../hooks/useSpotifyData";
+import { usePlaylistTool, sessionHeaders } from "../../hooks/useSpotifyData";
 
 const API_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
 interface UserPlaylist {
@@ -58,7 +58,9 @@ const PlaylistToolCard = () => {
   const fetchUserPlaylists = async () => {
     setIsLoadingPlaylists(true);
     try {
-      const response = await fetch(`${API_URL}/api/playlist/user-playlists`);
+      const response = await fetch(`${API_URL}/api/playlist/user-playlists`, {
+        headers: sessionHeaders(),
+      });
       const data = await response.json();
 
       if (!response.ok) {
@@ -129,6 +131,7 @@ const PlaylistToolCard = () => {
             method: "POST",
             headers: {
               "Content-Type": "application/json",
+              ...sessionHeaders(),
             },
             body: JSON.stringify({
               playlist_id: selectedExistingPlaylist,
@@ -9,6 +9,12 @@ import {
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
 
+// Session header identifying the logged-in user to the backend
+export const sessionHeaders = (): Record<string, string> => {
+  const sessionId = localStorage.getItem("session_id");
+  return sessionId ? { "X-Session-Id": sessionId } : {};
+};
+
 interface ApiResponse<T> {
   data: T | null;
   loading: boolean;
@@ -29,7 +35,8 @@ export function useTopArtists(
     const fetchData = async () => {
       try {
         const response = await fetch(
-          `${API_BASE_URL}/api/top-artists?time_range=${timeRange}&limit=${limit}`
+          `${API_BASE_URL}/api/top-artists?time_range=${timeRange}&limit=${limit}`,
+          { headers: sessionHeaders() }
         );
         const data = await response.json();
 
@@ -67,7 +74,8 @@ export function useTopTracks(
     const fetchData = async () => {
       try {
         const response = await fetch(
-          `${API_BASE_URL}/api/top-tracks?time_range=${timeRange}&limit=${limit}`
+          `${API_BASE_URL}/api/top-tracks?time_range=${timeRange}&limit=${limit}`,
+          { headers: sessionHeaders() }
         );
         const data = await response.json();
 
@@ -101,7 +109,9 @@ export function useListeningStats(): ApiResponse<ListeningStats> {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const response = await fetch(`${API_BASE_URL}/api/listening-stats`);
+        const response = await fetch(`${API_BASE_URL}/api/listening-stats`, {
+          headers: sessionHeaders(),
+        });
         const data = await response.json();
 
         if (response.ok) {
@@ -124,9 +134,9 @@ export function useListeningStats(): ApiResponse<ListeningStats> {
   return state;
 }
 
-export function useNowPlaying(
-  pollingInterval = 10000 // Poll every 10 seconds by default
-): ApiResponse<NowPlaying> {
+// Subscribes to the server's now-playing stream; the backend polls Spotify
+// once per user and pushes changes to every open tab
+export function useNowPlaying(): ApiResponse<NowPlaying> {
   const [state, setState] = useState<ApiResponse<NowPlaying>>({
     data: null,
     loading: true,
@@ -134,34 +144,32 @@ export function useNowPlaying(
   });
 
   useEffect(() => {
-    const fetchData = async () => {
-      try {
-        const response = await fetch(`${API_BASE_URL}/api/now-playing`);
-        const data = await response.json();
+    // EventSource can't send headers, so the session goes in the query string
+    const sessionId = localStorage.getItem("session_id") || "";
+    const source = new EventSource(
+      `${API_BASE_URL}/api/now-playing/stream?session=${encodeURIComponent(
+        sessionId
+      )}`
+    );
+
+    source.onmessage = (event) => {
+      setState({ data: JSON.parse(event.data), loading: false, error: null });
+    };
 
-        if (response.ok) {
-          setState({ data, loading: false, error: null });
-        } else {
-          setState({
-            data: null,
-            loading: false,
-            error: data.error || "Failed to fetch currently playing track",
-          });
-        }
-      } catch (error) {
-        setState({ data: null, loading: false, error: "Network error" });
+    source.onerror = () => {
+      // The browser reconnects on its own unless the server refused the stream
+      if (source.readyState === EventSource.CLOSED) {
+        setState({
+          data: null,
+          loading: false,
+          error: "Failed to fetch currently playing track",
+        });
       }
     };
 
-    // Initial fetch
-    fetchData();
-
-    // Set up polling
-    const intervalId = setInterval(fetchData, pollingInterval);
-
-    // Clean up on unmount
-    return () => clearInterval(intervalId);
-  }, [pollingInterval]);
+    // Close the stream on unmount
+    return () => source.close();
+  }, []);
 
   return state;
 }
@@ -184,15 +192,46 @@ export function usePlaylistTool() {
       const response = await fetch(
         `${API_BASE_URL}/api/playlist/fetch?playlist_input=${encodeURIComponent(
           playlistInput
-        )}`
+        )}&stream=true`,
+        { headers: sessionHeaders() }
       );
-      const data = await response.json();
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
+        const data = await response.json();
         throw new Error(data.error || "Failed to fetch playlist");
       }
 
-      setPlaylistData(data);
+      // Read NDJSON lines: playlist metadata first, then tracks as they arrive
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let playlist: PlaylistData["playlist"] | null = null;
+      const tracks: PlaylistData["tracks"] = [];
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop() || "";
+
+        for (const line of lines) {
+          if (!line) continue;
+          const message = JSON.parse(line);
+          if (message.error) {
+            throw new Error(message.error);
+          } else if (message.playlist) {
+            playlist = message.playlist;
+          } else if (message.track) {
+            tracks.push(message.track);
+          }
+        }
+
+        if (playlist) {
+          setPlaylistData({ playlist, tracks: [...tracks] });
+        }
+      }
     } catch (err) {
       setError(err instanceof Error ? err.message : "An error occurred");
     } finally {
@@ -228,6 +267,7 @@ export function usePlaylistTool() {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
+            ...sessionHeaders(),
           },
           body: JSON.stringify({
             name,
@@ -250,6 +290,7 @@ export function usePlaylistTool() {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
+            ...sessionHeaders(),
           },
           body: JSON.stringify({
             playlist_id: createData.id,